@@ -0,0 +1,407 @@
+"""
+Benchmark Suite for the DHT hot paths
+Measures, for each network size, the join throughput, the search and store
+throughput of Chord, Pastry and Kademlia, the repair cost after a mass
+failure, the memory per node and the latency of the Network primitives. Setup
+is kept out of the timings, and the workloads are seeded, so that runs are
+comparable.
+
+Results are written as JSON. If a baseline JSON is given, the ratio of every
+metric to the baseline is reported as well.
+"""
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import platform
+import tempfile
+import tracemalloc
+from chord_node import ChordNode
+from pastry_node import PastryNode
+from pastry_builder import build_overlay
+from kademlia_node import KademliaNode, build_buckets, hash_key
+from modules.network import Network
+
+if len(sys.argv) < 2:
+    print('Usage: python benchmark.py <output-json> [<baseline-json>]')
+    sys.exit(0)
+
+output_file = sys.argv[1]
+baseline_file = sys.argv[2] if len(sys.argv) > 2 else None
+
+sizes = [1000, 10000, 100000]
+seed = 1
+m = 24
+l = 6
+b = 4
+num_joins = 1000
+num_lookups = 10000
+num_stores = 10000
+num_network_calls = 100000
+failure_fraction = 0.2
+# Relative change below which a metric is reported as unchanged
+noise = 0.05
+
+# Metrics for which a lower value is better
+LOWER_IS_BETTER = ('seconds', 'bytes', 'latency')
+
+
+def hash_int(integer, bits):
+    """Hash the given integer and trim to the given number of bits
+
+    Arguments:
+        integer {Integer}
+        bits {Integer}
+
+    Returns:
+        String -- hex string of the hash
+    """
+    name = str(integer)
+    node_hash = int(hashlib.sha1(name.encode('utf-8')).hexdigest(), 16)
+    return format(node_hash >> (160 - bits), '0' + str((bits + 3) // 4) + 'x')
+
+
+def timed(function, count):
+    """Time count calls of function, given the index of the call
+
+    Arguments:
+        function {Function}
+        count {Integer}
+
+    Returns:
+        Float -- Elapsed seconds
+    """
+    start = time.perf_counter()
+    for index in range(count):
+        function(index)
+    return time.perf_counter() - start
+
+
+def new_network(num_switches):
+    """Create a seeded network, keeping its links out of the repository
+
+    Arguments:
+        num_switches {Integer}
+
+    Returns:
+        Network
+    """
+    random.seed(seed)
+    with tempfile.TemporaryDirectory() as directory:
+        return Network(num_switches,
+                       file_name=os.path.join(directory, 'links.dat'))
+
+
+def bench_chord(n):
+    """Run the Chord benchmarks on a ring of n nodes
+
+    Arguments:
+        n {Integer} -- Number of nodes
+
+    Returns:
+        Dict -- Metrics
+    """
+    network = new_network(n + num_joins)
+    tracemalloc.start()
+    nodes = []
+    for i in range(2 * n):
+        node = ChordNode(i, hash_int(i, m), network, m)
+        if network.add_node(node):
+            node.join(fast=True)
+            nodes.append(node.get_num())
+        if len(nodes) == n:
+            break
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    def join(index):
+        node = ChordNode(2 * n + index, hash_int(2 * n + index, m), network,
+                         m)
+        if network.add_node(node):
+            node.join(fast=True)
+
+    join_seconds = timed(join, num_joins)
+
+    random.seed(seed)
+    sources = [network.get_node(random.choice(nodes))
+               for _ in range(num_lookups)]
+    store_seconds = timed(
+        lambda index: sources[index % num_lookups].store_key(index, index),
+        num_stores)
+    lookup_seconds = timed(lambda index: sources[index].search(index),
+                           num_lookups)
+
+    # Mass departure: each node leaves through depart_network
+    failed = random.sample(nodes, int(failure_fraction * n))
+    start = time.perf_counter()
+    for node in failed:
+        network.get_node(node).depart_network()
+    repair_seconds = time.perf_counter() - start
+    alive = [node for node in nodes if network.is_alive(node)]
+    sources = [network.get_node(random.choice(alive))
+               for _ in range(num_lookups)]
+    found = [0]
+
+    def search(index):
+        if sources[index].search(index)[1] == index:
+            found[0] += 1
+
+    lookup_after_seconds = timed(search, num_lookups)
+    return {
+        'join_per_second': num_joins / join_seconds,
+        'lookup_per_second': num_lookups / lookup_seconds,
+        'store_per_second': num_stores / store_seconds,
+        'depart_seconds': repair_seconds,
+        'search_after_departure_per_second':
+        num_lookups / lookup_after_seconds,
+        'search_after_departure_success': found[0] / num_lookups,
+        'memory_bytes_per_node': memory / n,
+    }
+
+
+def bench_pastry(n):
+    """Run the Pastry benchmarks on an overlay of n nodes, built offline
+
+    Arguments:
+        n {Integer} -- Number of nodes
+
+    Returns:
+        Dict -- Metrics
+    """
+    network = new_network(n + num_joins)
+    tracemalloc.start()
+    added = []
+    for i in range(2 * n):
+        node = PastryNode(i, hash_int(i, l * b), network, l, b)
+        if network.add_node(node):
+            added.append(node)
+        if len(added) == n:
+            break
+    build_overlay(network, added, l, b)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    nodes = [node.get_num() for node in added]
+    del added
+
+    def join(index):
+        node = PastryNode(2 * n + index, hash_int(2 * n + index, l * b),
+                          network, l, b)
+        if network.add_node(node):
+            node.join()
+
+    join_seconds = timed(join, num_joins)
+
+    random.seed(seed)
+    sources = [network.get_node(random.choice(nodes))
+               for _ in range(num_lookups)]
+    store_seconds = timed(
+        lambda index: sources[index % num_lookups].put(index, index),
+        num_stores)
+    lookup_seconds = timed(lambda index: sources[index].search(index),
+                           num_lookups)
+
+    # Mass failure: nodes crash silently, and are found by a heartbeat pass
+    failed = random.sample(nodes, int(failure_fraction * n))
+    for node in failed:
+        network.remove_node(node)
+    alive = [node for node in nodes if network.is_alive(node)]
+    start = time.perf_counter()
+    for node in alive:
+        network.get_node(node).heartbeat()
+    repair_seconds = time.perf_counter() - start
+    sources = [network.get_node(random.choice(alive))
+               for _ in range(num_lookups)]
+    found = [0]
+
+    def get(index):
+        if sources[index].get(index)[1] == index:
+            found[0] += 1
+
+    lookup_after_seconds = timed(get, num_lookups)
+    return {
+        'join_per_second': num_joins / join_seconds,
+        'lookup_per_second': num_lookups / lookup_seconds,
+        'store_per_second': num_stores / store_seconds,
+        'heartbeat_seconds': repair_seconds,
+        'get_after_crash_per_second':
+        num_lookups / lookup_after_seconds,
+        'get_after_crash_success': found[0] / num_lookups,
+        'memory_bytes_per_node': memory / n,
+    }
+
+
+def bench_kademlia(n):
+    """Run the Kademlia benchmarks on an overlay of n nodes, with k-buckets
+    filled offline
+
+    Arguments:
+        n {Integer} -- Number of nodes
+
+    Returns:
+        Dict -- Metrics
+    """
+    network = new_network(n + num_joins)
+    tracemalloc.start()
+    added = []
+    for i in range(2 * n):
+        node = KademliaNode(i, hash_int(i, m), network, m)
+        if network.add_node(node):
+            added.append(node)
+        if len(added) == n:
+            break
+    build_buckets(network, added, seed=seed)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    nodes = [node.get_num() for node in added]
+    del added
+
+    def join(index):
+        node = KademliaNode(2 * n + index, hash_int(2 * n + index, m),
+                            network, m)
+        if network.add_node(node):
+            node.join()
+
+    join_seconds = timed(join, num_joins)
+
+    random.seed(seed)
+    sources = [network.get_node(random.choice(nodes))
+               for _ in range(num_lookups)]
+    store_seconds = timed(
+        lambda index: sources[index % num_lookups].put(index, index),
+        num_stores)
+    key_hashes = [hash_key(index) for index in range(num_lookups)]
+    lookup_seconds = timed(
+        lambda index: sources[index].lookup(key_hashes[index]), num_lookups)
+
+    # Mass failure: nodes crash silently, and are dropped by a bucket refresh
+    failed = random.sample(nodes, int(failure_fraction * n))
+    for node in failed:
+        network.remove_node(node)
+    alive = [node for node in nodes if network.is_alive(node)]
+    start = time.perf_counter()
+    for node in alive:
+        network.get_node(node).refresh()
+    repair_seconds = time.perf_counter() - start
+    sources = [network.get_node(random.choice(alive))
+               for _ in range(num_lookups)]
+    found = [0]
+
+    def get(index):
+        if sources[index].get(index)[1] == index:
+            found[0] += 1
+
+    lookup_after_seconds = timed(get, num_lookups)
+    return {
+        'join_per_second': num_joins / join_seconds,
+        'lookup_per_second': num_lookups / lookup_seconds,
+        'store_per_second': num_stores / store_seconds,
+        'refresh_seconds': repair_seconds,
+        'get_after_crash_per_second':
+        num_lookups / lookup_after_seconds,
+        'get_after_crash_success': found[0] / num_lookups,
+        'memory_bytes_per_node': memory / n,
+    }
+
+
+def bench_network(n):
+    """Measure the latency of Network.hop and Network.proximity
+
+    Arguments:
+        n {Integer} -- Number of nodes (and switches)
+
+    Returns:
+        Dict -- Metrics
+    """
+    network = new_network(2 * n)
+    for i in range(n):
+        network.add_node(ChordNode(i, hash_int(i, m), network, m))
+    random.seed(seed)
+    nodes = list(network.nodes)
+    pairs = [(random.choice(nodes), random.choice(nodes))
+             for _ in range(num_network_calls)]
+    proximity_seconds = timed(
+        lambda index: network.proximity(pairs[index][0], pairs[index][1]),
+        num_network_calls)
+    num_hops = num_network_calls // 100
+    hop_seconds = timed(lambda index: network.hop(pairs[index][0], 3),
+                        num_hops)
+    return {
+        'proximity_latency_us': 1e6 * proximity_seconds / num_network_calls,
+        'hop_latency_us': 1e6 * hop_seconds / num_hops,
+    }
+
+
+def compare(results, baseline):
+    """Ratio of every metric to the baseline, for the metrics present in both
+
+    Arguments:
+        results {Dict} -- protocol -> size -> metric -> value
+        baseline {Dict} -- Same layout, from an earlier run
+
+    Returns:
+        Dict -- protocol -> size -> metric -> {baseline, ratio, change}
+    """
+    comparison = {}
+    for protocol, by_size in results.items():
+        for size, metrics in by_size.items():
+            old_metrics = baseline.get(protocol, {}).get(size, {})
+            for metric, value in metrics.items():
+                old = old_metrics.get(metric)
+                if not old:
+                    continue
+                ratio = value / old
+                gain = ratio - 1
+                if any(word in metric for word in LOWER_IS_BETTER):
+                    gain = -gain
+                change = 'unchanged'
+                if gain > noise:
+                    change = 'improved'
+                elif gain < -noise:
+                    change = 'regressed'
+                comparison.setdefault(protocol, {}).setdefault(
+                    size, {})[metric] = {
+                        'baseline': old,
+                        'ratio': ratio,
+                        'change': change,
+                    }
+    return comparison
+
+
+results = {'chord': {}, 'pastry': {}, 'kademlia': {}, 'network': {}}
+for n in sizes:
+    print('Benchmarking N = ' + str(n))
+    results['chord'][str(n)] = bench_chord(n)
+    results['pastry'][str(n)] = bench_pastry(n)
+    results['kademlia'][str(n)] = bench_kademlia(n)
+    results['network'][str(n)] = bench_network(n)
+    for protocol in results:
+        print(protocol + ': ' + json.dumps(results[protocol][str(n)]))
+
+report = {
+    'meta': {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'seed': seed,
+        'sizes': sizes,
+        'num_joins': num_joins,
+        'num_lookups': num_lookups,
+        'num_stores': num_stores,
+        'failure_fraction': failure_fraction,
+    },
+    'results': results,
+}
+if baseline_file is not None:
+    with open(baseline_file) as f:
+        baseline = json.load(f)
+    report['comparison'] = compare(results, baseline['results'])
+    for protocol, by_size in report['comparison'].items():
+        for size, metrics in by_size.items():
+            for metric, entry in metrics.items():
+                print(protocol + ' N=' + size + ' ' + metric + ': x' +
+                      format(entry['ratio'], '.2f') + ' ' + entry['change'])
+
+with open(output_file, 'w') as f:
+    json.dump(report, f, indent=2)
+print('Results written to ' + output_file)
@@ -2,13 +2,23 @@
 Run Experiments for the Chord DHT Protocol
 Uses the ChordNode and Network classes defined in this repo.
 """
+import os
 import math
 import sys
+import time
 import random
 import hashlib
-import matplotlib.pyplot as plt
-from chord_node import ChordNode
+import numpy as np
+from chord_node import ChordNode, hash_key
+from snapshot import save_snapshot, load_snapshot
 from modules.network import Network
+from modules.tracing import Tracer
+from modules.load_report import print_load_report
+from modules.metrics import MetricsCollector, write_metrics
+from modules.workload import (make_keys, generate_workload, read_trace,
+                              ArrivalPacer, format_rates)
+from modules.churn import (make_sessions, ChurnSchedule, ChurnStats,
+                           format_row, write_churn)
 
 if len(sys.argv) == 2:
     print('Please enter required number of arguments')
@@ -19,14 +29,44 @@ num_nodes = int(sys.argv[1])
 read_from_file = bool(int(sys.argv[2]))
 nodes = []
 data_store = {}
+metrics = {}
+# Network Id of the next node joining during a workload: ids are never
+# reused, since departed nodes may still be in the state of other nodes
+next_node = 2 * num_nodes
 
 l = 6
 m = 24
 num_points = 10000
 num_queries = 1000000
+fast_join = True
+batch_search = True
+verbose = False
+show_plots = False
+metrics_file = 'chord_metrics.json'
+workload_operations = 0
+key_distribution = 'zipf'
+zipf_exponent = 0.99
+operation_mix = {'get': 0.9, 'put': 0.1, 'join': 0, 'leave': 0}
+arrival_schedule = [(workload_operations, 1000)]
+trace_file = None
+pace_workload = False
+snapshot_dir = None
+chrome_trace_file = None
+trace_sample_rate = 0.001
+load_file = None
+churn_duration = 0
+session_distribution = 'exponential'
+mean_session_time = 600
+churn_lookup_rate = 100
+crash_fraction = 0.5
+churn_maintenance_period = 30
+churn_window = 60
+churn_file = None
 
 
 def plot_histogram(dict):
+    # Only needed when show_plots is set
+    import matplotlib.pyplot as plt
     plt.bar(dict.keys(), dict.values())
     plt.xlim(0, 14)
     plt.ylim(0, 0.6)
@@ -59,85 +99,120 @@ def init_network(network, num_nodes):
     """
     num_added = 0
     for i in range(2 * num_nodes):
-        print("Adding node " + str(i))
         node_hash = hash_int(i)
-        print(node_hash)
+        if verbose:
+            print("Adding node " + str(i))
+            print(node_hash)
 
-        pn = ChordNode(i, node_hash, network, m)
+        pn = ChordNode(i, node_hash, network, m, verbose=verbose)
         is_added = network.add_node(pn)
         if is_added:
-            pn.join()
+            pn.join(fast=fast_join)
             num_added += 1
             nodes.append(i)
         if num_added == num_nodes:
             break
 
 
-def search_queries(network, num_queries):
+def search_queries(network, num_queries, phase):
     """Run search queries for num_queries times
     
     Arguments:
         network {Network}
         num_queries {Integer} -- Number of queries
+        phase {String} -- Name under which the statistics are collected
     """
-    hops_hist = {}
+    collector = metrics.setdefault(phase, MetricsCollector(max_hops=12))
     num_epoch = 0
-    flag = 0
     count = 0
     for _ in range(100):
         for q in data_store:
-            flag = 0
             count += 1
             if (count % 10000 == 0):
                 num_epoch += 1
                 print(str(num_epoch) + ' epochs completed')
             hit_node = int(hash_int(random.choice(nodes)), 16)
             node = network.get_node(hit_node)
+            start = time.perf_counter()
             hops, chord_value, path = node.search(q)
-            print('Lookup ' + str(q) + ': ' + str(path))
-            # Add in histogram
-            hops = 12 if hops > 12 else hops
-            if hops in hops_hist:
-                hops_hist[hops] += 1
-            else:
-                hops_hist[hops] = 1
+            latency = time.perf_counter() - start
+            if verbose:
+                print('Lookup ' + str(q) + ': ' + str(path))
 
+            error = None
             if chord_value == -1:
-                try:
-                    global_value = data_store[q]
-                    flag = 1
-                    print(
-                        str(q) + ': Found ' + str(global_value) +
-                        ' when not stored')
-                except:
-                    continue
-            else:
-                try:
-                    global_value = data_store[q]
-                    if (chord_value != global_value):
-                        print(
-                            str(q) + ': Found ' + str(global_value) +
-                            ' when ' + str(chord_value) + ' stored')
-                        flag = 1
-                except:
-                    flag = 1
-            if flag == 1:
+                error = 'not_found'
+            elif chord_value != data_store[q]:
+                error = 'wrong_value'
+            collector.record(hops, latency=latency, error=error)
+            if error is not None and verbose:
                 print('Couldn\'t find node ' + str(q) + ' correctly')
             if count >= num_queries:
                 break
         if count >= num_queries:
             break
 
-    if flag == 0:
-        print('All queries ran successfully')
+    report(phase)
+
+
+def batch_search_queries(network, num_queries, phase):
+    """Run search queries for num_queries times, all resolved together by
+    the vectorized lookup engine
+    
+    Arguments:
+        network {Network}
+        num_queries {Integer} -- Number of queries
+        phase {String} -- Name under which the statistics are collected
+    """
+    keys = list(data_store)
+    key_hashes = np.array([hash_key(key) for key in keys], dtype=np.int64)
+    queries = np.arange(num_queries) % len(keys)
+    sources = np.array(
+        [int(hash_int(random.choice(nodes)), 16) for _ in range(num_queries)],
+        dtype=np.int64)
+
+    start = time.perf_counter()
+    owners, hops = ChordNode.batch_lookup(network, sources,
+                                          key_hashes[queries])
+    elapsed = time.perf_counter() - start
 
-    new_dict = {}
-    avg_hops = 0
-    for k in hops_hist:
-        new_dict[k] = hops_hist[k] / num_queries
-        avg_hops += (new_dict[k] * k)
-    print(avg_hops)
-    plot_histogram(new_dict)
+    # Check that the owner of each distinct (key, owner) pair holds the key
+    pairs, counts = np.unique(np.stack((queries, owners), axis=1),
+                              axis=0,
+                              return_counts=True)
+    errors = {}
+    for (q, owner), count in zip(pairs.tolist(), counts.tolist()):
+        chord_value = -1
+        if network.is_alive(owner):
+            chord_value = network.get_node(owner).data_store.get(
+                int(key_hashes[q]), -1)
+        if chord_value != data_store[keys[q]]:
+            error = 'not_found' if chord_value == -1 else 'wrong_value'
+            errors[error] = errors.get(error, 0) + count
+            if verbose:
+                print('Couldn\'t find node ' + str(keys[q]) + ' correctly')
+
+    collector = metrics.setdefault(phase, MetricsCollector(max_hops=12))
+    collector.record_batch(hops, elapsed, errors=errors)
+    report(phase)
+
+
+def report(phase):
+    """Print the summary of the statistics collected in phase, and plot the
+    hop distribution if show_plots is set
+    
+    Arguments:
+        phase {String}
+    """
+    collector = metrics[phase]
+    num_errors = sum(collector.errors.values())
+    if num_errors == 0:
+        print('All queries ran successfully')
+    else:
+        print(str(num_errors) + ' queries failed: ' + str(collector.errors))
+    print(collector.summary()['avg_hops'])
+    if show_plots:
+        plot_histogram(collector.hop_distribution())
 
 
 def store_keys(network, num_keys):
@@ -163,6 +238,213 @@ def store_keys(network, num_keys):
                 break
 
 
+def join_node(network):
+    """Add a new node to the network, if a switch is free for it
+    
+    Arguments:
+        network {Network}
+    
+    Returns:
+        Boolean -- True if a node joined
+    """
+    global next_node
+    if len(network.nodes) >= network.num_switches:
+        return False
+    while True:
+        i = next_node
+        next_node += 1
+        pn = ChordNode(i, hash_int(i), network, m, verbose=verbose)
+        if network.add_node(pn):
+            pn.join(fast=fast_join)
+            nodes.append(i)
+            return True
+
+
+def run_workload(network, operations, phase):
+    """Run the operations of a workload, collecting the statistics of each
+    kind of operation under phase.kind, and report the offered and achieved
+    rate of every phase of the arrival schedule. With pace_workload, each
+    operation waits for its arrival time.
+    
+    Arguments:
+        network {Network}
+        operations {Iterable} -- Operation tuples, generated or replayed
+        phase {String}
+    """
+    collectors = {}
+    # A replayed trace has no schedule, and is measured as a single phase
+    pacer = ArrivalPacer(arrival_schedule if trace_file is None else None,
+                         pace=pace_workload)
+    for operation in operations:
+        pacer.wait(operation)
+        kind = operation.kind
+        collector = collectors.get(kind)
+        if collector is None:
+            collector = metrics.setdefault(phase + '.' + kind,
+                                           MetricsCollector(max_hops=12))
+            collectors[kind] = collector
+        key = operation.key
+        hops = 0
+        error = None
+        start = time.perf_counter()
+        if kind == 'get':
+            node = network.get_node(int(hash_int(random.choice(nodes)), 16))
+            hops, chord_value, _ = node.search(key)
+            if chord_value != data_store.get(key, -1):
+                error = 'not_found' if chord_value == -1 else 'wrong_value'
+        elif kind == 'put':
+            node = network.get_node(int(hash_int(random.choice(nodes)), 16))
+            value = random.randint(0, 2 * num_points)
+            if node.store_key(key, value) == 0:
+                data_store[key] = value
+            elif key not in data_store:
+                error = 'not_stored'
+        elif kind == 'join':
+            if not join_node(network):
+                error = 'no_free_switch'
+        elif len(nodes) > 1:
+            delete_nodes(network, 1)
+        else:
+            error = 'last_node'
+        collector.record(hops,
+                         latency=time.perf_counter() - start,
+                         error=error)
+        pacer.done()
+
+    for kind in collectors:
+        report(phase + '.' + kind)
+    for row in pacer.summary():
+        print(format_rates(row))
+
+
+def stabilize(network):
+    """Run a stabilization pass on every node, repairing the crashed
+    successors
+    
+    Arguments:
+        network {Network}
+    """
+    for i in nodes:
+        network.get_node(int(hash_int(i), 16)).stabilize()
+
+
+def leave_node(network, i, crash=False):
+    """Remove the node with Id i from the network
+    
+    Arguments:
+        network {Network}
+        i {Integer} -- Id of the node
+
+    Keyword Arguments:
+        crash {Boolean} -- Fail without notice instead of leaving gracefully
+                           (default: {False})
+    
+    Returns:
+        Boolean -- True if the node has left
+    """
+    node_hash = int(hash_int(i), 16)
+    if crash:
+        removed = network.remove_node(node_hash)
+    else:
+        removed = network.get_node(node_hash).depart_network()
+    if removed:
+        nodes.remove(i)
+    return removed
+
+
+def live_owner(network, key_hash):
+    """
+    Arguments:
+        network {Network}
+        key_hash {Integer}
+
+    Returns:
+        Integer -- Node Id of the live successor of key_hash
+    """
+    return min(network.nodes, key=lambda num: (num - key_hash) % 2**m)
+
+
+def run_churn(network, phase):
+    """Run lookups while nodes join, leave gracefully and crash, with session
+    times drawn from session_distribution, and report the routing success
+    rate, data availability, hop inflation and repair traffic over every
+    churn_window seconds. Each lookup is routed once, to the owner of its
+    key, and the value is read from that owner, so routing and lost keys are
+    measured apart.
+    
+    Arguments:
+        network {Network}
+        phase {String} -- Name under which the lookup statistics are
+                          collected
+    """
+    collector = metrics.setdefault(phase, MetricsCollector(max_hops=12))
+    # Joins balance the departures, keeping the size of the overlay steady
+    schedule = ChurnSchedule(make_sessions(session_distribution,
+                                           mean_session_time),
+                             len(nodes) / mean_session_time,
+                             churn_lookup_rate,
+                             crash_fraction=crash_fraction,
+                             maintenance_period=churn_maintenance_period)
+    for i in nodes:
+        schedule.add_node(i, 0)
+    stats = ChurnStats(network, churn_window, lambda n: 0.5 * math.log2(n))
+    keys = list(data_store)
+    alive = set(nodes)
+    for now, kind, i in schedule.events(churn_duration):
+        for row in stats.advance(now):
+            print(format_row(row))
+        if kind == 'lookup':
+            key = random.choice(keys)
+            node = network.get_node(int(hash_int(random.choice(nodes)), 16))
+            key_hash = node.key_hash(key)
+            start = time.perf_counter()
+            owner, hops = node.lookup(key_hash)
+            latency = time.perf_counter() - start
+            routed = owner == live_owner(network, key_hash)
+            value = -1
+            if network.is_alive(owner):
+                value = network.get_node(owner).data_store.get(key_hash, -1)
+            error = None
+            if value != data_store[key]:
+                error = 'not_found' if value == -1 else 'wrong_value'
+            collector.record(hops, latency=latency,
+                             error=error if routed else 'misrouted')
+            stats.record_lookup(hops, routed, error)
+        elif kind == 'join':
+            if join_node(network):
+                alive.add(nodes[-1])
+                schedule.add_node(nodes[-1], now)
+                stats.record_change('join')
+        elif kind == 'maintenance':
+            stabilize(network)
+        elif i in alive and len(nodes) > 1:
+            node = network.get_node(int(hash_int(i), 16))
+            if leave_node(network, i, crash=kind == 'crash'):
+                alive.remove(i)
+                stats.record_change(kind, node)
+    for row in stats.advance(churn_duration):
+        print(format_row(row))
+
+    report(phase)
+    if churn_file is not None:
+        write_churn(stats.rows, churn_file)
+        print('Churn statistics written to ' + churn_file)
+
+
+def workload():
+    """
+    Returns:
+        Iterable -- Operations replayed from trace_file if set, else generated
+    """
+    if trace_file is not None:
+        return read_trace(trace_file)
+    keys = make_keys(key_distribution, num_points, zipf_exponent)
+    return generate_workload(workload_operations,
+                             keys,
+                             mix=operation_mix,
+                             schedule=arrival_schedule)
+
+
 def delete_nodes(network, del_nodes):
     """Simulate deletion of nodes from network
     
@@ -182,14 +464,43 @@ def delete_nodes(network, del_nodes):
 
 # Number of switches :- Max number of nodes that can be added onto the network
 num_switches = num_nodes
-network = Network(num_switches, read_from_file)
+if snapshot_dir is not None and os.path.isdir(snapshot_dir):
+    # Start from the overlay saved by an earlier run
+    network, saved_store = load_snapshot(snapshot_dir, verbose=verbose)
+    data_store.update(saved_store or {})
+    nodes.extend(
+        sorted(network.get_node(num).get_id() for num in network.nodes))
+    next_node = max(next_node, nodes[-1] + 1)
+else:
+    network = Network(num_switches, read_from_file)
 
-# Initialize network
-init_network(network, num_nodes)
-store_keys(network, num_points)
-search_queries(network, num_queries)
+    # Initialize network
+    init_network(network, num_nodes)
+    store_keys(network, num_points)
+    if snapshot_dir is not None:
+        save_snapshot(snapshot_dir, network, data_store)
+if chrome_trace_file is not None:
+    # Trace a sample of the lookups made by the nodes
+    network.tracer = Tracer(trace_sample_rate)
+if batch_search:
+    batch_search_queries(network, num_queries, 'search')
+else:
+    search_queries(network, num_queries, 'search')
 delete_nodes(network, num_nodes // 2)
-search_queries(network, num_queries)
+if batch_search:
+    batch_search_queries(network, num_queries, 'search_after_delete')
+else:
+    search_queries(network, num_queries, 'search_after_delete')
+if workload_operations > 0 or trace_file is not None:
+    run_workload(network, workload(), 'workload')
+if churn_duration > 0:
+    run_churn(network, 'churn')
+write_metrics(metrics, metrics_file)
+print('Statistics written to ' + metrics_file)
+print_load_report(network, load_file)
+if network.tracer is not None:
+    network.tracer.export(chrome_trace_file)
+    print('Lookup traces written to ' + chrome_trace_file)
 
 print('Total number of nodes: ' + str(num_nodes))
 print('Total number of data points: ' + str(num_points))
@@ -0,0 +1,168 @@
+"""
+Vectorized Lookups on a whole Chord ring
+Exports the finger tables of all the ChordNode instances into NumPy arrays,
+and resolves a batch of lookups together, advancing every pending query by
+one hop per step, exactly as ChordNode.find_successor would route it. A
+query meeting a failed successor or finger is finished by find_successor
+itself, which repairs the state of the node on the way.
+"""
+import numpy as np
+
+
+def export_ring(network):
+    """Export the finger tables of all the nodes alive in the network
+
+    Arguments:
+        network {Network}
+
+    Returns:
+        ndarray, ndarray -- Sorted node ids (n),
+                            (n x M) finger nodes of each node
+    """
+    nums = np.array(sorted(network.nodes), dtype=np.int64)
+    fingers = np.array([[
+        entry['node'] for entry in network.get_node(int(num)).finger_table
+    ] for num in nums],
+                       dtype=np.int64)
+    return nums, fingers
+
+
+def circular_between(start, bet, end):
+    """Vectorized circular_between of chord_node: True where bet is strictly
+    between start and end (never when start equals end)
+
+    Arguments:
+        start {ndarray}
+        bet {ndarray}
+        end {ndarray}
+
+    Returns:
+        ndarray -- Boolean mask
+    """
+    forward = (end > start) & (bet > start) & (bet < end)
+    wrapped = (end < start) & ((bet > start) | (bet < end))
+    return forward | wrapped
+
+
+def closest_preceding_finger(fingers, nums, key):
+    """Vectorized ChordNode.closest_preceding_finger: the highest finger of
+    each node lying strictly between the node and the key
+
+    Arguments:
+        fingers {ndarray} -- (q x M) finger nodes of the current nodes
+        nums {ndarray} -- (q) current nodes
+        key {ndarray} -- (q) keys
+
+    Returns:
+        ndarray -- (q) closest preceding finger (the node itself if none)
+    """
+    inside = circular_between(nums[:, None], fingers, key[:, None])
+    last = fingers.shape[1] - 1 - np.argmax(inside[:, ::-1], axis=1)
+    found = fingers[np.arange(len(nums)), last]
+    return np.where(inside.any(axis=1), found, nums)
+
+
+def is_alive(nums, values):
+    """
+    Arguments:
+        nums {ndarray} -- Sorted node ids alive
+        values {ndarray} -- Node ids to be checked
+
+    Returns:
+        ndarray -- Boolean mask, True where the node is alive
+    """
+    pos = np.minimum(np.searchsorted(nums, values), len(nums) - 1)
+    return nums[pos] == values
+
+
+def batch_lookup(network,
+                 nums,
+                 fingers,
+                 sources,
+                 keys,
+                 max_hops=None,
+                 chunk=1 << 18,
+                 routed=None):
+    """Resolve lookups for keys started at sources, with the same owners and
+    hop counts as ChordNode.find_successor. A lookup whose current node has
+    a failed successor, or whose closest preceding finger has failed, is
+    handed over to find_successor on that node.
+
+    Arguments:
+        network {Network}
+        nums {ndarray} -- Sorted node ids, as given by export_ring
+        fingers {ndarray} -- Finger nodes, as given by export_ring
+        sources {ndarray} -- Node ids on which the lookups start
+        keys {ndarray} -- Keys to be looked up
+
+    Keyword Arguments:
+        max_hops {Integer} -- Lookups still pending after max_hops steps are
+                              given up (default: {4 * M})
+        chunk {Integer} -- Number of queries resolved together
+                           (default: {1 << 18})
+        routed {ndarray} -- If given, the number of lookups routed through
+                            each node by the vectorized steps, indexed like
+                            nums, is added to it. The lookups handed over are
+                            counted by the nodes themselves from then on
+                            (default: {None})
+
+    Returns:
+        ndarray, ndarray -- Node Id of the successor of each key (-1 if the
+                            lookup was given up), Num hops of each lookup
+    """
+    sources = np.asarray(sources, dtype=np.int64)
+    keys = np.asarray(keys, dtype=np.int64)
+    if max_hops is None:
+        max_hops = 4 * fingers.shape[1]
+    owners = np.full(len(keys), -1, dtype=np.int64)
+    hops = np.zeros(len(keys), dtype=np.int64)
+    for begin in range(0, len(keys), chunk):
+        end = min(begin + chunk, len(keys))
+        active = np.arange(begin, end)
+        current = np.searchsorted(nums, sources[begin:end])
+        for _ in range(max_hops):
+            if active.size == 0:
+                break
+            num = nums[current]
+            key = keys[active]
+            successor = fingers[current, 0]
+            next_node = closest_preceding_finger(fingers[current], num, key)
+
+            # The lookups meeting a failed node are finished by the node,
+            # as find_successor repairs its successor or fingers first
+            failed = ~is_alive(nums, successor) | ~is_alive(nums, next_node)
+            for query, node in zip(active[failed].tolist(),
+                                   num[failed].tolist()):
+                owner, num_hops, _ = network.get_node(node).find_successor(
+                    int(keys[query]))
+                owners[query] = owner
+                hops[query] += num_hops
+            alive = ~failed
+            active = active[alive]
+            current = current[alive]
+            num = num[alive]
+            key = key[alive]
+            successor = successor[alive]
+            next_node = next_node[alive]
+            if routed is not None:
+                routed += np.bincount(current, minlength=len(nums))
+
+            # The key is on the current node
+            at_node = num == key
+            owners[active[at_node]] = num[at_node]
+            # The key is on the successor
+            to_successor = ~at_node & (circular_between(num, key, successor)
+                                       | (key == successor)
+                                       | (num == successor))
+            owners[active[to_successor]] = successor[to_successor]
+            hops[active[to_successor]] += 1
+
+            # Forward the others to the closest preceding finger, or to the
+            # successor if no finger precedes the key
+            forward = ~(at_node | to_successor)
+            active = active[forward]
+            next_node = np.where(next_node[forward] == num[forward],
+                                 successor[forward], next_node[forward])
+            hops[active] += 1
+            current = np.searchsorted(nums, next_node)
+    return owners, hops
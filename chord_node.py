@@ -1,7 +1,10 @@
 """Class Definition for ChordNode"""
 import math
 import hashlib
-from modules.network import Node
+import numpy as np
+import chord_batch
+from modules.network import OverlayNode
+from modules.load_report import add_batch_load
 
 M = 0
 
@@ -62,12 +65,14 @@ def hash_key(integer):
 # X------------------X-----------------X
 #
 # Where the finger is from [Start, End) and stored at Node
-class ChordNode(Node):
+class ChordNode(OverlayNode):
     """Implementation Class for ChordNode, a single node instance, 
        running the Chord Protocol"""
-    def __init__(self, node_id, node_hash, network, m):
+    def __init__(self, node_id, node_hash, network, m, verbose=False):
         global M
         super().__init__(node_id, node_hash, network)
+        # Print the node on joins and departures
+        self.verbose = verbose
 
         M = m
         self.finger_table = []
@@ -87,6 +92,20 @@ class ChordNode(Node):
             print(str(entry['start']) + '\t|\t' + str(entry['node']))
         return ''
 
+    def load_counters(self):
+        """
+        Returns:
+            Dict -- Name -> value of each load counter of the node, with the
+                    keys stored and the number of distinct nodes in its
+                    routing state (fingers and predecessor)
+        """
+        counters = super().load_counters()
+        counters['keys'] = len(self.data_store)
+        counters['state_size'] = len(
+            set(entry['node'] for entry in self.finger_table) |
+            {self.predecessor})
+        return counters
+
     def get_successor(self):
         """Sends the successor of the node to whoever wants it
         
@@ -155,11 +174,15 @@ class ChordNode(Node):
         n_dash = self.network_api.get_node(key_successor)
         return n_dash.get_predecessor()
 
-    def find_successor(self, key):
+    def find_successor(self, key, trace=None):
         """Find the successor of the key, as per information with current node
         
         Arguments:
             key {Integer} -- Key whose successor is to be found
+
+        Keyword Arguments:
+            trace {LookupTrace} -- If given, a span is recorded for every hop
+                                   (default: {None})
         
         Returns:
             Integer, Integer, List -- Node Id of the successor node, Num hops
@@ -168,28 +191,85 @@ class ChordNode(Node):
         # Return the node itself when the key is on the node
         # print('Finding successor for ' + str(key) + ' at ' +
         #       str(self.get_num()))  # Debug
+        self.num_routed += 1
+        if not self.network_api.is_alive(self.get_successor()):
+            # The successor has crashed: repair it before routing
+            if trace is not None:
+                start = trace.tracer.now()
+            failed = self.get_successor()
+            self.stabilize()
+            if trace is not None:
+                trace.span('repair', start, node=self.get_num(), failed=failed)
         if self.get_num() == key:
+            if trace is not None:
+                trace.decide('found')
+                self.__trace_hop(trace, -1)
             return self.get_num(), 0, [self.get_num()]
 
         if circular_between(self.get_num(), key,
                             self.get_successor()) or key == self.get_successor(
                             ) or self.get_num() == self.get_successor():
+            if trace is not None:
+                trace.decide('successor')
+                self.__trace_hop(trace, self.get_successor())
             return self.get_successor(), 1, [self.get_successor()]
         else:
             node_id, i = self.closest_preceding_finger(key)
             i_orig = i
             while not self.network_api.is_alive(node_id):
-                node_id, i = self.closest_preceding_finger(node_id - 1)
-
-            # Update the node in the finger table from i_orig to i
-            for index in range(i_orig, i + 1):
-                self.finger_table[index]['node'] = node_id
+                if trace is not None:
+                    start = trace.tracer.now()
+                failed = node_id
+                node_id, i = self.closest_preceding_finger(node_id)
+                if trace is not None:
+                    trace.span('repair',
+                               start,
+                               node=self.get_num(),
+                               failed=failed)
+            if node_id == self.get_num():
+                # No finger alive precedes the key: forward to the successor
+                node_id, i = self.get_successor(), 0
+
+            # Replace the dead fingers skipped, from i to i_orig, by the
+            # finger found: it precedes their starts, so routes stay correct
+            for index in range(i, i_orig + 1):
+                if not self.network_api.is_alive(
+                        self.finger_table[index]['node']):
+                    self.finger_table[index]['node'] = node_id
+                    self.num_repairs += 1
+            if trace is not None:
+                trace.decide('finger', finger=i)
+                self.__trace_hop(trace, node_id)
             n_dash = self.network_api.get_node(node_id)
             l_path = [node_id]
-            succ, hops, path = n_dash.find_successor(key)
+            succ, hops, path = n_dash.find_successor(key, trace)
             l_path.extend(path)
             return succ, (hops + 1), l_path
 
+    def begin_trace(self, name, key):
+        """Start tracing a lookup made from the current node, if the network
+        has a tracer and the lookup is sampled
+
+        Arguments:
+            name {String} -- Kind of lookup
+            key {Integer} -- Hashed key
+
+        Returns:
+            LookupTrace -- None if the lookup is not traced
+        """
+        tracer = self.network_api.tracer
+        if tracer is None:
+            return None
+        return tracer.begin(name, self.get_num(), key)
+
+    def __trace_hop(self, trace, next_node):
+        """Close the span of the current node on trace, forwarding to
+        next_node (-1 if the lookup ends on the current node)"""
+        proximity = -1
+        if next_node != -1 and self.network_api.is_alive(next_node):
+            proximity = self.network_api.proximity(self.get_num(), next_node)
+        trace.hop(self.get_num(), next_node, proximity)
+
     def fetch_keys(self, start, end):
         """Send key-value pair requested by other node
         
@@ -207,11 +287,16 @@ class ChordNode(Node):
                 del self.data_store[key]
         return new_dict
 
-    def __init_finger_table(self, node_id):
+    def __init_finger_table(self, node_id, fast=False):
         """Initialize finger table for a node which has just joined
         
         Arguments:
             node_id {Integer} -- The node whose help is being taken to join
+
+        Keyword Arguments:
+            fast {Boolean} -- Copy the finger table from the predecessor
+                              instead of looking up every entry
+                              (default: {False})
         """
         global M
         n_dash = self.network_api.get_node(node_id)
@@ -223,12 +308,19 @@ class ChordNode(Node):
         # Update successor and predecessor links
         successor = self.network_api.get_node(self.get_successor())
         self.predecessor = successor.get_predecessor()
+        if not self.network_api.is_alive(self.predecessor):
+            # Crashed predecessor: take the node which answered the lookup,
+            # as the key lies between it and its successor
+            self.predecessor = path[-2] if len(path) > 1 else node_id
         predecessor = self.network_api.get_node(self.get_predecessor())
         predecessor.set_successor(self.get_num())
         successor.set_predecessor(self.get_num())
 
         # Update the finger table using node n_dash
-        self.fill_finger_table(node_id)
+        if fast:
+            self.__copy_finger_table()
+        else:
+            self.fill_finger_table(node_id)
 
     def fill_finger_table(self, node_id):
         """
@@ -252,6 +344,18 @@ class ChordNode(Node):
                     i + 1]['node'], num_hops, path = n_dash.find_successor(
                         self.finger_table[i + 1]['start'])
 
+    def load_state(self, fingers, predecessor):
+        """Initialize the finger table and predecessor directly, e.g. from a
+        snapshot of the ring
+
+        Arguments:
+            fingers {List} -- Node Ids of the M fingers
+            predecessor {Integer} -- Node Id of the predecessor
+        """
+        for entry, node in zip(self.finger_table, fingers):
+            entry['node'] = node
+        self.predecessor = predecessor
+
     def update_finger_table(self, x, i):
         """Update finger table of the current node when a new node x has arrived
         
@@ -265,8 +369,98 @@ class ChordNode(Node):
                             self.finger_table[i]
                             ['node']) or self.finger_table[i]['start'] == x:
             self.finger_table[i]['node'] = x
+            if self.network_api.is_alive(self.predecessor):
+                predecessor = self.network_api.get_node(self.predecessor)
+                predecessor.update_finger_table(x, i)
+
+    def __copy_finger_table(self):
+        """
+        Fill the finger table of a newly joined node from its predecessor's
+        finger table. Since the predecessor's finger starts lie just before the
+        current node's starts, a copied entry is correct unless a node exists
+        between the two starts; only such entries are verified with a lookup,
+        which starts from the copied entry itself and is hence short.
+        """
+        global M
+        predecessor = self.network_api.get_node(self.get_predecessor())
+        reference = predecessor.finger_table
+
+        for i in range(1, M):
+            start = self.finger_table[i]['start']
+            prev = self.finger_table[i - 1]['node']
+            if circular_between(self.get_num(), start, prev) or start == prev:
+                # Same successor as the previous finger
+                self.finger_table[i]['node'] = prev
+                continue
+
+            ref_start = reference[i]['start']
+            candidate = reference[i]['node']
+            if start in (ref_start, candidate) or circular_between(
+                    ref_start, start, candidate):
+                # No node in [ref_start, candidate): the entry can be copied,
+                # unless the current node itself lies before the entry
+                if circular_between(start, self.get_num(), candidate):
+                    self.finger_table[i]['node'] = self.get_num()
+                else:
+                    self.finger_table[i]['node'] = candidate
+            else:
+                # Entry differs: verify starting from the copied entry, or
+                # from the predecessor if the entry has departed since
+                if not self.network_api.is_alive(candidate):
+                    candidate = predecessor.get_num()
+                n_dash = self.network_api.get_node(candidate)
+                self.finger_table[i]['node'], num_hops, path = \
+                    n_dash.find_successor(start)
+
+    def update_finger_entries(self, x, indices):
+        """
+        Batched version of update_finger_table: update all the given fingers
+        of the current node for the new node x in a single message, and
+        forward only the fingers that changed to the predecessor
+
+        Arguments:
+            x {Integer} -- Node id of the new node which has joined
+            indices {List} -- Indices of the fingers to be updated
+        """
+        updated = []
+        for i in indices:
+            start = self.finger_table[i]['start']
+            if circular_between(start, x, self.finger_table[i]['node']) or \
+                    start == x:
+                self.finger_table[i]['node'] = x
+                updated.append(i)
+        if updated and self.network_api.is_alive(self.predecessor):
             predecessor = self.network_api.get_node(self.predecessor)
-            predecessor.update_finger_table(x, i)
+            predecessor.update_finger_entries(x, updated)
+
+    def __update_others_batched(self):
+        """
+        Update all nodes of the join of current node, sending one batched
+        update per node whose fingers might point to the current node
+        """
+        global M
+        pending = {}
+        last_target = self.get_num()
+        last_pred = self.get_predecessor()
+        for i in range(M):
+            # The node whose ith finger might be the current node
+            prev_id = circular_difference(self.get_num(), int(math.pow(2, i)))
+            if self.network_api.is_alive(prev_id):
+                p = prev_id
+            elif circular_between(last_pred, prev_id, last_target):
+                # No node between last_pred and last_target: reuse the lookup
+                p = last_pred
+            else:
+                p = self.find_predecessor(prev_id)
+            last_target, last_pred = prev_id, p
+            pending.setdefault(p, []).append(i)
+
+        for p, indices in pending.items():
+            if not self.network_api.is_alive(p):
+                # Crashed node, not yet replaced by stabilization
+                continue
+            p_node = self.network_api.get_node(p)
+            p_node.update_finger_entries(self.get_num(), indices)
 
     def __update_others(self):
         """Update all nodes of the join of current node"""
@@ -278,6 +472,8 @@ class ChordNode(Node):
                 prev_node = self.network_api.get_node(prev_id)
                 prev_node.update_finger_table(self.get_num(), i)
             p = self.find_predecessor(prev_id)
+            if not self.network_api.is_alive(p):
+                continue
             p_node = self.network_api.get_node(p)
             p_node.update_finger_table(self.get_num(), i)
 
@@ -293,25 +489,89 @@ class ChordNode(Node):
         """Run method when departing from the network"""
         # Notify successor of departure -- Successor shall transfer the
         # requisite keys
-        print('Deleting node: ')
-        print(self)
+        if self.verbose:
+            print('Deleting node: ')
+            print(self)
+        self.stabilize()
         successor = self.network_api.get_node(self.get_successor())
         successor.notify()
 
-        # Update Predecessor and Successor links
-        predecessor = self.network_api.get_node(self.get_predecessor())
-        predecessor.set_successor(self.get_successor())
+        # Update Predecessor and Successor links. A crashed predecessor is
+        # left to the stabilization of the node alive before it
         successor.set_predecessor(self.get_predecessor())
+        successor.num_repairs += 1
+        if self.network_api.is_alive(self.get_predecessor()):
+            predecessor = self.network_api.get_node(self.get_predecessor())
+            predecessor.set_successor(self.get_successor())
 
-        # Update finger tables of predecessor and successor
-        predecessor.fill_finger_table(successor.get_num())
-        successor.fill_finger_table(predecessor.get_num())
+            # Update finger tables of predecessor and successor
+            predecessor.fill_finger_table(successor.get_num())
+            successor.fill_finger_table(predecessor.get_num())
+            predecessor.num_repairs += 1
 
         # Finally: Depart from network
         return self.network_api.remove_node(self.get_num())
 
-    def join(self):
-        """Run when a new node joins the network"""
+    def stabilize(self):
+        """Periodic check of the successor, run off the query path: a crashed
+        successor is replaced by the next node alive on the ring, a node
+        which has joined just after the current node becomes its successor,
+        and the successor learns about the current node if its predecessor
+        has crashed or lies before the current node
+
+        Returns:
+            Boolean -- True if the successor had crashed
+        """
+        failed = not self.network_api.is_alive(self.get_successor())
+        if failed:
+            self.num_repairs += 1
+            self.set_successor(self.__next_alive())
+        successor = self.network_api.get_node(self.get_successor())
+        predecessor = successor.get_predecessor()
+        if self.network_api.is_alive(predecessor) and circular_between(
+                self.get_num(), predecessor, successor.get_num()):
+            self.set_successor(predecessor)
+            successor = self.network_api.get_node(predecessor)
+            predecessor = successor.get_predecessor()
+        if not self.network_api.is_alive(predecessor) or circular_between(
+                predecessor, self.get_num(), successor.get_num()):
+            successor.set_predecessor(self.get_num())
+        return failed
+
+    def __next_alive(self):
+        """Find the first node alive after the current node on the ring,
+        starting from the first finger alive and walking back the
+        predecessor links
+        
+        Returns:
+            Integer -- Node Id of the node, the current node if it is alone
+        """
+        candidate = self.get_num()
+        for entry in self.finger_table:
+            if entry['node'] != self.get_num() and self.network_api.is_alive(
+                    entry['node']):
+                candidate = entry['node']
+                break
+        if candidate == self.get_num():
+            return candidate
+        while True:
+            predecessor = self.network_api.get_node(
+                candidate).get_predecessor()
+            if not self.network_api.is_alive(
+                    predecessor) or not circular_between(
+                        self.get_num(), predecessor, candidate):
+                return candidate
+            candidate = predecessor
+
+    def join(self, fast=False):
+        """Run when a new node joins the network
+
+        Keyword Arguments:
+            fast {Boolean} -- Join by copying the predecessor's finger table
+                              and sending batched updates to other nodes,
+                              instead of O(M) independent lookups
+                              (default: {False})
+        """
         global M
         # Discover node through which, can enter the Chord Network
         # Implementation for expanding multicast search - Check till depth 500
@@ -322,8 +582,11 @@ class ChordNode(Node):
 
         if found_node != -1:
             # Some node has been found
-            self.__init_finger_table(found_node)
-            self.__update_others()
+            self.__init_finger_table(found_node, fast)
+            if fast:
+                self.__update_others_batched()
+            else:
+                self.__update_others()
 
             # Move keys (predecessor,n] from successor to current node
             successor = self.network_api.get_node(self.get_successor())
@@ -335,7 +598,8 @@ class ChordNode(Node):
             for i in range(M):
                 self.finger_table[i]['node'] = self.get_num()
             self.predecessor = self.get_num()
-        print(self)
+        if self.verbose:
+            print(self)
 
     def search(self, key):
         """Searches the Chord DHT for the key
@@ -348,9 +612,14 @@ class ChordNode(Node):
                                       Value of the key if present, else -1, Path
         """
         store_key = hash_key(key)
-        best_node, num_hops, path = self.find_successor(store_key)
+        self.num_originated += 1
+        trace = self.begin_trace('search', store_key)
+        best_node, num_hops, path = self.find_successor(store_key, trace)
+        if trace is not None:
+            trace.end(best_node, num_hops)
         # Check if best_node has store_key or not
         node = self.network_api.get_node(best_node)
+        node.num_terminated += 1
         if store_key in node.data_store:
             return num_hops, node.data_store[store_key], path
         return num_hops, -1, []
@@ -366,9 +635,103 @@ class ChordNode(Node):
             Integer -- Returns -1 if key couldn't be stored, else returns 0
         """
         stored_key = hash_key(key)
-        key_node, num_hops, path = self.find_successor(stored_key)
+        self.num_originated += 1
+        trace = self.begin_trace('store', stored_key)
+        key_node, num_hops, path = self.find_successor(stored_key, trace)
+        if trace is not None:
+            trace.end(key_node, num_hops)
         node = self.network_api.get_node(key_node)
+        node.num_terminated += 1
         if stored_key in node.data_store:
             return -1
         node.data_store[stored_key] = val
         return 0
+
+    def key_hash(self, key):
+        """
+        Arguments:
+            key {Integer}
+
+        Returns:
+            Integer -- Hash of key on the ring
+        """
+        return hash_key(key)
+
+    def leave(self):
+        """Leave the ring gracefully, see depart_network
+
+        Returns:
+            Boolean -- True if the node has left the network
+        """
+        return self.depart_network()
+
+    def lookup(self, key_hash, path=None):
+        """Route a lookup for key_hash to its successor
+
+        Arguments:
+            key_hash {Integer}
+
+        Keyword Arguments:
+            path {List} -- If given, the nodes visited are appended to it
+                           (default: {None})
+
+        Returns:
+            Integer, Integer -- Node Id of the successor of the key, Num hops
+        """
+        self.num_originated += 1
+        owner, num_hops, l_path = self.find_successor(key_hash)
+        if path is not None:
+            path.extend(l_path)
+        self.network_api.get_node(owner).num_terminated += 1
+        return owner, num_hops
+
+    def put(self, key, val):
+        """Same as store_key
+
+        Arguments:
+            key {Integer}
+            val {Integer}
+
+        Returns:
+            Integer -- Returns -1 if key couldn't be stored, else returns 0
+        """
+        return self.store_key(key, val)
+
+    def get(self, key):
+        """Same as search, without the path
+
+        Arguments:
+            key {Integer}
+
+        Returns:
+            Integer, Integer -- Num hops, Value of the key if present, else -1
+        """
+        num_hops, value, path = self.search(key)
+        return num_hops, value
+
+    @classmethod
+    def batch_lookup(cls, network, sources, key_hashes):
+        """Route lookups for key_hashes started at sources, all together with
+        the vectorized engine of chord_batch
+
+        Arguments:
+            network {Network}
+            sources {ndarray} -- Node ids on which the lookups start
+            key_hashes {ndarray} -- Hashes of the keys to be looked up
+
+        Returns:
+            ndarray, ndarray -- Node Id of the owner of each key (-1 if the
+                                lookup failed), Num hops of each lookup
+        """
+        sources = np.asarray(sources, dtype=np.int64)
+        nums, fingers = chord_batch.export_ring(network)
+        routed = np.zeros(len(nums), dtype=np.int64)
+        owners, hops = chord_batch.batch_lookup(network,
+                                                nums,
+                                                fingers,
+                                                sources,
+                                                np.asarray(key_hashes,
+                                                           dtype=np.int64),
+                                                routed=routed)
+        add_batch_load(network, nums, routed, sources, owners)
+        return owners, hops
@@ -0,0 +1,346 @@
+"""
+Side by Side Comparison of the Overlays
+Runs the same workload, on the same network topology and with the same node
+ids, against every overlay implementing OverlayNode (Chord, Pastry and
+Kademlia), and reports the throughput, the latency, hops and messages of the
+lookups and the memory per node of each. Results are written as JSON and
+printed as a table.
+"""
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import platform
+import tempfile
+import tracemalloc
+import numpy as np
+from chord_node import ChordNode
+from pastry_node import PastryNode
+from kademlia_node import KademliaNode
+from modules.network import Network
+from modules.metrics import MetricsCollector
+from modules.workload import make_keys, generate_workload
+
+if len(sys.argv) < 3:
+    print('Usage: python compare.py <num-nodes> <output-json>')
+    sys.exit(0)
+
+num_nodes = int(sys.argv[1])
+output_file = sys.argv[2]
+
+seed = 1
+m = 24
+l = 6
+b = 4
+k = 20
+alpha = 3
+num_joins = 100
+num_points = 10000
+num_lookups = 100000
+workload_operations = 100000
+key_distribution = 'zipf'
+zipf_exponent = 0.99
+operation_mix = {'get': 0.9, 'put': 0.05, 'join': 0.025, 'leave': 0.025}
+
+
+def hash_int(integer, bits):
+    """Hash the given integer and trim to the given number of bits
+
+    Arguments:
+        integer {Integer}
+        bits {Integer}
+
+    Returns:
+        String -- hex string of the hash
+    """
+    name = str(integer)
+    node_hash = int(hashlib.sha1(name.encode('utf-8')).hexdigest(), 16)
+    return format(node_hash >> (160 - bits), '0' + str((bits + 3) // 4) + 'x')
+
+
+def new_chord(i, network):
+    return ChordNode(i, hash_int(i, m), network, m)
+
+
+def new_pastry(i, network):
+    return PastryNode(i, hash_int(i, l * b), network, l, b)
+
+
+def new_kademlia(i, network):
+    return KademliaNode(i, hash_int(i, m), network, m, k=k, alpha=alpha)
+
+
+# Overlay name -> OverlayNode class, function making the node of a Network
+# Id, and arguments of its join
+OVERLAYS = {
+    'chord': (ChordNode, new_chord, {
+        'fast': True
+    }),
+    'pastry': (PastryNode, new_pastry, {}),
+    'kademlia': (KademliaNode, new_kademlia, {}),
+}
+
+
+def new_topology(num_switches):
+    """Generate the links between the switches, shared by all the overlays
+
+    Arguments:
+        num_switches {Integer}
+
+    Returns:
+        Dict -- switch -> list of the switches connected to it
+    """
+    random.seed(seed)
+    with tempfile.TemporaryDirectory() as directory:
+        network = Network(num_switches,
+                          file_name=os.path.join(directory, 'links.dat'))
+    return network.dict
+
+
+def run_overlay(name, topology):
+    """Run every phase of the comparison against one overlay
+
+    Arguments:
+        name {String} -- Key of OVERLAYS
+        topology {Dict} -- Links between the switches
+
+    Returns:
+        Dict -- Throughput (operations per second), memory per node and
+                statistics of every phase
+    """
+    overlay, new_node, join_args = OVERLAYS[name]
+    # Same placement of the nodes, sources and values for every overlay
+    random.seed(seed)
+    rng = random.Random(seed)
+    network = Network(2 * num_nodes,
+                      adjacency={
+                          switch: list(links)
+                          for switch, links in topology.items()
+                      })
+    collectors = {}
+    throughput = {}
+    nums = []
+
+    def join(i):
+        node = new_node(i, network)
+        if not network.add_node(node):
+            return False
+        node.join(**join_args)
+        nums.append(node.get_num())
+        return True
+
+    def source():
+        return network.get_node(rng.choice(nums))
+
+    # Build, tracing the memory held by the overlay
+    tracemalloc.start()
+    start = time.perf_counter()
+    next_id = 0
+    while len(nums) < num_nodes:
+        join(next_id)
+        next_id += 1
+    build_seconds = time.perf_counter() - start
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    throughput['build'] = num_nodes / build_seconds
+
+    # Joins into the built overlay
+    start = time.perf_counter()
+    joined = 0
+    while joined < num_joins:
+        joined += join(next_id)
+        next_id += 1
+    throughput['join'] = num_joins / (time.perf_counter() - start)
+
+    # Puts, lookups and gets, one at a time
+    data_store = {}
+    collector = collectors.setdefault('put', MetricsCollector())
+    for key in range(num_points):
+        value = rng.randint(0, 2 * num_points)
+        node = source()
+        start = time.perf_counter()
+        stored = node.put(key, value)
+        collector.record(0, latency=time.perf_counter() - start)
+        if stored == 0:
+            data_store[key] = value
+        else:
+            collector.error('not_stored')
+    keys = list(data_store)
+
+    collector = collectors.setdefault('lookup', MetricsCollector())
+    for _ in range(num_lookups):
+        node = source()
+        key_hash = node.key_hash(rng.choice(keys))
+        start = time.perf_counter()
+        owner, hops = node.lookup(key_hash)
+        collector.record(hops,
+                         latency=time.perf_counter() - start,
+                         error='not_found' if owner == -1 else None)
+
+    # Network latency of the lookups, in proximity units, and messages sent
+    # (nodes routing or answering) per lookup
+    routed = sum(node.stats()['routed'] for node in network.nodes.values())
+    latencies = []
+    for _ in range(num_lookups):
+        node = source()
+        owner, hops, latency = node.lookup_latency(
+            node.key_hash(rng.choice(keys)))
+        latencies.append(latency)
+    messages = (sum(node.stats()['routed']
+                    for node in network.nodes.values()) - routed) / num_lookups
+    network_latency = {
+        'avg': float(np.mean(latencies)),
+        'p50': float(np.percentile(latencies, 50)),
+        'p99': float(np.percentile(latencies, 99)),
+    }
+
+    collector = collectors.setdefault('get', MetricsCollector())
+    for _ in range(num_lookups):
+        node = source()
+        key = rng.choice(keys)
+        start = time.perf_counter()
+        hops, value = node.get(key)
+        error = None
+        if value != data_store[key]:
+            error = 'not_found' if value == -1 else 'wrong_value'
+        collector.record(hops,
+                         latency=time.perf_counter() - start,
+                         error=error)
+
+    # The same lookups, resolved together
+    sources = np.array([source().get_num() for _ in range(num_lookups)],
+                       dtype=np.int64)
+    node = source()
+    key_hashes = np.array(
+        [node.key_hash(rng.choice(keys)) for _ in range(num_lookups)],
+        dtype=np.int64)
+    start = time.perf_counter()
+    owners, hops = overlay.batch_lookup(network, sources, key_hashes)
+    elapsed = time.perf_counter() - start
+    num_failed = int(np.count_nonzero(owners == -1))
+    collectors.setdefault('batch_lookup', MetricsCollector()).record_batch(
+        hops, elapsed, errors={'not_found': num_failed} if num_failed else {})
+
+    # Mixed workload, with joins and leaves
+    operations = generate_workload(workload_operations,
+                                   make_keys(key_distribution, num_points,
+                                             zipf_exponent),
+                                   mix=operation_mix,
+                                   seed=seed)
+    start = time.perf_counter()
+    for operation in operations:
+        collector = collectors.setdefault('workload.' + operation.kind,
+                                          MetricsCollector())
+        hops = 0
+        error = None
+        begin = time.perf_counter()
+        if operation.kind == 'get':
+            hops, value = source().get(operation.key)
+            if value != data_store.get(operation.key, -1):
+                error = 'not_found' if value == -1 else 'wrong_value'
+        elif operation.kind == 'put':
+            value = rng.randint(0, 2 * num_points)
+            if source().put(operation.key, value) == 0:
+                data_store[operation.key] = value
+            elif operation.key not in data_store:
+                error = 'not_stored'
+        elif operation.kind == 'join':
+            if len(network.nodes) >= network.num_switches:
+                error = 'no_free_switch'
+            else:
+                while not join(next_id):
+                    next_id += 1
+                next_id += 1
+        elif len(nums) > 1:
+            node = source()
+            if node.leave():
+                nums.remove(node.get_num())
+        else:
+            error = 'last_node'
+        collector.record(hops,
+                         latency=time.perf_counter() - begin,
+                         error=error)
+    throughput['workload'] = workload_operations / (time.perf_counter() -
+                                                    start)
+
+    for phase in ('put', 'lookup', 'get', 'batch_lookup'):
+        throughput[phase] = collectors[phase].count / collectors[
+            phase].elapsed
+    return {
+        'throughput': throughput,
+        'memory_per_node': memory / num_nodes,
+        'network_latency': network_latency,
+        'messages_per_lookup': messages,
+        'phases': {
+            phase: collector.summary()
+            for phase, collector in collectors.items()
+        },
+    }
+
+
+def print_table(results):
+    """Print the main metrics of every overlay side by side
+
+    Arguments:
+        results {Dict} -- Overlay name -> result of run_overlay
+    """
+    rows = [('memory per node (bytes)',
+             lambda result: result['memory_per_node'])]
+    for phase in ('build', 'join', 'put', 'lookup', 'get', 'batch_lookup',
+                  'workload'):
+        rows.append((phase + ' ops/s',
+                     lambda result, phase=phase: result['throughput'][phase]))
+    for phase in ('lookup', 'get'):
+        rows.append(
+            (phase + ' avg hops',
+             lambda result, phase=phase: result['phases'][phase]['avg_hops']))
+        for quantile in ('p50', 'p99'):
+            rows.append((phase + ' ' + quantile + ' latency (us)',
+                         lambda result, phase=phase, quantile=quantile: 1e6 *
+                         result['phases'][phase]['latency'][quantile]))
+        rows.append((phase + ' failures', lambda result, phase=phase: sum(
+            result['phases'][phase]['errors'].values())))
+    for quantile in ('avg', 'p50', 'p99'):
+        rows.append(('lookup ' + quantile + ' network latency',
+                     lambda result, quantile=quantile: result[
+                         'network_latency'][quantile]))
+    rows.append(('lookup messages',
+                 lambda result: result['messages_per_lookup']))
+
+    print(format('', '28') + ''.join(format(name, '>14') for name in results))
+    for label, value in rows:
+        print(
+            format(label, '28') +
+            ''.join(format(value(result), '>14.2f')
+                    for result in results.values()))
+
+
+topology = new_topology(2 * num_nodes)
+results = {}
+for name in OVERLAYS:
+    print('Running ' + name)
+    results[name] = run_overlay(name, topology)
+print_table(results)
+
+report = {
+    'meta': {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'seed': seed,
+        'num_nodes': num_nodes,
+        'num_joins': num_joins,
+        'num_points': num_points,
+        'num_lookups': num_lookups,
+        'workload_operations': workload_operations,
+        'key_distribution': key_distribution,
+        'operation_mix': operation_mix,
+        'k': k,
+        'alpha': alpha,
+    },
+    'results': results,
+}
+with open(output_file, 'w') as f:
+    json.dump(report, f, indent=2)
+print('Comparison written to ' + output_file)
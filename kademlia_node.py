@@ -0,0 +1,461 @@
+"""Class Definition for KademliaNode"""
+import random
+import hashlib
+import numpy as np
+from modules.network import OverlayNode
+
+BITS = 0
+HASH_BITS = 160
+
+
+def hash_key(integer):
+    """Hash the given integers and trim to BITS bits
+
+    Arguments:
+        integer {Integer}
+
+    Returns:
+        Integer -- Hashed Integer Value
+    """
+    name = str(integer)
+    m = hashlib.sha1(name.encode('utf-8'))
+    return int(m.hexdigest(), 16) >> (HASH_BITS - BITS)
+
+
+def bucket_range(num, i):
+    """Range of the node ids which fall in the ith k-bucket of num: the ids
+    sharing the bits of num above bit i, and differing at bit i
+
+    Arguments:
+        num {Integer} -- Node id
+        i {Integer} -- Index of the bucket
+
+    Returns:
+        Integer, Integer -- First id of the range, id after the last one
+    """
+    start = ((num >> i) ^ 1) << i
+    return start, start + (1 << i)
+
+
+def build_buckets(network, nodes, seed=None):
+    """Fill the k-buckets of all the nodes at once, from the full list of
+    nodes, instead of joining the nodes one at a time. Every bucket gets up
+    to k nodes drawn at random from its range.
+
+    Arguments:
+        network {Network}
+        nodes {List} -- KademliaNode instances, all added to the network
+
+    Keyword Arguments:
+        seed {Integer} -- Seed of the draws (default: {None})
+    """
+    rng = np.random.default_rng(seed)
+    nums = np.array(sorted(node.get_num() for node in nodes), dtype=np.int64)
+    for node in nodes:
+        for i in range(node.bits):
+            start, end = bucket_range(node.get_num(), i)
+            lo, hi = np.searchsorted(nums, [start, end]).tolist()
+            if hi - lo > node.k:
+                members = nums[rng.choice(np.arange(lo, hi),
+                                          node.k,
+                                          replace=False)]
+            else:
+                members = nums[lo:hi]
+            node.buckets[i] = members.tolist()
+
+
+class KademliaNode(OverlayNode):
+    """Implementation Class for KademliaNode, a single node instance,
+       running the Kademlia Protocol"""
+    def __init__(self,
+                 node_id,
+                 node_hash,
+                 network,
+                 bits,
+                 k=20,
+                 alpha=3,
+                 replicas=4,
+                 verbose=False):
+        """Constructor for KademliaNode
+
+        Arguments:
+            node_id {Integer} -- Network Id of the node
+            node_hash {String} -- SHA1 nodeId
+            network {Network}
+            bits {Integer} -- Number of bits in a node id (at most 160)
+
+        Keyword Arguments:
+            k {Integer} -- Size of a k-bucket, and number of nodes returned
+                           by a FIND_NODE (default: {20})
+            alpha {Integer} -- Number of FIND_NODE sent in parallel at every
+                               step of a lookup (default: {3})
+            replicas {Integer} -- Number of nodes each stored key is kept on
+                                  (default: {4})
+            verbose {Boolean} -- Print the node state once joined
+                                 (default: {False})
+        """
+        global BITS
+        if bits > HASH_BITS:
+            raise ValueError('Node ids of ' + str(bits) +
+                             ' bits are wider than the SHA1 hash')
+        super().__init__(node_id, node_hash, network)
+        BITS = bits
+        self.bits = bits
+        self.k = k
+        self.alpha = alpha
+        self.replicas = replicas
+        self.verbose = verbose
+        self.data_store = {}
+        # Bucket i holds the nodes at an XOR distance in [2^i, 2^(i+1)),
+        # least recently seen first
+        self.buckets = [[] for _ in range(bits)]
+
+    def __str__(self):
+        """Print the KademliaNode Object"""
+        print('KademliaNode: ' + str(self.get_num()))
+        for i, bucket in enumerate(self.buckets):
+            if bucket:
+                print(str(i) + '\t|\t' + str(bucket))
+        return ''
+
+    def load_counters(self):
+        """
+        Returns:
+            Dict -- Name -> value of each load counter of the node, with the
+                    keys stored and the number of nodes in its k-buckets
+        """
+        counters = super().load_counters()
+        counters['keys'] = len(self.data_store)
+        counters['state_size'] = sum(len(bucket) for bucket in self.buckets)
+        return counters
+
+    def update(self, node):
+        """Record that node has been seen. A full bucket keeps its least
+        recently seen node if it still answers, and drops it for node
+        otherwise.
+
+        Arguments:
+            node {Integer} -- Node Id
+        """
+        if node == self.get_num():
+            return
+        bucket = self.buckets[(self.get_num() ^ node).bit_length() - 1]
+        if node in bucket:
+            bucket.remove(node)
+            bucket.append(node)
+        elif len(bucket) < self.k:
+            bucket.append(node)
+        elif self.network_api.is_alive(bucket[0]):
+            bucket.append(bucket.pop(0))
+        else:
+            self.num_repairs += 1
+            bucket.pop(0)
+            bucket.append(node)
+
+    def remove_contact(self, node):
+        """Drop a node which did not answer from the k-buckets
+
+        Arguments:
+            node {Integer} -- Node Id
+        """
+        bucket = self.buckets[(self.get_num() ^ node).bit_length() - 1]
+        if node in bucket:
+            self.num_repairs += 1
+            bucket.remove(node)
+
+    def refresh(self):
+        """Periodic check of the k-buckets, run off the query path: the
+        contacts which do not answer are dropped
+        """
+        for bucket in self.buckets:
+            for node in [
+                    node for node in bucket
+                    if not self.network_api.is_alive(node)
+            ]:
+                self.num_repairs += 1
+                bucket.remove(node)
+
+    def closest(self, key_hash, count):
+        """Find the nodes of the k-buckets closest to key_hash. Buckets are
+        visited in order of XOR distance to the key, so that only the
+        buckets needed are sorted.
+
+        Arguments:
+            key_hash {Integer}
+            count {Integer} -- Number of nodes to be found
+
+        Returns:
+            List -- Node Ids, closest first
+        """
+        distance = self.get_num() ^ key_hash
+        # The buckets of the bits set in distance hold nodes closer than the
+        # current node, highest bit first, the others farther, lowest first
+        order = [i for i in range(self.bits - 1, -1, -1) if distance >> i & 1]
+        order += [i for i in range(self.bits) if not distance >> i & 1]
+        found = []
+        for i in order:
+            if self.buckets[i]:
+                found.extend(
+                    sorted(self.buckets[i], key=lambda node: node ^ key_hash))
+                if len(found) >= count:
+                    break
+        return found[:count]
+
+    def find_node(self, key_hash, sender):
+        """FIND_NODE message: the sender is recorded, and given the k nodes
+        closest to key_hash known to the current node
+
+        Arguments:
+            key_hash {Integer}
+            sender {Integer} -- Node Id of the sender
+
+        Returns:
+            List -- Node Ids, closest first
+        """
+        self.num_routed += 1
+        self.update(sender)
+        return self.closest(key_hash, self.k)
+
+    def __iterative_find(self, key_hash, find_value=False, path=None):
+        """Iterative lookup: at every step, the alpha closest nodes not yet
+        contacted are sent a FIND_NODE in parallel, and the nodes returned
+        are merged in the shortlist, until a step finds no node closer than
+        the closest one, which has answered
+
+        Arguments:
+            key_hash {Integer}
+
+        Keyword Arguments:
+            find_value {Boolean} -- Stop at the first node holding key_hash
+                                    (default: {False})
+            path {List} -- If given, the nodes contacted are appended to it
+                           (default: {None})
+
+        Returns:
+            List, Integer, Integer, Integer -- Shortlist of the closest nodes
+                                               alive, closest first, Num
+                                               steps, latency (sum over the
+                                               steps of the slowest round
+                                               trip), value (-1 if not found)
+        """
+        shortlist = self.closest(key_hash, self.k)
+        contacted = set()
+        failed = set()
+        steps = 0
+        latency = 0
+        best = -1
+        while True:
+            candidates = [
+                node for node in shortlist if node not in contacted
+            ][:self.alpha]
+            if not candidates:
+                break
+            steps += 1
+            slowest = 0
+            found = []
+            for node in candidates:
+                contacted.add(node)
+                if path is not None:
+                    path.append(node)
+                if not self.network_api.is_alive(node):
+                    # Timed out: dropped from the shortlist and the buckets
+                    failed.add(node)
+                    self.remove_contact(node)
+                    continue
+                slowest = max(slowest,
+                              2 * self.network_api.proximity(
+                                  self.get_num(), node))
+                contact = self.network_api.get_node(node)
+                if find_value and key_hash in contact.data_store:
+                    contact.num_routed += 1
+                    contact.num_terminated += 1
+                    self.update(node)
+                    return shortlist, steps, latency + slowest, \
+                        contact.data_store[key_hash]
+                found.extend(contact.find_node(key_hash, self.get_num()))
+                self.update(node)
+            latency += slowest
+            merged = set(shortlist) | set(found)
+            merged.discard(self.get_num())
+            shortlist = sorted(merged - failed,
+                               key=lambda node: node ^ key_hash)[:self.k]
+            if not shortlist:
+                break
+            if shortlist[0] == best and best in contacted:
+                break
+            best = shortlist[0]
+        shortlist = [node for node in shortlist if node not in failed]
+        return shortlist, steps, latency, -1
+
+    def __owner(self, key_hash, shortlist):
+        """
+        Returns:
+            Integer -- Node Id of the node closest to key_hash among the
+                       current node and the nodes of the shortlist alive
+        """
+        candidates = [
+            node for node in shortlist if self.network_api.is_alive(node)
+        ]
+        candidates.append(self.get_num())
+        return min(candidates, key=lambda node: node ^ key_hash)
+
+    def lookup(self, key_hash, path=None):
+        """Route a lookup for key_hash to the node XOR closest to it
+
+        Arguments:
+            key_hash {Integer}
+
+        Keyword Arguments:
+            path {List} -- If given, the nodes contacted are appended to it
+                           (default: {None})
+
+        Returns:
+            Integer, Integer -- Node Id of the owner of the key, Num steps
+        """
+        self.num_originated += 1
+        shortlist, steps = self.__iterative_find(key_hash, path=path)[:2]
+        owner = self.__owner(key_hash, shortlist)
+        self.network_api.get_node(owner).num_terminated += 1
+        return owner, steps
+
+    def lookup_latency(self, key_hash):
+        """Route a lookup for key_hash, measuring its network latency: the
+        FIND_NODE messages of a step are sent in parallel, so that each step
+        costs the slowest round trip
+
+        Arguments:
+            key_hash {Integer}
+
+        Returns:
+            Integer, Integer, Integer -- Node Id of the owner of the key, Num
+                                         steps, latency (proximity units)
+        """
+        self.num_originated += 1
+        shortlist, steps, latency = self.__iterative_find(key_hash)[:3]
+        owner = self.__owner(key_hash, shortlist)
+        self.network_api.get_node(owner).num_terminated += 1
+        return owner, steps, latency
+
+    def key_hash(self, key):
+        """
+        Arguments:
+            key {Integer}
+
+        Returns:
+            Integer -- Hash of key in the identifier space
+        """
+        return hash_key(key)
+
+    def fetch_keys(self, node):
+        """Copy the keys of node to which the current node is closer
+
+        Arguments:
+            node {KademliaNode}
+        """
+        for key_hash, val in node.data_store.items():
+            if key_hash ^ self.get_num() < key_hash ^ node.get_num():
+                self.data_store[key_hash] = val
+
+    def join(self):
+        """Join the network: the node looks up its own id through a node
+        found on the network, which fills its closest buckets and announces
+        it to the nodes contacted, then refreshes its farther buckets and
+        takes over the keys it is now closer to
+        """
+        # Implementation for expanding multicast search - Check till depth 500
+        for depth in range(500):
+            found_node = self.network_api.hop(self.get_num(), depth + 1)
+            if found_node != -1:
+                break
+
+        if found_node != -1:
+            self.update(found_node)
+            shortlist = self.__iterative_find(self.get_num())[0]
+
+            # Refresh the buckets farther than the closest node, with a
+            # lookup for a random id in each of them
+            nearest = min(
+                (self.get_num() ^ node).bit_length() - 1
+                for node in shortlist) if shortlist else 0
+            for i in range(nearest + 1, self.bits):
+                start, end = bucket_range(self.get_num(), i)
+                self.__iterative_find(random.randrange(start, end))
+
+            for node in shortlist[:self.replicas]:
+                if self.network_api.is_alive(node):
+                    self.fetch_keys(self.network_api.get_node(node))
+        if self.verbose:
+            print('Added node: ', end='')
+            print(self)
+
+    def leave(self):
+        """Leave the network gracefully: each key stored is republished to
+        the replicas nodes closest to it other than the current one, found by
+        an iterative lookup. The other nodes drop the current node from their
+        buckets when it stops answering.
+
+        Returns:
+            Boolean -- True if the node has left the network
+        """
+        for key_hash, val in self.data_store.items():
+            shortlist = self.__iterative_find(key_hash)[0]
+            candidates = [
+                node for node in shortlist if node != self.get_num()
+                and self.network_api.is_alive(node)
+            ]
+            candidates.sort(key=lambda node: node ^ key_hash)
+            for node in candidates[:self.replicas]:
+                store = self.network_api.get_node(node).data_store
+                if key_hash not in store:
+                    store[key_hash] = val
+        if self.verbose:
+            print('Deleting node: ')
+            print(self)
+        return self.network_api.remove_node(self.get_num())
+
+    def put(self, key, val):
+        """Stores the (key, value) pair on the replicas nodes XOR closest to
+        the key
+
+        Arguments:
+            key {Integer} -- Key Value
+            val {Integer} -- Value
+
+        Returns:
+            Integer -- Returns -1 if key couldn't be stored, else returns 0
+        """
+        key_hash = hash_key(key)
+        self.num_originated += 1
+        shortlist = self.__iterative_find(key_hash)[0]
+        candidates = [
+            node for node in shortlist if self.network_api.is_alive(node)
+        ]
+        candidates.append(self.get_num())
+        candidates.sort(key=lambda node: node ^ key_hash)
+        owner = self.network_api.get_node(candidates[0])
+        owner.num_terminated += 1
+        if key_hash in owner.data_store:
+            return -1
+        for node in candidates[:self.replicas]:
+            self.network_api.get_node(node).data_store[key_hash] = val
+        return 0
+
+    def get(self, key):
+        """Fetches the value of key, answered by the first node holding it
+        among the nodes contacted by the lookup
+
+        Arguments:
+            key {Integer} -- Key to be fetched
+
+        Returns:
+            Integer, Integer -- Num steps, Value of the key if present,
+                                else -1
+        """
+        key_hash = hash_key(key)
+        self.num_originated += 1
+        if key_hash in self.data_store:
+            self.num_terminated += 1
+            return 0, self.data_store[key_hash]
+        shortlist, steps, latency, value = self.__iterative_find(
+            key_hash, find_value=True)
+        return steps, value
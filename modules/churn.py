@@ -0,0 +1,344 @@
+"""Churn Generation and Statistics for the Experiment Drivers"""
+import csv
+import json
+import math
+import heapq
+import random
+
+
+class ExponentialSessions:
+    """Session times drawn from an exponential distribution"""
+    def __init__(self, mean):
+        """
+        Arguments:
+            mean {Float} -- Mean session time (seconds)
+        """
+        self.mean = mean
+
+    def sample(self, rng):
+        """
+        Arguments:
+            rng {random.Random}
+
+        Returns:
+            Float -- Session time (seconds)
+        """
+        return rng.expovariate(1 / self.mean)
+
+
+class ParetoSessions:
+    """
+    Session times drawn from a Pareto distribution: most sessions are short,
+    and a few nodes stay for very long
+    """
+    def __init__(self, mean, shape=2.0):
+        """
+        Arguments:
+            mean {Float} -- Mean session time (seconds)
+
+        Keyword Arguments:
+            shape {Float} -- Tail index, greater than 1 (default: {2.0})
+        """
+        if shape <= 1:
+            raise ValueError('The shape of Pareto sessions must exceed 1')
+        self.mean = mean
+        self.shape = shape
+        self.scale = mean * (shape - 1) / shape
+
+    def sample(self, rng):
+        """
+        Arguments:
+            rng {random.Random}
+
+        Returns:
+            Float -- Session time (seconds)
+        """
+        return self.scale * rng.paretovariate(self.shape)
+
+
+class WeibullSessions:
+    """
+    Session times drawn from a Weibull distribution, which fits measured
+    peer-to-peer session times with a shape below 1
+    """
+    def __init__(self, mean, shape=0.5):
+        """
+        Arguments:
+            mean {Float} -- Mean session time (seconds)
+
+        Keyword Arguments:
+            shape {Float} -- Shape of the distribution (default: {0.5})
+        """
+        self.mean = mean
+        self.shape = shape
+        self.scale = mean / math.gamma(1 + 1 / shape)
+
+    def sample(self, rng):
+        """
+        Arguments:
+            rng {random.Random}
+
+        Returns:
+            Float -- Session time (seconds)
+        """
+        return rng.weibullvariate(self.scale, self.shape)
+
+
+def make_sessions(name, mean):
+    """
+    Arguments:
+        name {String} -- 'exponential', 'pareto' or 'weibull'
+        mean {Float} -- Mean session time (seconds)
+
+    Returns:
+        ExponentialSessions, ParetoSessions or WeibullSessions
+    """
+    if name == 'exponential':
+        return ExponentialSessions(mean)
+    if name == 'pareto':
+        return ParetoSessions(mean)
+    if name == 'weibull':
+        return WeibullSessions(mean)
+    raise ValueError('Unknown session distribution: ' + str(name))
+
+
+class ChurnSchedule:
+    """
+    Discrete event schedule of a churn experiment. Nodes arrive as a Poisson
+    process, each node leaves at the end of a session drawn from the session
+    distribution, crashing instead of leaving gracefully with probability
+    crash_fraction, and lookups arrive as a Poisson process.
+
+    With a join rate of num_nodes / mean session time, the size of the
+    overlay stays around num_nodes.
+    """
+    def __init__(self,
+                 sessions,
+                 join_rate,
+                 lookup_rate,
+                 crash_fraction=0.5,
+                 maintenance_period=0,
+                 seed=None):
+        """
+        Arguments:
+            sessions {ExponentialSessions, ParetoSessions or WeibullSessions}
+            join_rate {Float} -- Node arrivals per second
+            lookup_rate {Float} -- Lookups per second
+
+        Keyword Arguments:
+            crash_fraction {Float} -- Fraction of the departures which are
+                                      crashes (default: {0.5})
+            maintenance_period {Float} -- Seconds between two maintenance
+                                          rounds, 0 for none (default: {0})
+            seed {Integer} -- Seed of the schedule (default: {None})
+        """
+        self.sessions = sessions
+        self.join_rate = join_rate
+        self.lookup_rate = lookup_rate
+        self.crash_fraction = crash_fraction
+        self.maintenance_period = maintenance_period
+        self.rng = random.Random(seed)
+        self.queue = []
+        self.count = 0
+
+    def __push(self, time, kind, node=None):
+        # count breaks ties, so that events at the same time keep their order
+        heapq.heappush(self.queue, (time, self.count, kind, node))
+        self.count += 1
+
+    def add_node(self, node, now):
+        """Schedule the departure of a node which is in the overlay at now
+
+        Arguments:
+            node {Integer} -- Node Id, as known to the driver
+            now {Float} -- Current time (seconds)
+        """
+        kind = 'crash' if self.rng.random() < self.crash_fraction else 'leave'
+        self.__push(now + self.sessions.sample(self.rng), kind, node)
+
+    def events(self, duration):
+        """Generate the events until duration, in time order. Nodes added
+        with add_node while the events are consumed are scheduled too.
+
+        Arguments:
+            duration {Float} -- Length of the experiment (seconds)
+
+        Yields:
+            Float, String, Integer -- Time, kind ('join', 'leave', 'crash',
+                                      'lookup' or 'maintenance') and Node Id
+                                      (None but for departures)
+        """
+        if self.join_rate > 0:
+            self.__push(self.rng.expovariate(self.join_rate), 'join')
+        if self.lookup_rate > 0:
+            self.__push(self.rng.expovariate(self.lookup_rate), 'lookup')
+        if self.maintenance_period > 0:
+            self.__push(self.maintenance_period, 'maintenance')
+        while self.queue and self.queue[0][0] < duration:
+            time, _, kind, node = heapq.heappop(self.queue)
+            if kind == 'join':
+                self.__push(time + self.rng.expovariate(self.join_rate),
+                            'join')
+            elif kind == 'lookup':
+                self.__push(time + self.rng.expovariate(self.lookup_rate),
+                            'lookup')
+            elif kind == 'maintenance':
+                self.__push(time + self.maintenance_period, 'maintenance')
+            yield time, kind, node
+
+
+class ChurnStats:
+    """
+    Statistics of a churn experiment over windows of time: routing success
+    rate, data availability, hops and hop inflation, membership changes and
+    repair traffic. A lookup is routed correctly if it ends at the live owner
+    of its key, and the key is available if the value fetched is the one
+    stored, so keys lost with crashed nodes do not count as routing failures.
+    The repairs are counted from the num_repairs counters of the nodes, so
+    the counters of departing nodes are kept as they leave.
+    """
+    def __init__(self, network, window, expected_hops):
+        """
+        Arguments:
+            network {Network}
+            window {Float} -- Length of a window (seconds)
+            expected_hops {Function} -- Num nodes -> Average hops of the
+                                        protocol on a stable overlay
+        """
+        self.network = network
+        self.window = window
+        self.expected_hops = expected_hops
+        self.rows = []
+        self.end = window
+        self.departed_repairs = 0
+        self.last_repairs = self.__repairs()
+        self.__reset()
+
+    def __reset(self):
+        self.lookups = 0
+        self.misroutes = 0
+        self.failures = 0
+        self.hops = 0
+        self.changes = {'join': 0, 'leave': 0, 'crash': 0}
+
+    def __repairs(self):
+        return self.departed_repairs + sum(
+            node.num_repairs for node in self.network.nodes.values())
+
+    def advance(self, now):
+        """Close the windows which end before now
+
+        Arguments:
+            now {Float} -- Current time (seconds)
+
+        Returns:
+            List -- Statistics of the windows closed
+        """
+        rows = []
+        while now >= self.end:
+            rows.append(self.close())
+        return rows
+
+    def record_lookup(self, hops, routed=True, error=None):
+        """
+        Arguments:
+            hops {Integer} -- Num hops of the routing
+
+        Keyword Arguments:
+            routed {Boolean} -- True if the lookup reached the live owner of
+                                the key (default: {True})
+            error {String} -- Kind of failure of the fetch of the value, None
+                              if the value was found (default: {None})
+        """
+        self.lookups += 1
+        if routed:
+            self.hops += hops
+        else:
+            self.misroutes += 1
+        if error is not None:
+            self.failures += 1
+
+    def record_change(self, kind, node=None):
+        """Record a join, or a departure before it happens
+
+        Arguments:
+            kind {String} -- 'join', 'leave' or 'crash'
+
+        Keyword Arguments:
+            node {Node} -- Departing node (default: {None})
+        """
+        self.changes[kind] += 1
+        if node is not None:
+            self.departed_repairs += node.num_repairs
+
+    def close(self):
+        """Close the current window
+
+        Returns:
+            Dict -- Statistics of the window
+        """
+        num_nodes = len(self.network.nodes)
+        repairs = self.__repairs()
+        routed = self.lookups - self.misroutes
+        avg_hops = self.hops / routed if routed else 0.0
+        expected = self.expected_hops(num_nodes) if num_nodes > 1 else 0.0
+        row = {
+            'time': self.end,
+            'nodes': num_nodes,
+            'joins': self.changes['join'],
+            'leaves': self.changes['leave'],
+            'crashes': self.changes['crash'],
+            'lookups': self.lookups,
+            'routing_success_rate': (routed / self.lookups
+                                     if self.lookups else 1.0),
+            'availability': (1 - self.failures / self.lookups
+                             if self.lookups else 1.0),
+            'avg_hops': avg_hops,
+            'hop_inflation': avg_hops / expected if expected else 0.0,
+            'repairs': repairs - self.last_repairs,
+            'repairs_per_second': (repairs - self.last_repairs) / self.window,
+        }
+        self.rows.append(row)
+        self.last_repairs = repairs
+        self.end += self.window
+        self.__reset()
+        return row
+
+
+def format_row(row):
+    """
+    Arguments:
+        row {Dict} -- Statistics of a window
+
+    Returns:
+        String -- One line summary of the window
+    """
+    return ('t=' + format(row['time'], '.0f') + 's nodes ' +
+            str(row['nodes']) + ' joins ' + str(row['joins']) + ' leaves ' +
+            str(row['leaves']) + ' crashes ' + str(row['crashes']) +
+            ' | lookups ' + str(row['lookups']) + ' routed ' +
+            format(row['routing_success_rate'], '.4f') + ' available ' +
+            format(row['availability'], '.4f') + ' hops ' +
+            format(row['avg_hops'], '.2f') + ' inflation ' +
+            format(row['hop_inflation'], '.2f') + ' | repairs/s ' +
+            format(row['repairs_per_second'], '.2f'))
+
+
+def write_churn(rows, file_name):
+    """Write the statistics of the windows of a churn experiment, as JSON, or
+    as CSV if file_name ends with .csv
+
+    Arguments:
+        rows {List} -- Rows of ChurnStats
+        file_name {String}
+    """
+    if not file_name.endswith('.csv'):
+        with open(file_name, 'w') as f:
+            json.dump(rows, f, indent=2)
+        return
+    with open(file_name, 'w', newline='') as f:
+        writer = csv.writer(f)
+        if rows:
+            writer.writerow(list(rows[0]))
+        for row in rows:
+            writer.writerow(list(row.values()))
@@ -0,0 +1,250 @@
+"""Sorted Leaf Set Implementation for Pastry"""
+import bisect
+import heapq
+
+
+class LeafSet:
+    """
+    Leaf set of a Pastry node, kept sorted in ring order around the owner.
+
+    Members are stored by their clockwise offset from the owner, in ascending
+    order. Members in the clockwise half of the ring are the successors, those
+    in the other half the predecessors, and each side keeps at most L / 2 of
+    the numerically closest nodes, so that both extremes are available in O(1)
+    and the closest member to a key is found with a single bisection.
+    """
+    def __init__(self, owner, size, space):
+        """
+        Arguments:
+            owner {Integer} -- Node Id of the node owning the leaf set
+            size {Integer} -- Maximum number of nodes in the leaf set (L)
+            space {Integer} -- Size of the identifier space
+        """
+        self.owner = owner
+        self.size = size
+        self.half = size // 2
+        self.space = space
+        self.offsets = []
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __iter__(self):
+        """Iterate over the node ids, successors first (in ring order)"""
+        for offset in self.offsets:
+            yield (self.owner + offset) % self.space
+
+    def __contains__(self, node):
+        offset = (node - self.owner) % self.space
+        index = bisect.bisect_left(self.offsets, offset)
+        return index < len(self.offsets) and self.offsets[index] == offset
+
+    def is_full(self):
+        """
+        Returns:
+            Boolean -- True if the leaf set holds size nodes
+        """
+        return len(self.offsets) >= self.size
+
+    def add(self, node, evicted=None):
+        """Insert node, evicting the farthest node of its side if that side
+        is full
+
+        Arguments:
+            node {Integer} -- Node Id to be inserted
+
+        Keyword Arguments:
+            evicted {List} -- If given, the Node Id of any member evicted is
+                              appended to it (default: {None})
+
+        Returns:
+            Boolean -- True if node is a member of the leaf set afterwards
+        """
+        offset = (node - self.owner) % self.space
+        if offset == 0:
+            return False
+        index = bisect.bisect_left(self.offsets, offset)
+        if index < len(self.offsets) and self.offsets[index] == offset:
+            return True
+        self.offsets.insert(index, offset)
+        split = self.__split()
+        if index < split and split > self.half:
+            # Farthest successor
+            evicted_offset = self.offsets.pop(split - 1)
+        elif index >= split and len(self.offsets) - split > self.half:
+            # Farthest predecessor
+            evicted_offset = self.offsets.pop(split)
+        else:
+            return True
+        if evicted_offset == offset:
+            return False
+        if evicted is not None:
+            evicted.append((self.owner + evicted_offset) % self.space)
+        return True
+
+    def remove(self, node):
+        """Remove node from the leaf set, if present
+
+        Arguments:
+            node {Integer} -- Node Id to be removed
+
+        Returns:
+            Boolean -- True if node was removed
+        """
+        offset = (node - self.owner) % self.space
+        index = bisect.bisect_left(self.offsets, offset)
+        if index < len(self.offsets) and self.offsets[index] == offset:
+            del self.offsets[index]
+            return True
+        return False
+
+    def merge(self, nodes, exclude=None, evicted=None):
+        """Merge an iterable of candidate nodes into the leaf set
+
+        Arguments:
+            nodes {Iterable} -- Node Ids that can potentially be added
+
+        Keyword Arguments:
+            exclude {Set} -- Node Ids that must not be added (default: {None})
+            evicted {List} -- If given, the Node Ids of the members evicted
+                              are appended to it (default: {None})
+        """
+        mid = (self.space + 1) // 2
+        successors = []
+        predecessors = []
+        for node in nodes:
+            if exclude and node in exclude:
+                continue
+            offset = (node - self.owner) % self.space
+            if offset == 0:
+                continue
+            if offset < mid:
+                successors.append(offset)
+            else:
+                predecessors.append(offset)
+        # Only the closest half of the candidates on each side can be kept
+        offsets = heapq.nsmallest(self.half, successors) + heapq.nlargest(
+            self.half, predecessors)
+        for offset in offsets:
+            self.add((self.owner + offset) % self.space, evicted)
+
+    def load(self, nodes):
+        """Replace all the members with nodes, already known to be the
+        closest nodes on both sides
+
+        Arguments:
+            nodes {Iterable} -- Node Ids of the new members
+        """
+        self.offsets = sorted((node - self.owner) % self.space
+                              for node in nodes if node != self.owner)
+        split = self.__split()
+        self.offsets = (self.offsets[:min(split, self.half)] +
+                        self.offsets[max(split, len(self.offsets) -
+                                         self.half):])
+
+    def __split(self):
+        """Index of the first predecessor in the offsets list: the leaf set is
+        split between the two halves of the ring"""
+        return bisect.bisect_left(self.offsets, (self.space + 1) // 2)
+
+    def max_extreme(self):
+        """Farthest successor in the leaf set (left extreme)
+
+        Returns:
+            Integer -- Node Id of the extreme node (owner if no successor)
+        """
+        split = self.__split()
+        if split == 0:
+            return self.owner
+        return (self.owner + self.offsets[split - 1]) % self.space
+
+    def min_extreme(self):
+        """Farthest predecessor in the leaf set (right extreme)
+
+        Returns:
+            Integer -- Node Id of the extreme node (owner if no predecessor)
+        """
+        split = self.__split()
+        if split == len(self.offsets):
+            return self.owner
+        return (self.owner + self.offsets[split]) % self.space
+
+    def is_successor(self, node):
+        """Check on which side of the owner a member lies
+
+        Arguments:
+            node {Integer} -- Node Id of a member of the leaf set
+
+        Returns:
+            Boolean -- True if node is in the successor half
+        """
+        offset = (node - self.owner) % self.space
+        return bisect.bisect_left(self.offsets, offset) < self.__split()
+
+    def in_range(self, key):
+        """Check if key lies within the range covered by the leaf set
+
+        Arguments:
+            key {Integer}
+
+        Returns:
+            Boolean -- True if key is strictly between the two extremes
+        """
+        split = self.__split()
+        offset = (key - self.owner) % self.space
+        if split > 0 and offset < self.offsets[split - 1]:
+            return True
+        return split < len(self.offsets) and offset > self.offsets[split]
+
+    def closest(self, key):
+        """Find the numerically closest member to key
+
+        Arguments:
+            key {Integer}
+
+        Returns:
+            Integer, Integer -- Node Id of the closest member,
+                                circular distance to the key
+                                (returns -1, -1 if the leaf set is empty)
+        """
+        if not self.offsets:
+            return -1, -1
+        offset = (key - self.owner) % self.space
+        index = bisect.bisect_left(self.offsets, offset)
+        best_offset = -1
+        best_diff = -1
+        for candidate in (self.offsets[index % len(self.offsets)],
+                          self.offsets[index - 1]):
+            diff = abs(candidate - offset)
+            diff = min(diff, self.space - diff)
+            if best_diff == -1 or diff < best_diff:
+                best_diff = diff
+                best_offset = candidate
+        return (self.owner + best_offset) % self.space, best_diff
+
+    def closest_k(self, key, k):
+        """Find the k numerically closest members to key
+
+        Arguments:
+            key {Integer}
+            k {Integer} -- Number of members required
+
+        Returns:
+            List -- Node Ids of at most k members, closest first
+        """
+        num = len(self.offsets)
+        offset = (key - self.owner) % self.space
+        right = bisect.bisect_left(self.offsets, offset)
+        left = right - 1
+        result = []
+        while len(result) < min(k, num):
+            # Walk outwards from the key in both directions around the ring
+            right_diff = (self.offsets[right % num] - offset) % self.space
+            left_diff = (offset - self.offsets[left % num]) % self.space
+            if right_diff <= left_diff:
+                result.append(self.offsets[right % num])
+                right += 1
+            else:
+                result.append(self.offsets[left % num])
+                left -= 1
+        return [(self.owner + x) % self.space for x in result]
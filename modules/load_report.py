@@ -0,0 +1,114 @@
+"""Distribution of the Load over the Nodes of an Overlay"""
+import json
+import numpy as np
+
+
+def gini(values):
+    """Gini coefficient of values: 0 when the load is spread evenly, close to
+    1 when a single node carries all of it
+
+    Arguments:
+        values {ndarray} -- Non-negative values
+
+    Returns:
+        Float
+    """
+    values = np.sort(np.asarray(values, dtype=np.float64))
+    n = len(values)
+    total = values.sum()
+    if n == 0 or total == 0:
+        return 0.0
+    ranks = np.arange(1, n + 1)
+    return float(2 * np.dot(ranks, values) / (n * total) - (n + 1) / n)
+
+
+def add_batch_load(network, nums, routed, sources, owners, handed_off=None):
+    """Add the load of lookups resolved by a vectorized engine, which does
+    not go through the nodes, to their counters
+
+    Arguments:
+        network {Network}
+        nums {ndarray} -- Sorted node ids, indexing routed
+        routed {ndarray} -- Number of lookups routed through each node
+        sources {ndarray} -- Node ids on which the lookups started
+        owners {ndarray} -- Node ids on which the lookups ended (-1 if none)
+
+    Keyword Arguments:
+        handed_off {ndarray} -- Mask of the lookups finished by the nodes
+                                themselves, whose owners have already counted
+                                them (default: {None})
+    """
+    for num, count in zip(nums.tolist(), routed.tolist()):
+        if count > 0:
+            network.get_node(num).num_routed += count
+    if handed_off is not None:
+        owners = np.asarray(owners)[~handed_off]
+    for ends, counter in ((sources, 'num_originated'), (owners,
+                                                        'num_terminated')):
+        ends, counts = np.unique(ends, return_counts=True)
+        for num, count in zip(ends.tolist(), counts.tolist()):
+            if num != -1 and network.is_alive(num):
+                node = network.get_node(num)
+                setattr(node, counter, getattr(node, counter) + count)
+
+
+def load_report(network, top_k=10):
+    """Summarize the load counters of all the nodes alive in the network
+
+    Arguments:
+        network {Network}
+
+    Keyword Arguments:
+        top_k {Integer} -- Number of hot nodes reported per counter
+                           (default: {10})
+
+    Returns:
+        Dict -- Counter -> total, mean, percentiles, max, Gini coefficient
+                and top_k (Node Id, value) pairs
+    """
+    nums = list(network.nodes)
+    counters = [network.get_node(num).load_counters() for num in nums]
+    report = {}
+    if not counters:
+        return report
+    for name in counters[0]:
+        values = np.array([counter[name] for counter in counters],
+                          dtype=np.int64)
+        p50, p90, p99 = np.percentile(values, [50, 90, 99]).tolist()
+        top = np.argsort(-values, kind='stable')[:top_k]
+        report[name] = {
+            'total': int(values.sum()),
+            'mean': float(values.mean()),
+            'p50': p50,
+            'p90': p90,
+            'p99': p99,
+            'max': int(values.max()),
+            'gini': gini(values),
+            'top': [[nums[index], int(values[index])]
+                    for index in top.tolist()],
+        }
+    return report
+
+
+def print_load_report(network, file_name=None):
+    """Print a line per load counter of the nodes alive in the network, and
+    write the full report as JSON if file_name is given
+
+    Arguments:
+        network {Network}
+
+    Keyword Arguments:
+        file_name {String} -- JSON file for the report (default: {None})
+
+    Returns:
+        Dict -- Report of load_report
+    """
+    load = load_report(network)
+    for name, stats in load.items():
+        print('Load (' + name + '): mean ' + format(stats['mean'], '.1f') +
+              ', p99 ' + format(stats['p99'], '.1f') + ', max ' +
+              str(stats['max']) + ', Gini ' + format(stats['gini'], '.3f'))
+    if file_name is not None:
+        with open(file_name, 'w') as f:
+            json.dump(load, f, indent=2)
+    return load
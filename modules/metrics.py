@@ -0,0 +1,202 @@
+"""Streaming Statistics for the Experiment Drivers"""
+import csv
+import json
+import math
+import numpy as np
+
+
+class LatencyHistogram:
+    """
+    HDR style histogram of latencies: values are counted in buckets whose
+    bounds grow geometrically by (1 + precision), so that any quantile is
+    known within the given relative precision, with memory bounded by the
+    number of buckets covering [min_value, max_value], however many values
+    are recorded.
+    """
+    def __init__(self, precision=0.01, min_value=1e-7, max_value=1e3):
+        """
+        Keyword Arguments:
+            precision {Float} -- Relative precision of the quantiles
+                                 (default: {0.01})
+            min_value {Float} -- Values below are counted as min_value
+                                 (default: {1e-7})
+            max_value {Float} -- Values above are counted as max_value
+                                 (default: {1e3})
+        """
+        self.base = math.log(1 + precision)
+        self.min_value = min_value
+        self.num_buckets = int(math.log(max_value / min_value) /
+                               self.base) + 1
+        self.buckets = {}
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, value):
+        """
+        Arguments:
+            value {Float} -- Latency, in seconds
+        """
+        index = 0
+        if value > self.min_value:
+            index = min(int(math.log(value / self.min_value) / self.base),
+                        self.num_buckets - 1)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """
+        Arguments:
+            q {Float} -- Quantile, in [0, 1]
+
+        Returns:
+            Float -- Upper bound of the bucket holding the quantile
+        """
+        if self.count == 0:
+            return 0
+        rank = q * self.count
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                break
+        return min(self.min_value * math.exp(self.base * (index + 1)),
+                   self.max)
+
+
+class MetricsCollector:
+    """
+    Collects the outcome of lookups as they are made: a histogram of the hop
+    counts, a LatencyHistogram and the number of errors of each kind. Memory
+    does not grow with the number of lookups, so that the drivers can run
+    millions of queries without keeping or printing per query results.
+    """
+    def __init__(self, max_hops=None):
+        """
+        Keyword Arguments:
+            max_hops {Integer} -- Hop counts above are counted as max_hops
+                                  (default: {None})
+        """
+        self.max_hops = max_hops
+        self.hops = {}
+        self.latency = LatencyHistogram()
+        self.errors = {}
+        self.count = 0
+        self.elapsed = 0
+
+    def record(self, hops, latency=None, error=None):
+        """Record one lookup
+
+        Arguments:
+            hops {Integer} -- Num hops of the lookup
+
+        Keyword Arguments:
+            latency {Float} -- Duration of the lookup, in seconds
+                               (default: {None})
+            error {String} -- Kind of error, if the lookup failed
+                              (default: {None})
+        """
+        if self.max_hops is not None:
+            hops = min(hops, self.max_hops)
+        self.hops[hops] = self.hops.get(hops, 0) + 1
+        self.count += 1
+        if latency is not None:
+            self.latency.record(latency)
+            self.elapsed += latency
+        if error is not None:
+            self.errors[error] = self.errors.get(error, 0) + 1
+
+    def record_batch(self, hops, elapsed, errors=None):
+        """Record lookups resolved together, whose latencies are not known
+        individually
+
+        Arguments:
+            hops {ndarray} -- Num hops of each lookup
+            elapsed {Float} -- Duration of the whole batch, in seconds
+
+        Keyword Arguments:
+            errors {Dict} -- Kind of error -> Number of lookups
+                             (default: {None})
+        """
+        hops = np.asarray(hops, dtype=np.int64)
+        if self.max_hops is not None:
+            hops = np.minimum(hops, self.max_hops)
+        counts = np.bincount(hops)
+        for k in np.nonzero(counts)[0].tolist():
+            self.hops[k] = self.hops.get(k, 0) + int(counts[k])
+        self.count += len(hops)
+        self.elapsed += elapsed
+        for error, count in (errors or {}).items():
+            self.errors[error] = self.errors.get(error, 0) + count
+
+    def error(self, error):
+        """Count an error not tied to a recorded lookup
+
+        Arguments:
+            error {String} -- Kind of error
+        """
+        self.errors[error] = self.errors.get(error, 0) + 1
+
+    def hop_distribution(self):
+        """
+        Returns:
+            Dict -- Num hops -> Fraction of the lookups
+        """
+        return {
+            k: self.hops[k] / self.count
+            for k in sorted(self.hops)
+        } if self.count > 0 else {}
+
+    def summary(self):
+        """
+        Returns:
+            Dict -- Statistics of the lookups recorded
+        """
+        distribution = self.hop_distribution()
+        result = {
+            'lookups': self.count,
+            'avg_hops': sum(k * p for k, p in distribution.items()),
+            'hops': {str(k): p for k, p in distribution.items()},
+            'errors': dict(self.errors),
+            'seconds': self.elapsed,
+        }
+        if self.latency.count > 0:
+            result['latency'] = {
+                'mean': self.latency.total / self.latency.count,
+                'p50': self.latency.quantile(0.5),
+                'p90': self.latency.quantile(0.9),
+                'p99': self.latency.quantile(0.99),
+                'p999': self.latency.quantile(0.999),
+                'max': self.latency.max,
+            }
+        return result
+
+
+def write_metrics(collectors, file_name):
+    """Write the summaries of the collectors, as JSON or as CSV rows of
+    (phase, metric, value), depending on the extension of file_name
+
+    Arguments:
+        collectors {Dict} -- Phase name -> MetricsCollector
+        file_name {String}
+    """
+    summaries = {
+        phase: collector.summary()
+        for phase, collector in collectors.items()
+    }
+    if not file_name.endswith('.csv'):
+        with open(file_name, 'w') as f:
+            json.dump(summaries, f, indent=2)
+        return
+    with open(file_name, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['phase', 'metric', 'value'])
+        for phase, summary in summaries.items():
+            for metric, value in summary.items():
+                if isinstance(value, dict):
+                    for key, entry in value.items():
+                        writer.writerow([phase, metric + '.' + key, entry])
+                else:
+                    writer.writerow([phase, metric, value])
@@ -0,0 +1,149 @@
+"""Bounded Neighborhood Set Implementation for Pastry"""
+import heapq
+
+REMOVED = -1
+
+
+class NeighborhoodSet:
+    """
+    Neighborhood set of a Pastry node: the |M| nodes closest to it as per the
+    proximity metric.
+
+    Members are kept in a max-heap keyed by their cached distance, so that the
+    farthest member is evicted in O(log |M|) and the proximity metric is never
+    recomputed for a member. Removed members are only marked in the heap, and
+    discarded once they reach the top, or when marked entries make up half of
+    the heap, which is then rebuilt. The nearest member, only needed on
+    repairs, is found by a scan of the |M| cached distances.
+    """
+    def __init__(self, size):
+        """
+        Arguments:
+            size {Integer} -- Maximum number of nodes in the set (|M|)
+        """
+        self.size = size
+        self.heap = []
+        self.entries = {}
+        self.counter = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(list(self.entries))
+
+    def __contains__(self, node):
+        return node in self.entries
+
+    def distance(self, node):
+        """
+        Arguments:
+            node {Integer} -- Node Id of a member
+
+        Returns:
+            Integer -- Cached distance of the member
+        """
+        return -self.entries[node][0]
+
+    def __prune(self):
+        """Discard removed entries from the top of the heap"""
+        while self.heap and self.heap[0][2] == REMOVED:
+            heapq.heappop(self.heap)
+
+    def farthest(self):
+        """
+        Returns:
+            Integer, Integer -- Node Id of the farthest member, its distance
+                                (returns -1, -1 if the set is empty)
+        """
+        self.__prune()
+        if not self.heap:
+            return -1, -1
+        return self.heap[0][2], -self.heap[0][0]
+
+    def nearest(self):
+        """Scan the cached distances of the members, in O(|M|)
+
+        Returns:
+            Integer, Integer -- Node Id of the nearest member, its distance
+                                (returns -1, -1 if the set is empty)
+        """
+        nearest_node = -1
+        nearest = -1
+        for node, entry in self.entries.items():
+            if nearest == -1 or -entry[0] < nearest:
+                nearest = -entry[0]
+                nearest_node = node
+        return nearest_node, nearest
+
+    def add(self, node, distance, evicted=None):
+        """Insert node if the set is not full, or if it is nearer than the
+        farthest member, which is then evicted
+
+        Arguments:
+            node {Integer} -- Node Id
+            distance {Integer} -- Proximity of the node (-1 if not alive)
+
+        Keyword Arguments:
+            evicted {List} -- If given, the Node Id of any member evicted is
+                              appended to it (default: {None})
+
+        Returns:
+            Boolean -- True if node is a member of the set afterwards
+        """
+        if node in self.entries:
+            return True
+        if distance == -1:
+            return False
+        if len(self.entries) >= self.size:
+            farthest_node, farthest = self.farthest()
+            if distance >= farthest:
+                return False
+            self.remove(farthest_node)
+            self.__prune()
+            if evicted is not None:
+                evicted.append(farthest_node)
+        entry = [-distance, self.counter, node]
+        self.counter += 1
+        self.entries[node] = entry
+        heapq.heappush(self.heap, entry)
+        return True
+
+    def load(self, candidates):
+        """Replace the members by the size nearest of the candidates, building
+        the heap at once
+
+        Arguments:
+            candidates {Iterable} -- (Node Id, distance) pairs
+        """
+        candidates = [(distance, node) for node, distance in candidates
+                      if distance != -1]
+        self.heap = []
+        self.entries = {}
+        for distance, node in heapq.nsmallest(self.size, candidates):
+            if node in self.entries:
+                continue
+            entry = [-distance, self.counter, node]
+            self.counter += 1
+            self.entries[node] = entry
+            self.heap.append(entry)
+        heapq.heapify(self.heap)
+
+    def remove(self, node):
+        """Remove node from the set, if present
+
+        Arguments:
+            node {Integer} -- Node Id
+
+        Returns:
+            Boolean -- True if node was removed
+        """
+        entry = self.entries.pop(node, None)
+        if entry is None:
+            return False
+        entry[2] = REMOVED
+        if len(self.heap) > 2 * self.size:
+            # Members removed below the top are never popped: rebuild
+            self.heap = [item for item in self.heap if item[2] != REMOVED]
+            heapq.heapify(self.heap)
+        return True
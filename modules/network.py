@@ -1,5 +1,7 @@
 """Network Simulation Implementation"""
+import abc
 import random
+import numpy as np
 
 
 def add_to_dict(dict, key, val):
@@ -28,8 +30,17 @@ class Node:
         """
         self.node_id = node_id
         self.hash = node_hash
+        # Integer value of the hash, parsed once
+        self.num = int(node_hash, 16)
         self.network_api = network
 
+        # Load counters: lookup messages routed through the node, lookups
+        # originated and terminated on it, failed nodes repaired
+        self.num_routed = 0
+        self.num_originated = 0
+        self.num_terminated = 0
+        self.num_repairs = 0
+
     def get_id(self):
         """        
         Returns:
@@ -42,7 +53,169 @@ class Node:
         Returns:
             Integer -- Hash of the node id
         """
-        return int(self.hash, 16)
+        return self.num
+
+    def load_counters(self):
+        """
+        Returns:
+            Dict -- Name -> value of each load counter of the node
+        """
+        return {
+            'routed': self.num_routed,
+            'originated': self.num_originated,
+            'terminated': self.num_terminated,
+            'repairs': self.num_repairs,
+        }
+
+
+class OverlayNode(Node, abc.ABC):
+    """
+    Interface of the nodes of an overlay, implemented by ChordNode, PastryNode
+    and KademliaNode, so that the same experiments can be run against any of
+    them. Keys are the integers of the application, and key_hash maps them
+    onto the identifier space of the overlay. A subclass missing one of the
+    abstract methods cannot be instantiated.
+    """
+    @abc.abstractmethod
+    def key_hash(self, key):
+        """
+        Arguments:
+            key {Integer}
+
+        Returns:
+            Integer -- Hash of key in the identifier space of the overlay
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def join(self):
+        """Join the overlay, through a node found on the network"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def leave(self):
+        """Leave the overlay gracefully, handing over the keys stored
+
+        Returns:
+            Boolean -- True if the node has left the network
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def lookup(self, key_hash, path=None):
+        """Route a lookup for key_hash to the node responsible for it
+
+        Arguments:
+            key_hash {Integer}
+
+        Keyword Arguments:
+            path {List} -- If given, the nodes visited are appended to it
+                           (default: {None})
+
+        Returns:
+            Integer, Integer -- Node Id of the owner of the key
+                                (-1 if the lookup failed), Num hops
+        """
+        raise NotImplementedError
+
+    def lookup_latency(self, key_hash):
+        """Route a lookup for key_hash, measuring its network latency: the
+        proximity of every hop of the path, and of the reply of the owner
+
+        Arguments:
+            key_hash {Integer}
+
+        Returns:
+            Integer, Integer, Integer -- Node Id of the owner of the key
+                                         (-1 if the lookup failed), Num hops,
+                                         latency (proximity units)
+        """
+        path = []
+        owner, hops = self.lookup(key_hash, path)
+        latency = 0
+        node = self.get_num()
+        for next_node in path:
+            if next_node != node:
+                latency += self.network_api.proximity(node, next_node)
+                node = next_node
+        if owner != -1:
+            latency += self.network_api.proximity(owner, self.get_num())
+        return owner, hops, latency
+
+    @abc.abstractmethod
+    def put(self, key, val):
+        """
+        Arguments:
+            key {Integer}
+            val {Integer}
+
+        Returns:
+            Integer -- Returns -1 if key couldn't be stored, else returns 0
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get(self, key):
+        """
+        Arguments:
+            key {Integer}
+
+        Returns:
+            Integer, Integer -- Num hops, Value of the key if present, else -1
+        """
+        raise NotImplementedError
+
+    def stats(self):
+        """
+        Returns:
+            Dict -- Name -> value of each statistic of the node, its load
+                    counters unless the overlay adds its own
+        """
+        return self.load_counters()
+
+    @classmethod
+    def batch_lookup(cls, network, sources, key_hashes):
+        """Route lookups for key_hashes started at sources, one after the
+        other unless the overlay has a vectorized engine
+
+        Arguments:
+            network {Network}
+            sources {ndarray} -- Node ids on which the lookups start
+            key_hashes {ndarray} -- Hashes of the keys to be looked up
+
+        Returns:
+            ndarray, ndarray -- Node Id of the owner of each key (-1 if the
+                                lookup failed), Num hops of each lookup
+        """
+        owners = np.full(len(key_hashes), -1, dtype=np.int64)
+        hops = np.zeros(len(key_hashes), dtype=np.int64)
+        for index, (source, key_hash) in enumerate(
+                zip(np.asarray(sources).tolist(),
+                    np.asarray(key_hashes).tolist())):
+            owners[index], hops[index] = network.get_node(source).lookup(
+                key_hash)
+        return owners, hops
+
+    @classmethod
+    def batch_get(cls, network, sources, keys):
+        """Fetch the values of keys, each from the matching source
+
+        Arguments:
+            network {Network}
+            sources {ndarray} -- Node ids on which the gets start
+            keys {ndarray} -- Keys to be fetched
+
+        Returns:
+            ndarray, ndarray -- Num hops of each get, Value of each key
+                                (-1 if not found)
+        """
+        hops = np.zeros(len(keys), dtype=np.int64)
+        values = np.full(len(keys), -1, dtype=np.int64)
+        for index, (source, key) in enumerate(
+                zip(np.asarray(sources).tolist(),
+                    np.asarray(keys).tolist())):
+            hops[index], values[index] = network.get_node(source).get(key)
+        return hops, values
 
 
 class Network:
@@ -50,7 +223,8 @@ class Network:
     def __init__(self,
                  num_switches,
                  read_from_file=False,
-                 file_name='links.dat'):
+                 file_name='links.dat',
+                 adjacency=None):
         """Initialize the network nodes and switches
         
         Arguments:
@@ -61,25 +235,31 @@ class Network:
                                         from given file (default: {False})
             file_name {str} -- file from which network connections are to be
                                         read (default: {'links.dat'})
+            adjacency {Dict} -- switch -> list of the switches connected to
+                                it, given instead of generating or reading
+                                the connections (default: {None})
         """
         self.num_nodes = 0
         self.nodes = {}
+        # Tracer of the lookups made by the nodes (None to disable tracing)
+        self.tracer = None
 
         # Switches have ids 1,2,....,<num_switches>
         self.num_switches = num_switches
-        self.__proximity = []
-        for _ in range(num_switches):
-            row = [-1] * num_switches
-            self.__proximity.append(row)
+        # Sparse cache of switch distances: (s1, s2) -> distance
+        self.__proximity = {}
 
-        links = []
-        if read_from_file:
+        if adjacency is not None:
+            # Connections already known, e.g. restored from a snapshot
+            links = []
+        elif read_from_file:
             # Read network connections from file, if required
             with open(file_name) as f:
                 conn = f.readlines()
             links = [[int(x) for x in x.strip().split(',')] for x in conn]
         else:
             # Create a ring of links and then generate random remaining links
+            links = []
             max_links = random.randrange(8 * num_switches, 16 * num_switches)
             for i in range(num_switches):
                 links.append([i, (i + 1) % num_switches])
@@ -96,27 +276,33 @@ class Network:
                     f.write(str(link[0]) + ',' + str(link[1]) + '\n')
 
         # Generate dict of edges
-        self.dict = {}
+        self.dict = {} if adjacency is None else adjacency
         for link in links:
             add_to_dict(self.dict, link[0], link[1])
             add_to_dict(self.dict, link[1], link[0])
         self.switch_to_node = {}
+        # Reverse map: switch -> Node Hash of the node attached to it
+        self.node_at_switch = {}
 
-    def add_node(self, n):
+    def add_node(self, n, switch=None):
         """Add a new Node to the Network
         
         Arguments:
             n {Node} -- Node instance to be added to the network
+
+        Keyword Arguments:
+            switch {Integer} -- Free switch to attach the node to, instead of
+                                a random one (default: {None})
         
         Returns:
             Boolean -- Returns True if node could be added
         """
         if n.get_num() not in self.nodes:
             self.nodes[n.get_num()] = n
-            switch = random.randint(0, self.num_switches - 1)
-            while switch in self.switch_to_node.values():
+            while switch is None or switch in self.node_at_switch:
                 switch = random.randint(0, self.num_switches - 1)
             self.switch_to_node[n.get_num()] = switch
+            self.node_at_switch[switch] = n.get_num()
             return True
         return False
 
@@ -132,6 +318,7 @@ class Network:
         if n not in self.nodes:
             return False
         del self.nodes[n]
+        del self.node_at_switch[self.switch_to_node[n]]
         del self.switch_to_node[n]
         return True
 
@@ -177,8 +364,8 @@ class Network:
 
             return abs(s2 - s1)
 
-            if self.__proximity[s1][s2] != -1:
-                return self.__proximity[s1][s2]
+            if (s1, s2) in self.__proximity:
+                return self.__proximity[(s1, s2)]
 
             # bfs query
             queue = self.dict[s1]
@@ -198,9 +385,9 @@ class Network:
                     if next_switch == s2:
                         found_switch = 1
                         break
-                    elif self.__proximity[next_switch][s2] != -1:
+                    elif (next_switch, s2) in self.__proximity:
                         found_switch = 1
-                        depth = self.__proximity[next_switch][s2] + depth
+                        depth = self.__proximity[(next_switch, s2)] + depth
                     
                     _nq = self.dict[next_switch]
                     for _sw in _nq:
@@ -211,8 +398,8 @@ class Network:
                     break
                 queue = next_queue
 
-            self.__proximity[s1][s2] = depth
-            self.__proximity[s2][s1] = depth
+            self.__proximity[(s1, s2)] = depth
+            self.__proximity[(s2, s1)] = depth
             return depth
         except:
             return -1
@@ -240,7 +427,7 @@ class Network:
         while depth <= max_depth:
             next_queue = []
             for next_switch in queue:
-                if next_switch in self.switch_to_node.values():
+                if next_switch in self.node_at_switch:
                     found_switch = next_switch
                     break
                 _nq = self.dict[next_switch]
@@ -254,5 +441,4 @@ class Network:
             queue = next_queue
         if found_switch == -1:
             return -1
-        return list(self.switch_to_node.keys())[list(
-            self.switch_to_node.values()).index(found_switch)]
+        return self.node_at_switch[found_switch]
@@ -0,0 +1,114 @@
+"""Sorted Index of known nodes for the Pastry rare-case routing"""
+import bisect
+
+
+class PrefixIndex:
+    """
+    Sorted array of the node ids known to a Pastry node: the members of its
+    leaf set, neighborhood set and routing table. A node is removed once it
+    has failed or has been evicted from all three, so that the index stays
+    bounded by the size of the state.
+
+    All the nodes sharing at least l digits with a key lie in one contiguous
+    range of the identifier space, so the closest known node with such a
+    prefix is found with a single bisection instead of scanning every table.
+    """
+    def __init__(self, owner, digit_bits, length):
+        """
+        Arguments:
+            owner {Integer} -- Node Id of the node owning the index
+            digit_bits {Integer} -- Number of bits in a digit (b)
+            length {Integer} -- Number of digits in a node id
+        """
+        self.owner = owner
+        self.digit_bits = digit_bits
+        self.length = length
+        self.space = 1 << (digit_bits * length)
+        self.nodes = []
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, node):
+        index = bisect.bisect_left(self.nodes, node)
+        return index < len(self.nodes) and self.nodes[index] == node
+
+    def add(self, node):
+        """Add a node to the index
+
+        Arguments:
+            node {Integer} -- Node Id
+        """
+        node = int(node)
+        if node == -1 or node == self.owner:
+            return
+        index = bisect.bisect_left(self.nodes, node)
+        if index == len(self.nodes) or self.nodes[index] != node:
+            self.nodes.insert(index, node)
+
+    def update(self, nodes):
+        """Add an iterable of nodes to the index
+
+        Arguments:
+            nodes {Iterable} -- Node Ids
+        """
+        nodes = [int(node) for node in nodes]
+        if len(nodes) <= 8:
+            for node in nodes:
+                self.add(node)
+            return
+        # Merge many nodes at once instead of inserting them one by one
+        merged = set(self.nodes)
+        merged.update(nodes)
+        merged.discard(-1)
+        merged.discard(self.owner)
+        self.nodes = sorted(merged)
+
+    def remove(self, node):
+        """Remove a failed or evicted node from the index
+
+        Arguments:
+            node {Integer} -- Node Id
+        """
+        index = bisect.bisect_left(self.nodes, node)
+        if index < len(self.nodes) and self.nodes[index] == node:
+            del self.nodes[index]
+
+    def closest(self, key, l):
+        """Find the numerically closest known node sharing at least l digits
+        with key
+
+        Arguments:
+            key {Integer}
+            l {Integer} -- Minimum length of the common prefix
+
+        Returns:
+            Integer, Integer -- Node Id of the closest node, circular distance
+                                to the key (returns -1, -1 if there is none)
+        """
+        if not self.nodes:
+            return -1, -1
+        index = bisect.bisect_left(self.nodes, key)
+        if l == 0:
+            # Every node qualifies, the closest one may be across the wrap
+            candidates = (self.nodes[index % len(self.nodes)],
+                          self.nodes[index - 1])
+        else:
+            shift = self.digit_bits * (self.length - l)
+            low = (key >> shift) << shift
+            high = low + (1 << shift)
+            candidates = []
+            if index < len(self.nodes) and self.nodes[index] < high:
+                candidates.append(self.nodes[index])
+            if index > 0 and self.nodes[index - 1] >= low:
+                candidates.append(self.nodes[index - 1])
+
+        best_node = -1
+        best_diff = -1
+        for node in candidates:
+            diff = abs(node - key)
+            diff = min(diff, self.space - diff)
+            if best_diff == -1 or diff < best_diff:
+                best_diff = diff
+                best_node = node
+        return best_node, best_diff
@@ -0,0 +1,102 @@
+"""Compact Storage of Pastry Routing Tables, shared by all the nodes"""
+import numpy as np
+
+
+class RoutingTableStore:
+    """
+    Keeps the routing tables of all the nodes of an overlay in shared NumPy
+    blocks of shape (block_size, length, 2^b), instead of Python lists of
+    boxed ints. Each node is given a slot, and works on a view of it, so that
+    the node code indexes it exactly like a list of rows.
+
+    Blocks are never reallocated once handed out, hence views stay valid as
+    the overlay grows, and the slots freed by departed nodes are reused. Pass
+    the expected number of nodes as block_size to keep all the tables in a
+    single array.
+    """
+    def __init__(self, length, b, block_size=4096):
+        """
+        Arguments:
+            length {Integer} -- Number of digits in a node id (rows)
+            b {Integer} -- Number of bits in a digit (2^b columns)
+
+        Keyword Arguments:
+            block_size {Integer} -- Number of slots per block (default: {4096})
+        """
+        if length * b > 63:
+            raise ValueError('Node ids of ' + str(length * b) +
+                             ' bits do not fit the compact routing tables')
+        self.length = length
+        self.width = 1 << b
+        self.block_size = block_size
+        self.dtype = np.int32 if length * b < 32 else np.int64
+        self.blocks = []
+        self.owners = []
+        self.free_slots = []
+
+    def __len__(self):
+        return len(self.owners) - len(self.free_slots)
+
+    def allocate(self, owner):
+        """Allocate a slot for a new node, with all the entries empty (-1)
+
+        Arguments:
+            owner {Integer} -- Node Id of the node owning the routing table
+
+        Returns:
+            Integer, ndarray -- Slot of the node, view of its routing table
+        """
+        if self.free_slots:
+            slot = self.free_slots.pop()
+            self.owners[slot] = owner
+            return slot, self.get(slot)
+        slot = len(self.owners)
+        if slot == len(self.blocks) * self.block_size:
+            self.blocks.append(
+                np.full((self.block_size, self.length, self.width),
+                        -1,
+                        dtype=self.dtype))
+        self.owners.append(owner)
+        return slot, self.get(slot)
+
+    def free(self, slot):
+        """Free the slot of a node which has left, clearing its entries
+
+        Arguments:
+            slot {Integer}
+        """
+        self.get(slot)[:] = -1
+        self.owners[slot] = -1
+        self.free_slots.append(slot)
+
+    def get(self, slot):
+        """
+        Arguments:
+            slot {Integer}
+
+        Returns:
+            ndarray -- View of the routing table at slot
+        """
+        return self.blocks[slot // self.block_size][slot % self.block_size]
+
+    def snapshot(self):
+        """Copy all the routing tables at once
+
+        Returns:
+            ndarray, ndarray -- Node Ids owning each slot in use,
+                                routing tables (slots x length x 2^b)
+        """
+        owners = np.array(self.owners, dtype=np.int64)
+        if not self.blocks:
+            return owners, np.empty((0, self.length, self.width),
+                                    dtype=self.dtype)
+        used = owners != -1
+        tables = np.concatenate(self.blocks)[:len(self.owners)][used]
+        return owners[used], tables
+
+    def nbytes(self):
+        """
+        Returns:
+            Integer -- Memory held by the routing tables, in bytes
+        """
+        return sum(block.nbytes for block in self.blocks)
@@ -0,0 +1,171 @@
+"""Sampled Tracing of Lookups, exported in the Chrome trace format"""
+import json
+import time
+import random
+
+
+class Tracer:
+    """
+    Records a span for every hop of a sample of the lookups: the node, the
+    rule which chose the next hop, the time spent on the node and the
+    proximity to the next hop. Each lookup traced is shown as a track, with
+    a span for the whole lookup and one nested span per hop.
+
+    Lookups are sampled when they start, so that a lookup not sampled costs
+    a single random draw, and the number of events kept is bounded, so that
+    tracing can stay on during long runs. The events are exported as Chrome
+    trace JSON, which can be opened in Perfetto or chrome://tracing.
+    """
+    def __init__(self, sample_rate=0.001, max_events=1000000, seed=None):
+        """
+        Keyword Arguments:
+            sample_rate {Float} -- Fraction of the lookups traced
+                                   (default: {0.001})
+            max_events {Integer} -- Lookups are no longer sampled once this
+                                    many events are kept (default: {1000000})
+            seed {Integer} -- Seed of the sampling (default: {None})
+        """
+        self.sample_rate = sample_rate
+        self.max_events = max_events
+        self.random = random.Random(seed)
+        self.events = []
+        self.origin = time.perf_counter()
+        self.num_lookups = 0
+        self.num_sampled = 0
+        self.num_dropped = 0
+
+    def now(self):
+        """
+        Returns:
+            Float -- Microseconds since the tracer was created
+        """
+        return (time.perf_counter() - self.origin) * 1e6
+
+    def begin(self, name, node, key):
+        """Start a lookup, which is traced if it is sampled
+
+        Arguments:
+            name {String} -- Kind of lookup, e.g. 'search'
+            node {Integer} -- Node Id on which the lookup starts
+            key {Integer} -- Hash of the key looked up
+
+        Returns:
+            LookupTrace -- None if the lookup is not traced
+        """
+        self.num_lookups += 1
+        if self.random.random() >= self.sample_rate:
+            return None
+        if len(self.events) >= self.max_events:
+            self.num_dropped += 1
+            return None
+        self.num_sampled += 1
+        return LookupTrace(self, name, self.num_sampled, node, key)
+
+    def export(self, file_name):
+        """Write the events recorded as Chrome trace JSON
+
+        Arguments:
+            file_name {String}
+        """
+        with open(file_name, 'w') as f:
+            json.dump(
+                {
+                    'traceEvents': self.events,
+                    'displayTimeUnit': 'ns',
+                    'otherData': {
+                        'lookups': self.num_lookups,
+                        'sampled': self.num_sampled,
+                        'dropped': self.num_dropped,
+                        'sample_rate': self.sample_rate,
+                    },
+                }, f)
+
+
+class LookupTrace:
+    """
+    Spans of one lookup. The routing code reports the rule it applied with
+    decide, and the lookup loop closes the span of the current node with hop
+    once the next node is known.
+    """
+    def __init__(self, tracer, name, lookup_id, node, key):
+        """
+        Arguments:
+            tracer {Tracer}
+            name {String} -- Kind of lookup
+            lookup_id {Integer} -- Track of the lookup
+            node {Integer} -- Node Id on which the lookup starts
+            key {Integer} -- Hash of the key looked up
+        """
+        self.tracer = tracer
+        self.name = name
+        self.lookup_id = lookup_id
+        self.key = key
+        self.source = node
+        self.start = tracer.now()
+        self.mark = self.start
+        self.rule = None
+        self.args = {}
+
+    def decide(self, rule, **args):
+        """Record the rule which chose the next hop on the current node
+
+        Arguments:
+            rule {String} -- e.g. 'successor', 'finger', 'leaf_set',
+                             'routing_table', 'fallback_scan'
+
+        Keyword Arguments:
+            Details of the rule, e.g. the finger or the row and column
+        """
+        self.rule = rule
+        self.args = args
+
+    def span(self, name, start, **args):
+        """Record a span which started at start and ends now, e.g. a repair
+
+        Arguments:
+            name {String}
+            start {Float} -- Start of the span, from Tracer.now
+        """
+        end = self.tracer.now()
+        self.__event(name, start, end - start, args)
+
+    def hop(self, node, next_node, proximity):
+        """Close the span of the current node, forwarding to next_node
+
+        Arguments:
+            node {Integer} -- Node Id of the current node
+            next_node {Integer} -- Node Id of the next hop (-1 if none)
+            proximity {Integer} -- Proximity of the next hop (-1 if none)
+        """
+        end = self.tracer.now()
+        args = dict(self.args, node=node, next=next_node, proximity=proximity)
+        self.__event(self.rule or 'hop', self.mark, end - self.mark, args)
+        self.mark = end
+        self.rule = None
+        self.args = {}
+
+    def end(self, owner, hops):
+        """Close the span of the whole lookup
+
+        Arguments:
+            owner {Integer} -- Node Id reached (-1 if the lookup failed)
+            hops {Integer} -- Num hops
+        """
+        self.__event(self.name, self.start,
+                     self.tracer.now() - self.start, {
+                         'source': self.source,
+                         'key': self.key,
+                         'owner': owner,
+                         'hops': hops,
+                     })
+
+    def __event(self, name, start, duration, args):
+        self.tracer.events.append({
+            'name': name,
+            'ph': 'X',
+            'ts': start,
+            'dur': duration,
+            'pid': 0,
+            'tid': self.lookup_id,
+            'args': args,
+        })
@@ -0,0 +1,334 @@
+"""Workload Generation and Trace Replay for the Experiment Drivers"""
+import math
+import time
+import random
+import struct
+import bisect
+import itertools
+from collections import namedtuple
+
+# One operation of a workload: arrival time (seconds), kind (one of
+# OPERATIONS) and key (unused by joins and leaves)
+Operation = namedtuple('Operation', ['time', 'kind', 'key'])
+
+OPERATIONS = ('get', 'put', 'join', 'leave')
+
+# Trace records: arrival time (float64), kind (uint8), key (int64)
+TRACE_RECORD = struct.Struct('<dBq')
+TRACE_MAGIC = b'DHTTRACE1\n'
+
+
+class UniformKeys:
+    """Keys drawn uniformly from [0, num_keys)"""
+    def __init__(self, num_keys):
+        """
+        Arguments:
+            num_keys {Integer} -- Number of distinct keys
+        """
+        self.num_keys = num_keys
+
+    def sample(self, rng):
+        """
+        Arguments:
+            rng {random.Random}
+
+        Returns:
+            Integer -- Key
+        """
+        return rng.randrange(self.num_keys)
+
+
+class ZipfKeys:
+    """
+    Keys drawn from [0, num_keys) with a Zipf distribution: key k is drawn
+    with probability proportional to 1 / (k + 1)^exponent. The cumulative
+    weights are computed once, and each key is drawn by bisection.
+    """
+    def __init__(self, num_keys, exponent=0.99):
+        """
+        Arguments:
+            num_keys {Integer} -- Number of distinct keys
+
+        Keyword Arguments:
+            exponent {Float} -- Skew of the distribution, 0 being uniform
+                                (default: {0.99})
+        """
+        self.num_keys = num_keys
+        self.cum_weights = list(
+            itertools.accumulate(1 / math.pow(k + 1, exponent)
+                                 for k in range(num_keys)))
+
+    def sample(self, rng):
+        """
+        Arguments:
+            rng {random.Random}
+
+        Returns:
+            Integer -- Key
+        """
+        return bisect.bisect_right(self.cum_weights,
+                                   rng.random() * self.cum_weights[-1])
+
+
+class HotspotKeys:
+    """
+    Keys drawn from [0, num_keys), where a fraction hot_probability of the
+    operations go to the first hot_fraction of the keys, uniformly, and the
+    others to the remaining keys, uniformly
+    """
+    def __init__(self, num_keys, hot_fraction=0.01, hot_probability=0.9):
+        """
+        Arguments:
+            num_keys {Integer} -- Number of distinct keys
+
+        Keyword Arguments:
+            hot_fraction {Float} -- Fraction of the keys which are hot
+                                    (default: {0.01})
+            hot_probability {Float} -- Fraction of the operations on hot keys
+                                       (default: {0.9})
+        """
+        self.num_keys = num_keys
+        self.num_hot = max(1, int(hot_fraction * num_keys))
+        self.hot_probability = hot_probability
+
+    def sample(self, rng):
+        """
+        Arguments:
+            rng {random.Random}
+
+        Returns:
+            Integer -- Key
+        """
+        if self.num_hot == self.num_keys or rng.random(
+        ) < self.hot_probability:
+            return rng.randrange(self.num_hot)
+        return rng.randrange(self.num_hot, self.num_keys)
+
+
+def make_keys(name, num_keys, zipf_exponent=0.99):
+    """
+    Arguments:
+        name {String} -- 'uniform', 'zipf' or 'hotspot'
+        num_keys {Integer} -- Number of distinct keys
+
+    Keyword Arguments:
+        zipf_exponent {Float} -- Skew of the Zipf distribution
+                                 (default: {0.99})
+
+    Returns:
+        UniformKeys, ZipfKeys or HotspotKeys -- Distribution of keys
+    """
+    if name == 'uniform':
+        return UniformKeys(num_keys)
+    if name == 'zipf':
+        return ZipfKeys(num_keys, zipf_exponent)
+    if name == 'hotspot':
+        return HotspotKeys(num_keys)
+    raise ValueError('Unknown key distribution: ' + str(name))
+
+
+def generate_workload(num_operations,
+                      keys,
+                      mix=None,
+                      schedule=None,
+                      seed=None):
+    """Generate the operations of a workload, one at a time, so that long
+    workloads are never held in memory. Arrivals are Poisson, with the rate
+    given by the schedule.
+
+    Arguments:
+        num_operations {Integer}
+        keys {UniformKeys, ZipfKeys or HotspotKeys} -- Distribution of keys
+
+    Keyword Arguments:
+        mix {Dict} -- Kind of operation -> Relative frequency
+                      (default: {{'get': 1}})
+        schedule {List} -- (num_operations, rate per second) phases, the last
+                           one lasting until the end of the workload
+                           (default: {[(num_operations, 1000)]})
+        seed {Integer} -- Seed of the generator (default: {None})
+
+    Yields:
+        Operation
+    """
+    if mix is None:
+        mix = {'get': 1}
+    if schedule is None:
+        schedule = [(num_operations, 1000)]
+    for kind in mix:
+        if kind not in OPERATIONS:
+            raise ValueError('Unknown operation: ' + str(kind))
+    rng = random.Random(seed)
+    kinds = list(mix)
+    cum_weights = list(itertools.accumulate(mix[kind] for kind in kinds))
+
+    now = 0
+    phase = 0
+    phase_end = schedule[0][0]
+    for count in range(num_operations):
+        while count >= phase_end and phase < len(schedule) - 1:
+            phase += 1
+            phase_end += schedule[phase][0]
+        now += rng.expovariate(schedule[phase][1])
+        kind = kinds[bisect.bisect_right(cum_weights,
+                                         rng.random() * cum_weights[-1])]
+        key = keys.sample(rng) if kind in ('get', 'put') else -1
+        yield Operation(now, kind, key)
+
+
+class ArrivalPacer:
+    """
+    Paces the operations of a workload against their arrival times, and
+    measures, for every phase of the arrival schedule, the rate at which the
+    operations were offered (from their arrival times) and the rate at which
+    they were run
+    """
+    def __init__(self, schedule=None, pace=False):
+        """
+        Keyword Arguments:
+            schedule {List} -- (num_operations, rate per second) phases of the
+                               workload, as given to generate_workload. A
+                               replayed trace is taken as a single phase
+                               (default: {None})
+            pace {Boolean} -- Wait until the arrival time of each operation
+                              before running it, instead of running the
+                              operations back to back (default: {False})
+        """
+        self.schedule = schedule or []
+        self.pace = pace
+        self.start = None
+        self.count = 0
+        self.phase_end = self.schedule[0][0] if self.schedule else -1
+        self.rows = []
+
+    def __new_phase(self, now, arrival):
+        """Open the next phase of the schedule
+
+        Arguments:
+            now {Float} -- Time at which the phase starts
+            arrival {Float} -- Arrival time at which the phase starts
+        """
+        self.rows.append({
+            'phase': len(self.rows),
+            'operations': 0,
+            'first_arrival': arrival,
+            'last_arrival': arrival,
+            'start': now,
+            'end': now,
+            'max_lag': 0,
+        })
+
+    def wait(self, operation):
+        """Start operation: wait until its arrival time if pacing, and count
+        it in its phase of the schedule
+
+        Arguments:
+            operation {Operation}
+        """
+        now = time.perf_counter()
+        if self.start is None:
+            self.start = now
+            self.__new_phase(now, 0)
+        while self.count == self.phase_end and len(self.rows) < len(
+                self.schedule):
+            # The phase starts where the previous one ended
+            self.phase_end += self.schedule[len(self.rows)][0]
+            self.__new_phase(self.rows[-1]['end'],
+                             self.rows[-1]['last_arrival'])
+        row = self.rows[-1]
+        due = self.start + operation.time
+        if self.pace and due > now:
+            time.sleep(due - now)
+        row['max_lag'] = max(row['max_lag'], now - due)
+        row['operations'] += 1
+        row['last_arrival'] = operation.time
+        self.count += 1
+
+    def done(self):
+        """End the operation started last"""
+        self.rows[-1]['end'] = time.perf_counter()
+
+    def summary(self):
+        """
+        Returns:
+            List -- For every phase: its index, number of operations, offered
+                    and achieved rates (operations per second) and the
+                    largest delay of an operation past its arrival time
+                    (seconds)
+        """
+        result = []
+        for row in self.rows:
+            offered = row['last_arrival'] - row['first_arrival']
+            achieved = row['end'] - row['start']
+            result.append({
+                'phase': row['phase'],
+                'operations': row['operations'],
+                'offered_rate':
+                row['operations'] / offered if offered > 0 else 0,
+                'achieved_rate':
+                row['operations'] / achieved if achieved > 0 else 0,
+                'max_lag': row['max_lag'],
+            })
+        return result
+
+
+def format_rates(row):
+    """
+    Arguments:
+        row {Dict} -- Phase of ArrivalPacer.summary
+
+    Returns:
+        String -- One line summary of the phase
+    """
+    return ('Phase ' + str(row['phase']) + ': ' + str(row['operations']) +
+            ' operations, offered ' + format(row['offered_rate'], '.1f') +
+            '/s, achieved ' + format(row['achieved_rate'], '.1f') +
+            '/s, max lag ' + format(row['max_lag'], '.3f') + ' s')
+
+
+def write_trace(file_name, operations):
+    """Record operations in a trace file, of fixed size binary records
+
+    Arguments:
+        file_name {String}
+        operations {Iterable} -- Operation tuples
+
+    Returns:
+        Integer -- Number of operations written
+    """
+    count = 0
+    with open(file_name, 'wb') as f:
+        f.write(TRACE_MAGIC)
+        for operation in operations:
+            f.write(
+                TRACE_RECORD.pack(operation.time,
+                                  OPERATIONS.index(operation.kind),
+                                  operation.key))
+            count += 1
+    return count
+
+
+def read_trace(file_name, chunk=4096):
+    """Replay the operations recorded in a trace file, reading chunk records
+    at a time
+
+    Arguments:
+        file_name {String}
+
+    Keyword Arguments:
+        chunk {Integer} -- Number of records read at once (default: {4096})
+
+    Yields:
+        Operation
+    """
+    with open(file_name, 'rb') as f:
+        if f.read(len(TRACE_MAGIC)) != TRACE_MAGIC:
+            raise ValueError(file_name + ' is not a trace file')
+        while True:
+            data = f.read(chunk * TRACE_RECORD.size)
+            if len(data) % TRACE_RECORD.size != 0:
+                raise ValueError(file_name + ' is truncated')
+            if not data:
+                break
+            for arrival, kind, key in TRACE_RECORD.iter_unpack(data):
+                yield Operation(arrival, OPERATIONS[kind], key)
@@ -2,13 +2,25 @@
 Run Experiments for the Pastry DHT Protocol
 Uses the PastryNode and Network classes defined in this repo.
 """
+import os
 import math
 import sys
+import time
 import random
 import hashlib
-import matplotlib.pyplot as plt
+import numpy as np
 from pastry_node import PastryNode
+from pastry_builder import build_overlay
+from snapshot import save_snapshot, load_snapshot
 from modules.network import Network
+from modules.tracing import Tracer
+from modules.load_report import print_load_report
+from modules.routing_store import RoutingTableStore
+from modules.metrics import MetricsCollector, write_metrics
+from modules.workload import (make_keys, generate_workload, read_trace,
+                              ArrivalPacer, format_rates)
+from modules.churn import (make_sessions, ChurnSchedule, ChurnStats,
+                           format_row, write_churn)
 
 if len(sys.argv) == 2:
     print('Please enter required number of arguments')
@@ -19,14 +31,52 @@ num_nodes = int(sys.argv[1])
 read_from_file = bool(int(sys.argv[2]))
 nodes = []
 nodes_hash = []
+data_store = {}
+metrics = {}
+# Shared storage of the routing tables, with compact_tables
+store = None
+# Network Id of the next node joining during a workload: ids are never
+# reused, since departed nodes may still be in the state of other nodes
+next_node = 2 * num_nodes
 
 l = 6
 b = 4
 num_points = 10000
 num_queries = 1000000
+compact_tables = False
+bulk_build = False
+batch_search = True
+row_exchange_rounds = 0
+num_stretch_queries = 10000
+graceful_leave = True
+heartbeat_period = 10000
+verbose = False
+show_plots = False
+metrics_file = 'pastry_metrics.json'
+workload_operations = 0
+key_distribution = 'zipf'
+zipf_exponent = 0.99
+operation_mix = {'get': 0.9, 'put': 0.1, 'join': 0, 'leave': 0}
+arrival_schedule = [(workload_operations, 1000)]
+trace_file = None
+pace_workload = False
+snapshot_dir = None
+chrome_trace_file = None
+trace_sample_rate = 0.001
+load_file = None
+churn_duration = 0
+session_distribution = 'exponential'
+mean_session_time = 600
+churn_lookup_rate = 100
+crash_fraction = 0.5
+churn_maintenance_period = 30
+churn_window = 60
+churn_file = None
 
 
 def plot_histogram(dict):
+    # Only needed when show_plots is set
+    import matplotlib.pyplot as plt
     plt.bar(dict.keys(), dict.values())
     plt.xlim(0, 12)
     plt.ylim(0, 0.8)
@@ -36,18 +86,18 @@ def plot_histogram(dict):
 
 
 def hash_int(integer):
-    """Hash the given integers and trim to l digits
+    """Hash the given integers and trim to l digits of b bits
     
     Arguments:
         integer {Integer}
     
     Returns:
-        String -- string of l digits, hash of integer
+        String -- hex string of the l * b bit hash of integer
     """
     name = str(integer)
     m = hashlib.sha1(name.encode('utf-8'))
-    node_hash = m.hexdigest()[:l]
-    return node_hash
+    node_hash = int(m.hexdigest(), 16) >> (160 - l * b)
+    return format(node_hash, '0' + str((l * b + 3) // 4) + 'x')
 
 
 def init_network(network, num_nodes):
@@ -57,33 +107,63 @@ def init_network(network, num_nodes):
         network {Network}
         num_nodes {Integer} -- Number of nodes
     """
+    global store
     num_added = 0
+    added_nodes = []
+    if compact_tables:
+        # Keep all routing tables in one shared array
+        store = RoutingTableStore(l, b, block_size=num_nodes)
     for i in range(2 * num_nodes):
-        print("Adding node " + str(i))
         node_hash = hash_int(i)
-        print(node_hash)
+        if verbose:
+            print("Adding node " + str(i))
+            print(node_hash)
 
-        pn = PastryNode(i, node_hash, network, l, b)
+        pn = PastryNode(i, node_hash, network, l, b, verbose=verbose)
         is_added = network.add_node(pn)
         if is_added:
-            pn.join()
+            if store is not None:
+                pn.attach(store)
+            if bulk_build:
+                added_nodes.append(pn)
+            else:
+                pn.join()
             num_added += 1
             nodes.append(i)
             nodes_hash.append(int(node_hash, 16))
         if num_added == num_nodes:
             break
 
+    if bulk_build:
+        # Compute the state of all nodes at once, instead of joining
+        build_overlay(network, added_nodes, l, b)
+
+    # Periodic maintenance: swap routing table rows for nearer entries
+    for _ in range(row_exchange_rounds):
+        for node_hash in nodes_hash:
+            network.get_node(node_hash).exchange_rows()
+
+
+def keep_alive(network):
+    """Run a heartbeat pass on every node, repairing the failures found
+    
+    Arguments:
+        network {Network}
+    """
+    for node_hash in nodes_hash:
+        network.get_node(node_hash).heartbeat()
+
 
-def search_queries(network, num_queries):
+def search_queries(network, num_queries, phase):
     """Run search queries for num_queries times
     
     Arguments:
         network {Network}
         num_queries {Integer} -- Number of queries
+        phase {String} -- Name under which the statistics are collected
     """
-    hops_hist = {}
+    collector = metrics.setdefault(phase, MetricsCollector(max_hops=10))
     num_epoch = 0
-    flag = 0
     count = 0
     for _ in range(100):
         for q in range(num_queries // 100):
@@ -91,34 +171,397 @@ def search_queries(network, num_queries):
             if (count % 10000 == 0):
                 num_epoch += 1
                 print(str(num_epoch) + ' epochs completed')
+            if heartbeat_period > 0 and count % heartbeat_period == 0:
+                keep_alive(network)
             hit_node = int(hash_int(random.choice(nodes)), 16)
             node = network.get_node(hit_node)
+            start = time.perf_counter()
             hops, found = node.search(q)
+            latency = time.perf_counter() - start
 
-            # Add in histogram
-            hops = 10 if hops > 10 else hops
-            if hops in hops_hist:
-                hops_hist[hops] += 1
-            else:
-                hops_hist[hops] = 1
             q_hash = int(hash_int(q), 16)
             in_list = q_hash in nodes_hash
-            if (in_list and found != -1) or (not in_list and found == -1):
-                continue
-            flag = 1
-            print(in_list, found)
+            error = None
+            if in_list and found == -1:
+                error = 'not_found'
+            elif not in_list and found != -1:
+                error = 'false_positive'
+            collector.record(hops, latency=latency, error=error)
+            if error is not None and verbose:
+                print(in_list, found)
+                print('Couldn\'t find node ' + str(q) + ' correctly')
+
+    report(phase)
+
+
+def batch_search_queries(network, num_queries, phase):
+    """Run search queries for num_queries times, all routed together by the
+    vectorized routing engine
+    
+    Arguments:
+        network {Network}
+        num_queries {Integer} -- Number of queries
+        phase {String} -- Name under which the statistics are collected
+    """
+    queries = np.arange(num_queries) % (num_queries // 100)
+    key_hashes = np.array(
+        [int(hash_int(q), 16) for q in range(num_queries // 100)],
+        dtype=np.int64)[queries]
+    sources = np.array(random.choices(nodes_hash, k=num_queries),
+                       dtype=np.int64)
+
+    start = time.perf_counter()
+    owners, hops = PastryNode.batch_lookup(network, sources, key_hashes)
+    elapsed = time.perf_counter() - start
+
+    # A key is found iff it is routed to the node with the same hash
+    found = owners == key_hashes
+    in_list = np.isin(key_hashes, np.array(nodes_hash, dtype=np.int64))
+    errors = {}
+    num_not_found = int(np.count_nonzero(in_list & ~found))
+    num_false_positive = int(np.count_nonzero(~in_list & found))
+    if num_not_found > 0:
+        errors['not_found'] = num_not_found
+    if num_false_positive > 0:
+        errors['false_positive'] = num_false_positive
+    if verbose:
+        for q in np.unique(queries[found != in_list]).tolist():
             print('Couldn\'t find node ' + str(q) + ' correctly')
 
-    if flag == 0:
+    collector = metrics.setdefault(phase, MetricsCollector(max_hops=10))
+    collector.record_batch(hops, elapsed, errors=errors)
+    report(phase)
+
+
+def report(phase):
+    """Print the summary of the statistics collected in phase, and plot the
+    hop distribution if show_plots is set
+    
+    Arguments:
+        phase {String}
+    """
+    collector = metrics[phase]
+    num_errors = sum(collector.errors.values())
+    if num_errors == 0:
         print('All queries ran successfully')
+    else:
+        print(str(num_errors) + ' queries failed: ' + str(collector.errors))
+    print(collector.summary()['avg_hops'])
+    if show_plots:
+        plot_histogram(collector.hop_distribution())
+
 
-    new_dict = {}
-    avg_hops = 0
-    for k in hops_hist:
-        new_dict[k] = hops_hist[k] / num_queries
-        avg_hops += (new_dict[k] * k)
-    print(avg_hops)
-    plot_histogram(new_dict)
+def route_stretch(network, num_queries):
+    """Measure the route stretch of lookups: the proximity distance travelled
+    along the route, relative to the direct distance from the source node to
+    the node reached
+    
+    Arguments:
+        network {Network}
+        num_queries {Integer} -- Number of lookups
+    """
+    total_stretch = 0
+    count = 0
+    for q in range(num_queries):
+        source = int(hash_int(random.choice(nodes)), 16)
+        node = network.get_node(source)
+        path = []
+        owner, _ = node.lookup(int(hash_int(q), 16), path)
+        if owner == -1 or owner == source:
+            continue
+        direct = network.proximity(source, owner)
+        travelled = 0
+        previous = source
+        for next_node in path:
+            travelled += network.proximity(previous, next_node)
+            previous = next_node
+        total_stretch += travelled / direct
+        count += 1
+    if count > 0:
+        print('Average route stretch: ' + str(total_stretch / count))
+
+
+def store_keys(network, num_keys):
+    """Store keys in the Pastry Network
+    
+    Arguments:
+        network {Network}
+        num_keys {Integer}
+    """
+    count = 0
+    for key in range(2 * num_keys):
+        value = random.randint(0, 2 * num_keys)
+        # Choose a random node and store through it
+        rand_node = int(hash_int(random.choice(nodes)), 16)
+        node = network.get_node(rand_node)
+        is_stored = node.put(key, value)
+        if is_stored == 0:
+            # Also store in the global array
+            count += 1
+            data_store[key] = value
+            if count == num_keys:
+                break
+
+
+def get_queries(network, num_queries, phase):
+    """Run get queries on the stored keys for num_queries times
+    
+    Arguments:
+        network {Network}
+        num_queries {Integer} -- Number of queries
+        phase {String} -- Name under which the statistics are collected
+    """
+    collector = metrics.setdefault(phase, MetricsCollector())
+    keys = list(data_store)
+    for count in range(num_queries):
+        if ((count + 1) % 10000 == 0):
+            print(str((count + 1) // 10000) + ' epochs completed')
+        if heartbeat_period > 0 and (count + 1) % heartbeat_period == 0:
+            keep_alive(network)
+        q = keys[count % len(keys)]
+        hit_node = int(hash_int(random.choice(nodes)), 16)
+        node = network.get_node(hit_node)
+        start = time.perf_counter()
+        hops, value = node.get(q)
+        latency = time.perf_counter() - start
+        error = None
+        if value != data_store[q]:
+            error = 'not_found' if value == -1 else 'wrong_value'
+            if verbose:
+                print('Couldn\'t get key ' + str(q) + ' correctly')
+        collector.record(hops, latency=latency, error=error)
+
+    if not collector.errors:
+        print('All get queries ran successfully')
+    print(collector.summary()['avg_hops'])
+
+
+def join_node(network):
+    """Add a new node to the network, if a switch is free for it
+    
+    Arguments:
+        network {Network}
+    
+    Returns:
+        Boolean -- True if a node joined
+    """
+    global next_node
+    if len(network.nodes) >= network.num_switches:
+        return False
+    while True:
+        i = next_node
+        next_node += 1
+        node_hash = hash_int(i)
+        pn = PastryNode(i, node_hash, network, l, b, verbose=verbose)
+        if network.add_node(pn):
+            if store is not None:
+                pn.attach(store)
+            pn.join()
+            nodes.append(i)
+            nodes_hash.append(int(node_hash, 16))
+            return True
+
+
+def run_workload(network, operations, phase):
+    """Run the operations of a workload, collecting the statistics of each
+    kind of operation under phase.kind, and report the offered and achieved
+    rate of every phase of the arrival schedule. With pace_workload, each
+    operation waits for its arrival time.
+    
+    Arguments:
+        network {Network}
+        operations {Iterable} -- Operation tuples, generated or replayed
+        phase {String}
+    """
+    collectors = {}
+    # A replayed trace has no schedule, and is measured as a single phase
+    pacer = ArrivalPacer(arrival_schedule if trace_file is None else None,
+                         pace=pace_workload)
+    count = 0
+    for operation in operations:
+        pacer.wait(operation)
+        count += 1
+        if heartbeat_period > 0 and count % heartbeat_period == 0:
+            keep_alive(network)
+        kind = operation.kind
+        collector = collectors.get(kind)
+        if collector is None:
+            collector = metrics.setdefault(phase + '.' + kind,
+                                           MetricsCollector(max_hops=10))
+            collectors[kind] = collector
+        key = operation.key
+        hops = 0
+        error = None
+        start = time.perf_counter()
+        if kind == 'get':
+            node = network.get_node(int(hash_int(random.choice(nodes)), 16))
+            hops, value = node.get(key)
+            if value != data_store.get(key, -1):
+                error = 'not_found' if value == -1 else 'wrong_value'
+        elif kind == 'put':
+            node = network.get_node(int(hash_int(random.choice(nodes)), 16))
+            value = random.randint(0, 2 * num_points)
+            if node.put(key, value) == 0:
+                data_store[key] = value
+            elif key not in data_store:
+                error = 'not_stored'
+        elif kind == 'join':
+            if not join_node(network):
+                error = 'no_free_switch'
+        elif len(nodes) > 1:
+            delete_nodes(network, 1)
+        else:
+            error = 'last_node'
+        collector.record(hops,
+                         latency=time.perf_counter() - start,
+                         error=error)
+        pacer.done()
+
+    for kind in collectors:
+        report(phase + '.' + kind)
+    for row in pacer.summary():
+        print(format_rates(row))
+
+
+def leave_node(network, i, crash=False):
+    """Remove the node with Id i from the network
+    
+    Arguments:
+        network {Network}
+        i {Integer} -- Id of the node
+
+    Keyword Arguments:
+        crash {Boolean} -- Fail without notice instead of leaving gracefully
+                           (default: {False})
+    
+    Returns:
+        Boolean -- True if the node has left
+    """
+    node_hash = int(hash_int(i), 16)
+    node = network.get_node(node_hash)
+    if crash:
+        removed = network.remove_node(node_hash)
+    else:
+        removed = node.depart()
+    if removed:
+        node.release()
+        nodes.remove(i)
+        nodes_hash.remove(node_hash)
+    return removed
+
+
+def live_owner(network, key_hash):
+    """
+    Arguments:
+        network {Network}
+        key_hash {Integer}
+
+    Returns:
+        Integer -- Node Id of the live node numerically closest to key_hash
+    """
+    space = 1 << (l * b)
+    return min(network.nodes,
+               key=lambda num: min((num - key_hash) % space,
+                                   (key_hash - num) % space))
+
+
+def fetch_replica(network, owner, key_hash):
+    """
+    Arguments:
+        network {Network}
+        owner {Integer} -- Node Id on which the lookup for key_hash ended
+        key_hash {Integer}
+
+    Returns:
+        Integer -- Value of the key held by the closest node of the replica
+                   set of owner, -1 if none holds it
+    """
+    if not network.is_alive(owner):
+        return -1
+    for num in network.get_node(owner).replica_set(key_hash):
+        if network.is_alive(num) and key_hash in network.get_node(
+                num).data_store:
+            return network.get_node(num).data_store[key_hash]
+    return -1
+
+
+def run_churn(network, phase):
+    """Run lookups while nodes join, leave gracefully and crash, with session
+    times drawn from session_distribution, and report the routing success
+    rate, data availability, hop inflation and repair traffic over every
+    churn_window seconds. Each lookup is routed once, to the owner of its
+    key, and the value is read from the replica set of that owner, so
+    routing and lost keys are measured apart.
+    
+    Arguments:
+        network {Network}
+        phase {String} -- Name under which the lookup statistics are
+                          collected
+    """
+    collector = metrics.setdefault(phase, MetricsCollector(max_hops=10))
+    # Joins balance the departures, keeping the size of the overlay steady
+    schedule = ChurnSchedule(make_sessions(session_distribution,
+                                           mean_session_time),
+                             len(nodes) / mean_session_time,
+                             churn_lookup_rate,
+                             crash_fraction=crash_fraction,
+                             maintenance_period=churn_maintenance_period)
+    for i in nodes:
+        schedule.add_node(i, 0)
+    stats = ChurnStats(network, churn_window, lambda n: math.log(n, 2**b))
+    keys = list(data_store)
+    alive = set(nodes)
+    for now, kind, i in schedule.events(churn_duration):
+        for row in stats.advance(now):
+            print(format_row(row))
+        if kind == 'lookup':
+            key = random.choice(keys)
+            node = network.get_node(int(hash_int(random.choice(nodes)), 16))
+            key_hash = node.key_hash(key)
+            start = time.perf_counter()
+            owner, hops = node.lookup(key_hash)
+            latency = time.perf_counter() - start
+            routed = owner == live_owner(network, key_hash)
+            value = fetch_replica(network, owner, key_hash)
+            error = None
+            if value != data_store[key]:
+                error = 'not_found' if value == -1 else 'wrong_value'
+            collector.record(hops, latency=latency,
+                             error=error if routed else 'misrouted')
+            stats.record_lookup(hops, routed, error)
+        elif kind == 'join':
+            if join_node(network):
+                alive.add(nodes[-1])
+                schedule.add_node(nodes[-1], now)
+                stats.record_change('join')
+        elif kind == 'maintenance':
+            keep_alive(network)
+        elif i in alive and len(nodes) > 1:
+            node = network.get_node(int(hash_int(i), 16))
+            if leave_node(network, i, crash=kind == 'crash'):
+                alive.remove(i)
+                stats.record_change(kind, node)
+    for row in stats.advance(churn_duration):
+        print(format_row(row))
+
+    report(phase)
+    if churn_file is not None:
+        write_churn(stats.rows, churn_file)
+        print('Churn statistics written to ' + churn_file)
+
+
+def workload():
+    """
+    Returns:
+        Iterable -- Operations replayed from trace_file if set, else generated
+    """
+    if trace_file is not None:
+        return read_trace(trace_file)
+    keys = make_keys(key_distribution, num_points, zipf_exponent)
+    return generate_workload(workload_operations,
+                             keys,
+                             mix=operation_mix,
+                             schedule=arrival_schedule)
 
 
 def delete_nodes(network, del_nodes):
@@ -132,8 +575,14 @@ def delete_nodes(network, del_nodes):
     while num_deleted < del_nodes:
         chosen_node = random.choice(nodes)
         del_node = int(hash_int(chosen_node), 16)
-        removed = network.remove_node(del_node)
+        node = network.get_node(del_node)
+        if graceful_leave:
+            # Announce the departure to the affected nodes
+            removed = node.depart()
+        else:
+            removed = network.remove_node(del_node)
         if removed:
+            node.release()
             num_deleted += 1
             nodes.remove(chosen_node)
             nodes_hash.remove(int(hash_int(chosen_node), 16))
@@ -141,13 +590,53 @@ def delete_nodes(network, del_nodes):
 
 # Number of switches :- Max number of nodes that can be added onto the network
 num_switches = num_nodes
-network = Network(num_switches, read_from_file)
+if snapshot_dir is not None and os.path.isdir(snapshot_dir):
+    # Start from the overlay saved by an earlier run
+    if compact_tables:
+        store = RoutingTableStore(l, b, block_size=num_nodes)
+    network, saved_store = load_snapshot(snapshot_dir,
+                                         store=store,
+                                         verbose=verbose)
+    data_store.update(saved_store or {})
+    nodes.extend(
+        sorted(network.get_node(num).get_id() for num in network.nodes))
+    nodes_hash.extend(int(hash_int(i), 16) for i in nodes)
+    next_node = max(next_node, nodes[-1] + 1)
+else:
+    network = Network(num_switches, read_from_file)
 
-# Initialize network
-init_network(network, num_nodes)
-search_queries(network, num_queries)
+    # Initialize network
+    init_network(network, num_nodes)
+    store_keys(network, num_points)
+    if snapshot_dir is not None:
+        save_snapshot(snapshot_dir, network, data_store)
+if chrome_trace_file is not None:
+    # Trace a sample of the lookups made by the nodes
+    network.tracer = Tracer(trace_sample_rate)
+# The vectorized engine routes ids of at most 62 bits
+batch_search = batch_search and l * b <= 62
+if batch_search:
+    batch_search_queries(network, num_queries, 'search')
+else:
+    search_queries(network, num_queries, 'search')
+route_stretch(network, num_stretch_queries)
+get_queries(network, num_queries, 'get')
 delete_nodes(network, num_nodes // 2)
-search_queries(network, num_queries)
+if batch_search:
+    batch_search_queries(network, num_queries, 'search_after_delete')
+else:
+    search_queries(network, num_queries, 'search_after_delete')
+get_queries(network, num_queries, 'get_after_delete')
+if workload_operations > 0 or trace_file is not None:
+    run_workload(network, workload(), 'workload')
+if churn_duration > 0:
+    run_churn(network, 'churn')
+write_metrics(metrics, metrics_file)
+print('Statistics written to ' + metrics_file)
+print_load_report(network, load_file)
+if network.tracer is not None:
+    network.tracer.export(chrome_trace_file)
+    print('Lookup traces written to ' + chrome_trace_file)
 
 print('Total number of nodes: ' + str(num_nodes))
 print('Total number of data points: ' + str(num_points))
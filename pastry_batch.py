@@ -0,0 +1,246 @@
+"""
+Vectorized Routing on a whole Pastry overlay
+Exports the routing tables, leaf sets and node ids of all the PastryNode
+instances into NumPy arrays, and routes a batch of keys together, advancing
+every pending lookup by one hop per step, exactly as PastryNode.route would
+route it.
+"""
+import numpy as np
+from pastry_node import MAX_HOPS
+
+
+class BatchRouter:
+    """
+    Snapshot of the routing state of a Pastry overlay, as arrays:
+    node ids (n), routing tables (n x length x 2^b), leaf set offsets
+    (n x L, padded) and the sorted known nodes of each node, flattened.
+
+    Shared-prefix lengths and digits are computed with integer ops on whole
+    arrays, next hops are gathered from the routing table tensor and leaf set
+    ranges are resolved by counting the offsets below the key, i.e. a
+    searchsorted on every row at once. Only the rare case of routing, when the
+    routing table entry is empty, is resolved query by query, and lookups
+    meeting a failed node are handed over to PastryNode.forward_lookup, which
+    repairs the state of the node.
+    """
+    def __init__(self, network, l, b):
+        """
+        Arguments:
+            network {Network}
+            l {Integer} -- Number of digits in a node id
+            b {Integer} -- Number of bits in a digit
+        """
+        if l * b > 62:
+            raise ValueError('Batch routing supports node ids of at most '
+                             '62 bits')
+        self.network = network
+        self.length = l
+        self.b = b
+        self.mask = (1 << (l * b)) - 1
+        self.mid = (self.mask + 2) // 2
+
+        nodes = [network.get_node(num) for num in sorted(network.nodes)]
+        self.nums = np.array([node.get_num() for node in nodes],
+                             dtype=np.int64)
+        self.tables = np.array([[[int(entry) for entry in row]
+                                 for row in node.get_routing_table()]
+                                for node in nodes],
+                               dtype=np.int64).reshape(
+                                   len(nodes), l, 1 << b)
+
+        # Leaf sets, as sorted clockwise offsets, padded with the mask
+        size = max([node.leaf_set.size for node in nodes] + [1])
+        self.leaf_count = np.array([len(node.leaf_set) for node in nodes],
+                                   dtype=np.int64)
+        self.leaf_offsets = np.full((len(nodes), size),
+                                    self.mask,
+                                    dtype=np.int64)
+        for index, node in enumerate(nodes):
+            self.leaf_offsets[index, :len(node.leaf_set)] = (
+                node.leaf_set.offsets)
+
+        # Known nodes of each node, in one flat array
+        known = [node.known_nodes.nodes for node in nodes]
+        self.known_start = np.cumsum([0] + [len(nodes) for nodes in known])
+        self.known = np.array([num for nodes in known for num in nodes],
+                              dtype=np.int64)
+
+    def __circular_abs(self, node1, node2):
+        diff = np.abs(node1 - node2)
+        return np.minimum(diff, self.mask + 1 - diff)
+
+    def __common_prefix(self, keys, nums):
+        """Number of leading digits shared by keys and nums"""
+        diff = keys ^ nums
+        prefix = np.zeros(len(keys), dtype=np.int64)
+        for row in range(1, self.length + 1):
+            prefix += (diff >> (self.b * (self.length - row))) == 0
+        return prefix
+
+    def __leaf_route(self, current, nums, keys):
+        """Vectorized LeafSet.in_range and LeafSet.closest
+
+        Returns:
+            ndarray, ndarray, ndarray -- Mask of the keys in range, closest
+                                         member, circular distance to the key
+        """
+        offsets = self.leaf_offsets[current]
+        count = self.leaf_count[current]
+        rows = np.arange(len(current))
+        key_offsets = (keys - nums) & self.mask
+
+        split = (offsets < self.mid).sum(axis=1)
+        last_successor = offsets[rows, np.maximum(split - 1, 0)]
+        first_predecessor = offsets[rows, np.minimum(split, offsets.shape[1] -
+                                                     1)]
+        in_range = ((split > 0) & (key_offsets < last_successor)) | (
+            (split < count) & (key_offsets > first_predecessor))
+
+        # Bisection on every row: the two members around the key
+        index = (offsets < key_offsets[:, None]).sum(axis=1)
+        count = np.maximum(count, 1)
+        after = offsets[rows, index % count]
+        before = offsets[rows, (index - 1) % count]
+        after_diff = self.__circular_abs(after, key_offsets)
+        before_diff = self.__circular_abs(before, key_offsets)
+        best = np.where(before_diff < after_diff, before, after)
+        best_diff = np.minimum(before_diff, after_diff)
+        return in_range, (nums + best) & self.mask, best_diff
+
+    def __rare_route(self, current, keys, prefix, diff):
+        """PrefixIndex.closest for each query, over the known nodes
+
+        Returns:
+            ndarray -- Next node of each query (-1 if none is closer)
+        """
+        result = np.full(len(current), -1, dtype=np.int64)
+        for query in range(len(current)):
+            begin = self.known_start[current[query]]
+            end = self.known_start[current[query] + 1]
+            nodes = self.known[begin:end]
+            if len(nodes) == 0:
+                continue
+            key = keys[query]
+            index = np.searchsorted(nodes, key)
+            l = prefix[query]
+            if l == 0:
+                candidates = [nodes[index % len(nodes)], nodes[index - 1]]
+            else:
+                shift = self.b * (self.length - l)
+                low = (key >> shift) << shift
+                high = low + (1 << shift)
+                candidates = []
+                if index < len(nodes) and nodes[index] < high:
+                    candidates.append(nodes[index])
+                if index > 0 and nodes[index - 1] >= low:
+                    candidates.append(nodes[index - 1])
+            best_node = -1
+            best_diff = -1
+            for node in candidates:
+                node_diff = abs(int(node) - int(key))
+                node_diff = min(node_diff, self.mask + 1 - node_diff)
+                if best_diff == -1 or node_diff < best_diff:
+                    best_diff = node_diff
+                    best_node = int(node)
+            if best_node != -1 and best_diff < diff[query]:
+                result[query] = best_node
+        return result
+
+    def lookup(self, sources, keys, routed=None):
+        """Route lookups for keys started at sources, with the same owners and
+        hop counts as PastryNode.lookup
+
+        Arguments:
+            sources {ndarray} -- Node ids on which the lookups start
+            keys {ndarray} -- Hashes of the keys to be looked up
+
+        Keyword Arguments:
+            routed {ndarray} -- If given, the number of lookups routed through
+                                each node by the vectorized steps, indexed
+                                like self.nums, is added to it
+                                (default: {None})
+
+        Returns:
+            ndarray, ndarray, ndarray -- Node Id of the owner of each key (-1
+                                         if the lookup did not converge), Num
+                                         hops of each lookup, and a mask of
+                                         the lookups handed over to
+                                         PastryNode.forward_lookup on
+                                         meeting a failed node. The rest of
+                                         these lookups, from the node
+                                         handing them over, is counted by
+                                         the nodes themselves
+        """
+        keys = np.asarray(keys, dtype=np.int64)
+        owners = np.full(len(keys), -1, dtype=np.int64)
+        hops = np.zeros(len(keys), dtype=np.int64)
+        handed_off = np.zeros(len(keys), dtype=bool)
+        active = np.arange(len(keys))
+        current = np.searchsorted(self.nums, np.asarray(sources,
+                                                        dtype=np.int64))
+        for _ in range(MAX_HOPS):
+            if active.size == 0:
+                break
+            visited = current
+            nums = self.nums[current]
+            key = keys[active]
+            prefix = self.__common_prefix(key, nums)
+            next_node = np.full(len(active), -1, dtype=np.int64)
+
+            # Key found on the current node
+            found = prefix == self.length
+
+            # Keys in the range of the leaf set
+            in_range, closest, closest_diff = self.__leaf_route(
+                current, nums, key)
+            in_range &= ~found
+            diff = self.__circular_abs(nums, key)
+            leaf = in_range & (diff > closest_diff)
+            next_node[leaf] = closest[leaf]
+
+            # Other keys: routing table entry of the next digit
+            table = ~found & ~in_range
+            rows = np.nonzero(table)[0]
+            row_prefix = prefix[rows]
+            digit = (key[rows] >> (self.b * (self.length - 1 - row_prefix))
+                     ) & ((1 << self.b) - 1)
+            next_node[rows] = self.tables[current[rows], row_prefix, digit]
+
+            # Rare case: the entry is empty
+            rare = rows[next_node[rows] == -1]
+            if rare.size > 0:
+                next_node[rare] = self.__rare_route(current[rare], key[rare],
+                                                    prefix[rare], diff[rare])
+
+            done = next_node == -1
+            owners[active[done]] = nums[done]
+            forward = ~done
+            active = active[forward]
+            next_node = next_node[forward]
+            nums = nums[forward]
+
+            # The lookups meeting a failed node are finished by the node
+            position = np.minimum(np.searchsorted(self.nums, next_node),
+                                  len(self.nums) - 1)
+            alive = self.nums[position] == next_node
+            if routed is not None:
+                # The nodes finishing the other lookups count them
+                routed += np.bincount(
+                    np.concatenate((visited[done], visited[forward][alive])),
+                    minlength=len(self.nums))
+            handed_off[active[~alive]] = True
+            for query, num in zip(active[~alive].tolist(),
+                                  nums[~alive].tolist()):
+                node = self.network.get_node(num)
+                owner, num_hops = node.forward_lookup(
+                    int(keys[query]))
+                hops[query] += num_hops
+                owners[query] = owner
+                if owner == -1 or hops[query] >= MAX_HOPS:
+                    owners[query] = -1
+                    hops[query] = MAX_HOPS
+            active = active[alive]
+            current = position[alive]
+            hops[active] += 1
+        hops[active] = MAX_HOPS
+        return owners, hops, handed_off
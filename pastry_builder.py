@@ -0,0 +1,135 @@
+"""
+Offline Bulk Construction of a complete Pastry overlay
+Computes the state of all the PastryNode instances at once, from the full list
+of nodes, instead of joining the nodes one at a time.
+
+Proximity is taken as the distance between the switches of two nodes, the
+metric used by Network.proximity, so that the nearest candidates are found by
+sorting the switches.
+"""
+import numpy as np
+
+
+def leaf_sets(nums, size):
+    """Find the leaf set of every node, from the sorted order of node ids
+
+    Arguments:
+        nums {ndarray} -- Sorted node ids
+        size {Integer} -- Size of the leaf set (L)
+
+    Returns:
+        ndarray -- (n x L) indices into nums of the leaf set members
+    """
+    n = len(nums)
+    if n - 1 <= size:
+        steps = np.arange(1, n)
+    else:
+        half = np.arange(1, size // 2 + 1)
+        steps = np.concatenate((half, -half))
+    return (np.arange(n)[:, None] + steps[None, :]) % n
+
+
+def routing_tables(nums, switches, l, b):
+    """Find the routing table of every node. The entry at row r, column c of a
+    node is the proximity-closest node sharing its first r digits, and having
+    c as the next digit.
+
+    Arguments:
+        nums {ndarray} -- Sorted node ids
+        switches {ndarray} -- Switch of each node
+        l {Integer} -- Number of digits in a node id
+        b {Integer} -- Number of bits in a digit
+
+    Returns:
+        ndarray -- (n x l x 2^b) routing tables (-1 if empty)
+    """
+    n = len(nums)
+    width = 1 << b
+    span = int(switches.max()) + 1
+    tables = np.full((n, l, width), -1, dtype=np.int64)
+    for row in range(l):
+        shift = b * (l - row - 1)
+        # Every node falls in the cell given by its first row + 1 digits
+        groups, group_of = np.unique(nums >> shift, return_inverse=True)
+        order = np.lexsort((switches, group_of))
+        # Sorted by cell, then by switch
+        composite = group_of[order] * span + switches[order]
+        base = (nums >> (shift + b)) << b
+        for col in range(width):
+            targets = base | col
+            group = np.minimum(np.searchsorted(groups, targets),
+                               len(groups) - 1)
+            present = groups[group] == targets
+            low = np.searchsorted(composite, group * span)
+            high = np.searchsorted(composite, (group + 1) * span)
+            pos = np.searchsorted(composite, group * span + switches)
+            # Nearest switches on both sides, within the cell
+            right = order[np.maximum(np.minimum(pos, high - 1), 0)]
+            left = order[np.maximum(pos - 1, low)]
+            right_d = np.abs(switches[right] - switches)
+            left_d = np.abs(switches[left] - switches)
+            best = np.where(left_d < right_d, left, right)
+            tables[:, row, col] = np.where(present, nums[best], -1)
+    return tables
+
+
+def neighborhood_sets(switches, size):
+    """Find the neighborhood set of every node: the size proximity-closest
+    nodes
+
+    Arguments:
+        switches {ndarray} -- Switch of each node
+        size {Integer} -- Size of the neighborhood set (|M|)
+
+    Returns:
+        ndarray, ndarray -- (n x |M|) indices of the members,
+                            (n x |M|) distances of the members
+    """
+    n = len(switches)
+    k = min(size, n - 1)
+    order = np.argsort(switches, kind='stable')
+    rank = np.empty(n, dtype=np.int64)
+    rank[order] = np.arange(n)
+    # The k closest lie within k positions on either side, in switch order
+    window = np.concatenate((np.arange(-k, 0), np.arange(1, k + 1)))
+    candidate_rank = rank[:, None] + window[None, :]
+    valid = (candidate_rank >= 0) & (candidate_rank < n)
+    candidates = order[np.clip(candidate_rank, 0, n - 1)]
+    distances = np.abs(switches[candidates] - switches[:, None])
+    distances = np.where(valid, distances, np.iinfo(np.int64).max)
+    pick = np.argsort(distances, axis=1, kind='stable')[:, :k]
+    return (np.take_along_axis(candidates, pick, axis=1),
+            np.take_along_axis(distances, pick, axis=1))
+
+
+def build_overlay(network, nodes, l, b):
+    """Build the complete overlay of the given PastryNode instances, which
+    have been added to the network but not joined
+
+    Arguments:
+        network {Network}
+        nodes {List} -- PastryNode instances
+        l {Integer} -- Number of digits in a node id
+        b {Integer} -- Number of bits in a digit
+    """
+    if l * b > 63:
+        raise ValueError('Bulk construction supports node ids of at most '
+                         '63 bits')
+    nodes = sorted(nodes, key=lambda node: node.get_num())
+    if not nodes:
+        return
+    nums = np.array([node.get_num() for node in nodes], dtype=np.int64)
+    switches = np.array(
+        [network.switch_to_node[node.get_num()] for node in nodes],
+        dtype=np.int64)
+
+    leaves = leaf_sets(nums, 1 << b)
+    tables = routing_tables(nums, switches, l, b)
+    neighbors, distances = neighborhood_sets(switches, 1 << (b + 1))
+
+    leaf_ids = nums[leaves].tolist()
+    neighbor_ids = nums[neighbors].tolist()
+    distances = distances.tolist()
+    for index, node in enumerate(nodes):
+        node.load_state(tables[index].tolist(), leaf_ids[index],
+                        list(zip(neighbor_ids[index], distances[index])))
@@ -1,9 +1,15 @@
 """Class Definition for PastryNode"""
 import math
 import time
+import random
 import hashlib
 import itertools
-from modules.network import Node, Network
+import numpy as np
+from modules.network import OverlayNode, Network
+from modules.load_report import add_batch_load
+from modules.leaf_set import LeafSet
+from modules.neighborhood_set import NeighborhoodSet
+from modules.prefix_index import PrefixIndex
 
 # NOTE: Node Instances may call and use instance variables from other nodes,
 # without sending network packets. [Five Instances in the File]
@@ -11,22 +17,55 @@ from modules.network import Node, Network
 
 length = 0
 B = 0
+ID_SPACE = 0
+MAX_HOPS = 32
+HASH_BITS = 160
 
 
 def common_prefix(key, node_id):
-    """Find the common prefix between two hex digit numbers
+    """Find the number of leading digits shared by two ids, using the position
+    of the highest differing bit of their XOR
     
     Arguments:
-        key {Hex String}
-        node_id {Hex String}
+        key {Integer}
+        node_id {Integer}
 
     Returns:
         Integer -- Length of common prefix
     """
-    prefix = key
-    while node_id[:len(prefix)] != prefix and prefix:
-        prefix = prefix[:len(prefix) - 1]
-    return len(prefix[2:])
+    global length, B
+    diff = key ^ node_id
+    if diff == 0:
+        return length
+    return length - (diff.bit_length() + B - 1) // B
+
+
+def digit_at(int_val, index):
+    """Returns the digit of int_val at position index (0 is the most
+    significant digit)
+    
+    Arguments:
+        int_val {Integer}
+        index {Integer}
+    
+    Returns:
+        Integer -- Value of the digit
+    """
+    global length, B
+    return (int_val >> (B * (length - 1 - index))) & ((1 << B) - 1)
+
+
+def to_digits(int_val):
+    """Returns all the digits of int_val, most significant first
+    
+    Arguments:
+        int_val {Integer}
+    
+    Returns:
+        Tuple -- Tuple of length digits
+    """
+    global length
+    return tuple(digit_at(int_val, index) for index in range(length))
 
 
 def circular_between(start, bet, end):
@@ -56,57 +95,102 @@ def circular_abs(node1, node2):
     Returns:
         Integer -- Circular Absolute Difference
     """
-    global length
-    return min(abs(node1 - node2), math.pow(16, length) - abs(node1 - node2))
+    global ID_SPACE
+    diff = abs(node1 - node2)
+    return min(diff, ID_SPACE - diff)
+
+
+def hash_key(integer):
+    """Hash the given integers and trim to length digits of B bits
+    
+    Arguments:
+        integer {Integer}
+    
+    Returns:
+        Integer -- Hashed Integer Value
+    """
+    global length, B
+    name = str(integer)
+    m = hashlib.sha1(name.encode('utf-8'))
+    return int(m.hexdigest(), 16) >> (HASH_BITS - B * length)
 
 
 def hex_code(int_val):
-    """Returns six digit hex code
+    """Returns the hex code of int_val, zero padded to length digits
     
     Arguments:
         int_val {Integer}
     
     Returns:
-        String -- Hex String of length digits
+        String -- Hex String wide enough for length digits of B bits
     """
-    global length
-    hex_string = hex(int_val)[2:]
-    while len(hex_string) != length:
-        hex_string = '0' + hex_string
-    ret = '0x' + hex_string
-    return ret
+    global length, B
+    return '0x' + format(int_val, '0' + str((B * length + 3) // 4) + 'x')
 
 
-class PastryNode(Node):
+class PastryNode(OverlayNode):
     """Implementation Class for PastryNode, a single node instance, 
        running the Pastry Protocol"""
-    def __init__(self, node_id, node_hash, network, l, b):
+    def __init__(self,
+                 node_id,
+                 node_hash,
+                 network,
+                 l,
+                 b,
+                 store=None,
+                 replicas=4,
+                 verbose=False):
         """Constructor for PastryNode
 
         Arguments:
             node_id {Integer} -- Network Id of the node
             node_hash {String} -- SHA1 nodeId
             network {Network}
-            l {Integer} -- length of the SHA1 nodeId
-            b {Integer} -- Pastry parameter
+            l {Integer} -- length of the SHA1 nodeId, in digits
+            b {Integer} -- Pastry parameter: number of bits in a digit. Node
+                           ids are l * b bits wide (at most 160)
+
+        Keyword Arguments:
+            store {RoutingTableStore} -- Shared compact storage to keep the
+                                         routing table in, instead of Python
+                                         lists (default: {None})
+            replicas {Integer} -- Number of nodes each stored key is kept on
+                                  (default: {4})
+            verbose {Boolean} -- Print the node state once joined
+                                 (default: {False})
         """
-        global length, B
+        global length, B, ID_SPACE
+        if l * b > HASH_BITS:
+            raise ValueError('Node ids of ' + str(l * b) +
+                             ' bits are wider than the SHA1 hash')
         super().__init__(node_id, node_hash, network)
         self.L = int(math.pow(2, b))
-        self.routing_table = []
-        self.leaf_set = []
-        self.neighborhood_set = []
         length = l
         B = b
+        ID_SPACE = 1 << (B * length)
+        self.leaf_set = LeafSet(self.get_num(), self.L, ID_SPACE)
+        self.neighborhood_set = NeighborhoodSet(int(math.pow(2, b + 1)))
+        self.known_nodes = PrefixIndex(self.get_num(), B, length)
+        self.replicas = replicas
+        self.verbose = verbose
+        self.data_store = {}
+        self.store = None
+        self.slot = -1
+        self.routing_table = []
         for _ in range(l):
             row = [-1] * self.L
             self.routing_table.append(row)
+        if store is not None:
+            self.attach(store)
+
+        # Reverse index: Node Id -> list of (row, col) positions in the
+        # routing table
+        self.positions = {}
 
         # Update routing table to include self entry
-        hash_string = hex_code(self.get_num())[2:]
+        self.digits = to_digits(self.get_num())
         for index in range(length):
-            digit = hash_string[index]
-            self.routing_table[index][int(digit, 16)] = self.get_num()
+            self.routing_table[index][self.digits[index]] = self.get_num()
 
     def __str__(self):
         """Print the PastryNode instance"""
@@ -134,13 +218,35 @@ class PastryNode(Node):
         """
         return self.routing_table
 
+    def attach(self, store):
+        """Move the routing table into a slot of the shared compact storage,
+        once the node has been added to the network
+
+        Arguments:
+            store {RoutingTableStore}
+        """
+        self.slot, table = store.allocate(self.get_num())
+        table[:] = self.routing_table
+        self.routing_table = table
+        self.store = store
+
+    def release(self):
+        """Give the slot of the routing table back to the shared compact
+        storage, once the node has left the network"""
+        if self.store is None:
+            return
+        self.routing_table = self.routing_table.tolist()
+        self.store.free(self.slot)
+        self.store = None
+        self.slot = -1
+
     def get_neighborhood_set(self):
         """Return the neighborhood set to when wanted
         
         Returns:
             Array -- Neighborhood Set
         """
-        return self.neighborhood_set
+        return list(self.neighborhood_set)
 
     def get_leaf_set(self):
         """Return the leaf set to when wanted
@@ -148,247 +254,260 @@ class PastryNode(Node):
         Returns:
             Array -- Leaf Set
         """
-        return self.leaf_set
+        return list(self.leaf_set)
 
-    def __extreme_leaf_set(self, extreme, failed_nodes=None):
-        """Get the extremes of the current node's leaf set
-        
-        Arguments:
-            extreme {Integer} -- -1 for min (right extreme),
-                                  1 for max (left extreme)
+    def load_counters(self):
+        """
+        Returns:
+            Dict -- Name -> value of each load counter of the node, with the
+                    keys stored and the number of entries of its routing
+                    state (routing table, leaf, neighborhood and known nodes)
+        """
+        counters = super().load_counters()
+        counters['keys'] = len(self.data_store)
+        counters['state_size'] = (
+            sum(len(cells) for cells in self.positions.values()) +
+            len(self.leaf_set) + len(self.neighborhood_set) +
+            len(self.known_nodes))
+        return counters
 
-        Keyword Arguments:
-            failed_nodes {List} -- List of Node Ids of a failed nodes
-                                   (default: {None})
+    def __set_entry(self, row, col, node):
+        """Set an entry of the routing table, keeping the reverse index of
+        positions up to date
 
-        Returns:
-            Integer -- Node Id of the extreme node
-        """
-        greater_list = []
-        lower_list = []
-        for node in self.leaf_set:
-            if failed_nodes and node in failed_nodes: continue
-            if node > self.get_num():
-                greater_list.append(node)
-            else:
-                lower_list.append(node)
-        greater_list.sort()
-        lower_list.sort()
-
-        if len(greater_list) + len(lower_list) < self.L:
-            if extreme == -1:
-                if len(lower_list) != 0:
-                    return lower_list[0]
-            else:
-                if len(greater_list) != 0:
-                    return greater_list[-1]
-            return self.get_num()
-        else:
-            if extreme == -1:
-                if len(lower_list) >= self.L / 2:
-                    return lower_list[-self.L // 2]
-                else:
-                    return greater_list[self.L // 2]
-            else:
-                if len(greater_list) >= self.L / 2:
-                    return greater_list[self.L // 2 - 1]
-                else:
-                    return lower_list[-self.L // 2 - 1]
+        Arguments:
+            row {Integer} -- Row of the routing table
+            col {Integer} -- Column of the routing table
+            node {Integer} -- Node Id to be set (-1 to clear the entry)
+        """
+        old = int(self.routing_table[row][col])
+        if old == node:
+            return
+        if old in self.positions:
+            cells = self.positions[old]
+            cells.remove((row, col))
+            if not cells:
+                del self.positions[old]
+                self.__forget([old])
+        self.routing_table[row][col] = node
+        if node != -1 and node != self.get_num():
+            self.positions.setdefault(node, []).append((row, col))
+
+    def __forget(self, nodes):
+        """Drop from the index of known nodes the nodes which are no longer in
+        the leaf set, neighborhood set or routing table
 
-    def __merge_leaf_set(self, array, failed_nodes=None):
+        Arguments:
+            nodes {Iterable} -- Node Ids evicted from one of them
         """
-        Merge the array into the current node's leaf set, choosing the right
-        nodes.
+        for node in nodes:
+            if (node not in self.positions and node not in self.leaf_set
+                    and node not in self.neighborhood_set):
+                self.known_nodes.remove(node)
+
+    def __offer_entry(self, row, col, node):
+        """Offer node for the entry at row, col of the routing table. It is
+        kept if the entry is empty, or if it is closer than the current entry
+        as per the proximity metric, so that each entry holds the nearest
+        candidate seen
         
         Arguments:
-            array {List} -- List of leaf nodes that can potentially be added
+            row {Integer} -- Row of the routing table
+            col {Integer} -- Column of the routing table
+            node {Integer} -- Node Id of the candidate
 
-        Keyword Arguments:
-            failed_nodes {List} -- List of Node Ids of a failed nodes
-                                   (default: {None})
+        Returns:
+            Boolean -- True if node was set in the entry
         """
-        greater_list = []
-        lower_list = []
-        for node in itertools.chain(self.leaf_set, array):
-            if failed_nodes:
-                if node in failed_nodes or (
-                        not self.network_api.is_alive(node)):
-                    continue
-            if node > self.get_num() and (node not in greater_list):
-                greater_list.append(node)
-            elif node < self.get_num() and (node not in lower_list):
-                lower_list.append(node)
-        greater_list.sort()
-        lower_list.sort()
-
-        # Merge the two lists to get the final leaf set
-        if len(greater_list) + len(lower_list) <= self.L:
-            greater_list.extend(lower_list)
-            self.leaf_set = greater_list
-        else:
-            if len(greater_list) < self.L / 2:
-                num_needed = int(self.L / 2 - len(greater_list))
-                greater_list.extend(lower_list[:num_needed])
-                lower_list = lower_list[num_needed:]
-            if len(lower_list) < self.L / 2:
-                num_needed = int(self.L / 2 - len(lower_list))
-                lower_list.extend(greater_list[-num_needed:])
-                greater_list = greater_list[:-num_needed]
-            if len(greater_list) > self.L / 2:
-                greater_list = greater_list[:self.L // 2]
-            if len(lower_list) > self.L / 2:
-                lower_list = lower_list[-self.L // 2:]
-            greater_list.extend(lower_list)
-            self.leaf_set = greater_list
-
-    def __repair_leaf_set(self, failed_node):
-        """Repair the leaf set of a node when a node in leaf set fails
+        node = int(node)
+        current = int(self.routing_table[row][col])
+        if node == -1 or node == current or current == self.get_num():
+            return False
+        distance = self.network_api.proximity(self.get_num(), node)
+        if distance == -1:
+            return False
+        if current != -1:
+            current_distance = self.network_api.proximity(
+                self.get_num(), current)
+            # Keep the current entry, unless it is farther or has failed
+            if current_distance != -1 and current_distance <= distance:
+                return False
+        self.__set_entry(row, col, node)
+        return True
+
+    def __repair_leaf_set(self, failed_nodes):
+        """Repair the leaf set of a node when nodes in leaf set fail
         
         Arguments:
-            failed_node {Integer} -- Hash of the node which failed
-        """
-        # Find on which side the failed node is, in the leaf set
-        # Check if failed_node is between min_leaf and node
-        is_smaller = circular_between(self.__extreme_leaf_set(-1), failed_node,
-                                      self.get_num())
-        if is_smaller:
-            get_ls_from = self.__extreme_leaf_set(-1)
-        else:
-            get_ls_from = self.__extreme_leaf_set(1)
-
-        # Get the leaf set from this node, if alive else search for other nodes
-        failed_nodes = [failed_node]
-        while not self.network_api.is_alive(get_ls_from):
-            failed_nodes.append(get_ls_from)
-            is_smaller = circular_between(
-                self.__extreme_leaf_set(-1, failed_nodes), failed_node,
-                self.get_num())
-            if is_smaller:
-                get_ls_from = self.__extreme_leaf_set(-1, failed_nodes)
-            else:
-                get_ls_from = self.__extreme_leaf_set(1, failed_nodes)
-
-        leaf_node = (self.network_api.get_node(get_ls_from))
-        # Delete the failed node and then, merge
-        self.leaf_set.remove(failed_node)
-        self.__merge_leaf_set(leaf_node.get_leaf_set(),
-                              failed_nodes=failed_nodes)
-
-    def __repair_neighborhood_set(self, failed_node):
-        """Repair the neighborhood set of a node when another one fails
+            failed_nodes {List} -- Hashes of the nodes which failed
+        """
+        # Find on which sides the failed nodes are, in the leaf set
+        sides = set()
+        for node in failed_nodes:
+            sides.add(self.leaf_set.is_successor(node))
+            self.leaf_set.remove(node)
+
+        # Drop other failed members
+        failed = set(failed_nodes)
+        for node in list(self.leaf_set):
+            if not self.network_api.is_alive(node):
+                failed.add(node)
+                self.leaf_set.remove(node)
+
+        for is_successor in sides:
+            # Get the leaf set from the extreme node on that side, if alive,
+            # else drop it and try the next extreme node
+            while True:
+                if is_successor:
+                    get_ls_from = self.leaf_set.max_extreme()
+                else:
+                    get_ls_from = self.leaf_set.min_extreme()
+                if self.network_api.is_alive(get_ls_from):
+                    break
+                failed.add(get_ls_from)
+                self.leaf_set.remove(get_ls_from)
+
+            leaf_node = (self.network_api.get_node(get_ls_from))
+            alive_nodes = [
+                node for node in leaf_node.get_leaf_set()
+                if node not in failed and self.network_api.is_alive(node)
+            ]
+            evicted = []
+            self.leaf_set.merge(alive_nodes, evicted=evicted)
+            self.known_nodes.update(node for node in alive_nodes
+                                    if node in self.leaf_set)
+            self.__forget(evicted)
+
+        for node in failed:
+            self.known_nodes.remove(node)
+
+        # Replicas held by the failed nodes have to be re-created
+        self.__restore_replicas()
+
+    def __repair_neighborhood_set(self, failed_nodes):
+        """Repair the neighborhood set of a node when other nodes fail
         
         Arguments:
-            failed_node {Integer} -- Hash of the node which failed
+            failed_nodes {List} -- Hashes of the nodes which failed
         """
-        self.neighborhood_set.remove(failed_node)
+        for node in failed_nodes:
+            self.neighborhood_set.remove(node)
 
-        # Find the nearest node
-        nearest = -1
-        nearest_node = -1
-        for neighbor in self.neighborhood_set:
-            distance = self.network_api.proximity(self.get_num(), neighbor)
-            if distance != -1 and (nearest == -1 or distance < nearest):
-                nearest = distance
-                nearest_node = neighbor
+        # Find the nearest node, from the cached distances
+        nearest_node, nearest = self.neighborhood_set.nearest()
+        if nearest_node == -1 or not self.network_api.is_alive(nearest_node):
+            return
 
-        # Find the nearest node that hasn't yet been included
+        # Refill from the nodes that haven't yet been included
         neighborhood_set = self.network_api.get_node(
             nearest_node).get_neighborhood_set()
-        nearest = -1
-        nearest_node = -1
+        evicted = []
         for node in neighborhood_set:
-            if node not in self.neighborhood_set:
-                # Find the nearest such node
+            if node not in self.neighborhood_set and node != self.get_num():
                 distance = self.network_api.proximity(self.get_num(), node)
-                if distance != -1 and (nearest == -1 or distance < nearest):
-                    nearest = distance
-                    nearest_node = node
-        if nearest_node != -1:
-            self.neighborhood_set.append(nearest_node)
-
-    def __repair(self, failed_node):
-        """Repair the leaf and neighborhoodsets and the routing table
-        
+                if self.neighborhood_set.add(node, distance, evicted):
+                    self.known_nodes.add(node)
+        self.__forget(evicted)
+
+    def __find_replacement(self, l, d, failed):
+        """Find a replacement for the routing table entry at row l, column d,
+        by asking the nodes in rows l and l + 1 for their entry at (l, d)
+
         Arguments:
-            failed_node {Integer} -- Hash of the node which has failed
+            l {Integer} -- Row of the entry
+            d {Integer} -- Column of the entry
+            failed {Set} -- Node Ids of the failed nodes
+
+        Returns:
+            Integer -- Node Id of the replacement (-1 if not found)
         """
-        global length
-        # First repair leaf and neighborhood set in the wake of failed node
-        if failed_node in self.leaf_set:
-            self.__repair_leaf_set(failed_node)
-        if failed_node in self.neighborhood_set:
-            self.__repair_neighborhood_set(failed_node)
-
-        # Find the entry in the routing table
-        l = d = -1
-        contact_list = []
-        for row_index in range(length):
-            row = self.routing_table[row_index]
-            for node_index in range(len(row)):
-                if row[node_index] == failed_node:
-                    l = row_index
-                    d = node_index
-        if l != -1 and d != -1:
-            if l < length - 1:
-                iterlist = itertools.chain(self.routing_table[l],
-                                           self.routing_table[l + 1])
-            else:
-                iterlist = self.routing_table[l]
-            for node in iterlist:
-                if node != failed_node and self.network_api.is_alive(node):
-                    contact_list.append(node)
-
-            replacement = failed_node
-            # Contact each of these nodes to find replacement for the failed node
-            for node_hash in contact_list:
-                contact_node = (self.network_api.get_node(node_hash))
+        global length, B
+        for row in self.routing_table[l:min(l + 2, length)]:
+            for node in row:
+                node = int(node)
+                if node == -1 or node == self.get_num() or node in failed:
+                    continue
+                if not self.network_api.is_alive(node):
+                    continue
+                contact_node = (self.network_api.get_node(node))
                 # Check if the alternate node is alive
-                alternate_node = contact_node.get_routing_table()[l][d]
-                if self.network_api.is_alive(
-                        alternate_node) and alternate_node != failed_node:
-                    replacement = alternate_node
-                    break
+                alternate_node = int(contact_node.get_routing_table()[l][d])
+                if alternate_node != -1 and alternate_node not in failed and (
+                        self.network_api.is_alive(alternate_node)):
+                    return alternate_node
+
+        # Fall back on the closest known node with the prefix of the entry
+        shift = B * (length - l - 1)
+        prefix = (((self.get_num() >> (shift + B)) << B) | d) << shift
+        node, _ = self.known_nodes.closest(prefix, l + 1)
+        if node != -1 and node not in failed and self.network_api.is_alive(
+                node):
+            return node
+        return -1
+
+    def repair_nodes(self, failed_nodes):
+        """Repair the leaf and neighborhood sets and the routing table when a
+        list of nodes fail, in one pass
+        
+        Arguments:
+            failed_nodes {List} -- Hashes of the nodes which have failed
+        """
+        failed = set(failed_nodes)
+        self.num_repairs += len(failed)
+        for node in failed:
+            self.known_nodes.remove(node)
+
+        # First repair leaf and neighborhood set in the wake of failed nodes
+        failed_leaves = [node for node in failed if node in self.leaf_set]
+        if failed_leaves:
+            self.__repair_leaf_set(failed_leaves)
+        failed_neighbors = [
+            node for node in failed if node in self.neighborhood_set
+        ]
+        if failed_neighbors:
+            self.__repair_neighborhood_set(failed_neighbors)
 
-            if replacement == failed_node:
-                self.routing_table[l][d] = -1
-            else:
-                self.routing_table[l][d] = replacement
+        # Replace every entry of the failed nodes in the routing table
+        for node in failed:
+            for l, d in list(self.positions.get(node, [])):
+                replacement = self.__find_replacement(l, d, failed)
+                self.__set_entry(l, d, replacement)
+                self.known_nodes.add(replacement)
 
         # State after repair
         # print("After repair: ", self)  # Debug
 
-    def __route(self, key_hash):
+    def __route(self, key_hash, trace=None):
         """
         Internal function to find the suitable candidate, to send request
         Implemented following the Pastry Protocol
 
         Arguments:
             key_hash {Integer} -- Hash of the key to be found
+
+        Keyword Arguments:
+            trace {LookupTrace} -- Trace told the rule applied, if the lookup
+                                   is traced (default: {None})
         
         Returns:
             Integer -- NodeId of the next node to which the request is to be
                        forwarded
-                       (returns -1 if not present and 16^length if found)
+                       (returns -1 if not present and ID_SPACE if found)
         """
-        global length
-        l = common_prefix(hex_code(key_hash), hex_code(self.get_num()))
+        global length, ID_SPACE
+        l = common_prefix(key_hash, self.get_num())
         if l == length:
-            return int(math.pow(16, length))
+            if trace is not None:
+                trace.decide('found')
+            return ID_SPACE
 
         # print("Running Internal Route at node " + hex_code(self.get_num()) +
         #       " to search " + hex_code(key_hash))  # Debug
         # Find if the key is in the leaf set
-        ls_string = [hex_code(x)[2:] for x in self.leaf_set]
-        if circular_between(self.__extreme_leaf_set(-1), key_hash,
-                            self.__extreme_leaf_set(1)):
-            min_diff = -1
-            min_node = 0x0
-            diff_arr = []
-            for node in self.leaf_set:
-                diff_arr.append(circular_abs(node, key_hash))
-                if circular_abs(node, key_hash) < min_diff or min_diff == -1:
-                    min_diff = circular_abs(node, key_hash)
-                    min_node = node
+        if self.leaf_set.in_range(key_hash):
+            min_node, min_diff = self.leaf_set.closest(key_hash)
+            if trace is not None:
+                trace.decide('leaf_set', distance=min_diff)
             # Route only if min_node is closer than current node
             diff = circular_abs(self.get_num(), key_hash)
             if diff > min_diff:
@@ -397,54 +516,64 @@ class PastryNode(Node):
 
         # print("Not found in leaf set") # Debug
         # Not found in leaf set: route to the most suitable next node
-        digit = hex_code(key_hash)[2:][l]
-        if self.routing_table[l][int(digit, 16)] != -1:
+        digit = digit_at(key_hash, l)
+        if trace is not None:
+            trace.decide('routing_table', row=l, col=digit)
+        if self.routing_table[l][digit] != -1:
             # print("Found " + hex_code(key_hash) + " in routing table of ",
             #       hex_code(self.get_num()),
-            #       hex_code(self.routing_table[l][int(digit, 16)]), l,
+            #       hex_code(self.routing_table[l][digit]), l,
             #       digit)  # Debug
-            return self.routing_table[l][int(digit, 16)]
+            return int(self.routing_table[l][digit])
         else:
+            # Rare case: forward to the closest known node, sharing at least
+            # l digits with the key, if it is closer than the current node
             min_diff = circular_abs(self.get_num(), key_hash)
-            # Check in leaf set and neighbourhood set
-            for node in itertools.chain(self.leaf_set, self.neighborhood_set):
-                diff = circular_abs(node, key_hash)
-                prefix = common_prefix(hex_code(key_hash), hex_code(node))
-                if diff < min_diff and prefix >= l:
-                    return node
-            # Check in routing table
-            for row in self.routing_table:
-                for node in row:
-                    diff = circular_abs(node, key_hash)
-                    prefix = common_prefix(hex_code(key_hash), hex_code(node))
-                    if diff < min_diff and prefix >= l:
-                        return node
+            if trace is not None:
+                trace.decide('fallback_scan',
+                             row=l,
+                             known=len(self.known_nodes))
+            node, diff = self.known_nodes.closest(key_hash, l)
+            if node != -1 and diff < min_diff:
+                return node
             # Key not located in the DHT
             return -1
 
-    def route(self, key_hash):
+    def route(self, key_hash, trace=None):
         """Public Function to route the request to the next node
         
         Arguments:
             key_hash {String} -- Hash of the key to be searched
+
+        Keyword Arguments:
+            trace {LookupTrace} -- Trace of the lookup, if it is traced
+                                   (default: {None})
         
         Returns:
             Integer -- Integer hash of the next node to ping
-                       (returns -1 if not present and 16^length if found)
+                       (returns -1 if not present and ID_SPACE if found)
         """
-        global length
-        next_node = self.__route(key_hash)
+        global ID_SPACE
+        self.num_routed += 1
+        next_node = self.__route(key_hash, trace)
         # Search query found
-        if next_node == int(math.pow(16, length)) or next_node == -1:
+        if next_node == ID_SPACE or next_node == -1:
             return next_node
 
         # Check if the node is alive.
         while (not self.network_api.is_alive(next_node)):
             # Node has failed/departed. Follow repair protocol
             # print('Failed Node: ' + hex_code(next_node))
-            self.__repair(next_node)
-            next_node = self.__route(key_hash)
-            if next_node == int(math.pow(16, length)) or next_node == -1:
+            if trace is not None:
+                start = trace.tracer.now()
+            self.repair_nodes([next_node])
+            if trace is not None:
+                trace.span('repair',
+                           start,
+                           node=self.get_num(),
+                           failed=next_node)
+            next_node = self.__route(key_hash, trace)
+            if next_node == ID_SPACE or next_node == -1:
                 return next_node
         return next_node
 
@@ -463,58 +592,109 @@ class PastryNode(Node):
         """
         global length, B
         # Add into leaf set
-        self.__merge_leaf_set(leaf_set)
+        self.leaf_set.merge(leaf_set)
 
         # Also fetch from extreme nodes
-        min_extreme = self.__extreme_leaf_set(-1)
-        max_extreme = self.__extreme_leaf_set(1)
-        min_node = self.network_api.get_node(min_extreme)
-        max_node = self.network_api.get_node(max_extreme)
-        self.__merge_leaf_set(min_node.get_leaf_set())
-        self.__merge_leaf_set(max_node.get_leaf_set())
-
-        # Select the neighborhood set
-        # Remove the farthest node, if neighborhood set is large
-        if len(neighborhood_set) > math.pow(2, B + 1):
-            farthest = -1
-            farthest_node = -1
-            for node in neighborhood_set:
+        for extreme in (self.leaf_set.min_extreme(),
+                        self.leaf_set.max_extreme()):
+            if self.network_api.is_alive(extreme):
+                extreme_node = self.network_api.get_node(extreme)
+                self.leaf_set.merge(extreme_node.get_leaf_set())
+
+        # Select the neighborhood set: the farthest nodes are evicted, if the
+        # neighborhood set is large
+        for node in neighborhood_set:
+            if node != self.get_num():
                 distance = self.network_api.proximity(self.get_num(), node)
-                if distance != -1 and (farthest < distance or farthest == -1):
-                    farthest = distance
-                    farthest_node = node
-            neighborhood_set.remove(farthest_node)
-        self.neighborhood_set = neighborhood_set
-
-        # Update from the routing tables received
-        routing_table_nodes = []
+                self.neighborhood_set.add(node, distance)
+
+        # Update from the routing tables received: row i of any node on the
+        # path sharing at least i digits with the current node is a valid
+        # row i, keep the closest candidate for each entry
         for index in range(len(routing_tables)):
-            for node_index in range(self.L):
-                self.routing_table[index][node_index] = routing_tables[index][
-                    index][node_index]
-                node = self.routing_table[index][node_index]
-                if (node != -1) and (node not in self.leaf_set) and (
-                        node not in self.neighborhood_set):
-                    routing_table_nodes.append(node)
+            for table in routing_tables[index:]:
+                for node_index in range(self.L):
+                    self.__offer_entry(index, node_index,
+                                       table[index][node_index])
 
         # Update leaf_set and neighborhood_set nodes in routing table
         for node in itertools.chain(leaf_set, neighborhood_set):
-            l = common_prefix(hex_code(node), hex_code(self.get_num()))
-            # If match till lth level, add in routing table
-            digit = hex_code(node)[2:][l]
-            if l >= 1 and self.routing_table[l][int(digit, 16)] == -1:
-                self.routing_table[l][int(digit, 16)] = node
+            if node == self.get_num():
+                continue
+            l = common_prefix(node, self.get_num())
+            self.__offer_entry(l, digit_at(node, l), node)
 
-        # Update routing table to include self entry
-        hash_string = hex_code(self.get_num())[2:]
-        for index in range(length):
-            digit = hash_string[index]
-            self.routing_table[index][int(digit, 16)] = self.get_num()
+        routing_table_nodes = [
+            node for node in self.positions
+            if node not in self.leaf_set and node not in self.neighborhood_set
+        ]
+
+        # Index all the nodes kept, for the rare case of routing
+        self.known_nodes.update(self.leaf_set)
+        self.known_nodes.update(self.neighborhood_set)
+        self.known_nodes.update(self.positions)
 
         # Send the node state to other nodes
         return itertools.chain(routing_table_nodes, self.leaf_set,
                                self.neighborhood_set)
 
+    def load_state(self,
+                   routing_table,
+                   leaf_set,
+                   neighborhood_set,
+                   known_nodes=None):
+        """Initialize routing table, leaf set and neighborhood set directly,
+        from the state computed offline for a complete overlay, or saved in a
+        snapshot
+        
+        Arguments:
+            routing_table {List} -- length rows of 2^b Node Ids (-1 if empty),
+                                    or an array of shape (length, 2^b)
+            leaf_set {List} -- Node Ids of the leaf set
+            neighborhood_set {List} -- (Node Id, distance) pairs
+
+        Keyword Arguments:
+            known_nodes {List} -- Node Ids indexed for the rare case of
+                                  routing, if known, instead of those of the
+                                  state (default: {None})
+        """
+        global length
+        own = self.get_num()
+        self.positions = {}
+        if self.store is not None:
+            # Copy the whole table into the shared storage at once, and index
+            # the positions of the entries set
+            self.routing_table[:] = routing_table
+            self.routing_table[np.arange(length), list(self.digits)] = own
+            rows, cols = np.nonzero((self.routing_table != -1)
+                                    & (self.routing_table != own))
+            for row, col, node in zip(
+                    rows.tolist(), cols.tolist(),
+                    self.routing_table[rows, cols].tolist()):
+                self.positions.setdefault(node, []).append((row, col))
+        else:
+            # Set whole rows, and index the positions of the entries in one
+            # pass
+            for row in range(length):
+                table_row = [int(node) for node in routing_table[row]]
+                # Update routing table to include self entry
+                table_row[self.digits[row]] = own
+                self.routing_table[row][:] = table_row
+                for col, node in enumerate(table_row):
+                    if node != -1 and node != own:
+                        self.positions.setdefault(node, []).append((row, col))
+
+        self.leaf_set.load(leaf_set)
+        self.neighborhood_set.load(neighborhood_set)
+
+        # Index all the nodes learnt, for the rare case of routing
+        if known_nodes is not None:
+            self.known_nodes.update(known_nodes)
+            return
+        self.known_nodes.update(self.leaf_set)
+        self.known_nodes.update(self.neighborhood_set)
+        self.known_nodes.update(self.positions)
+
     def node_arrival(self, x):
         """Function Call that shall be made when node X enters the network and
            contacts current node
@@ -527,7 +707,7 @@ class PastryNode(Node):
                 Num hops, Routing Tables, Leaf Set, Neighborhood Set
                 (Returns the id if already exists)
         """
-        global length
+        global ID_SPACE
         # print("Running Node Arrival for key " + hex_code(x) + " on " +
         #       hex_code(self.get_num()))  # Debug
         # Send all routing tables, A's neighbourhood set and Z's leaf set to X
@@ -535,25 +715,25 @@ class PastryNode(Node):
         next_node = self.get_num()
         z_node_id = next_node
 
-        num_times = 32
+        num_times = MAX_HOPS
         while next_node != -1:
             # Add the routing table as many times as there are matching
             # new digits with the key
-            l = common_prefix(hex_code(x), hex_code(next_node))
+            l = common_prefix(x, next_node)
             node = (self.network_api.get_node(next_node))
             for i in range(l - len(routing_tables) + 1):
                 routing_tables.append(node.get_routing_table())
             z_node_id = next_node
             next_node = node.route(x)
-            if num_times == 0 or next_node == int(math.pow(16, length)):
+            if num_times == 0 or next_node == ID_SPACE:
                 break
             num_times -= 1
 
         z_node = (self.network_api.get_node(z_node_id))
         if num_times == 0:
-            return (32 - num_times), [], [], []
-        if next_node == int(math.pow(16, length)):
-            return (32 - num_times), [z_node.get_id()]
+            return (MAX_HOPS - num_times), [], [], []
+        if next_node == ID_SPACE:
+            return (MAX_HOPS - num_times), [z_node.get_id()]
 
         leaf_set = z_node.get_leaf_set().copy()
         neighborhood_set = self.get_neighborhood_set().copy()
@@ -562,7 +742,8 @@ class PastryNode(Node):
         # respective nodes.
         leaf_set.append(z_node.get_num())
         neighborhood_set.append(self.get_num())
-        return (32 - num_times), routing_tables, leaf_set, neighborhood_set
+        num_hops = MAX_HOPS - num_times
+        return num_hops, routing_tables, leaf_set, neighborhood_set
 
     def node_update(self, x):
         """Update Routing Table, Leaf Set and Neighborhood Set when a new node
@@ -571,35 +752,47 @@ class PastryNode(Node):
         Arguments:
             x {Integer} -- Hash of the new node that has been added
         """
-        global B
-        # Add into routing table, at all levels where x can be added
-        l = common_prefix(hex_code(x), hex_code(self.get_num()))
-        hash_string = hex_code(x)[2:]
-        for i in range(l):
-            digit = hash_string[i]
-            if self.routing_table[i][int(digit, 16)] == -1:
-                self.routing_table[i][int(digit, 16)] = x
-        # Definitely, add at the maximum level of match
-        digit = hash_string[l]
-        self.routing_table[l][int(digit, 16)] = x
+        # Add into routing table at the maximum level of match, if the entry
+        # is empty or x is nearer. The entries of x in the rows above are the
+        # current node itself
+        l = common_prefix(x, self.get_num())
+        kept = self.__offer_entry(l, digit_at(x, l), x)
 
         # Add into leaf set
-        self.__merge_leaf_set([x])
-
-        # Add into neighborhood set
-        farthest = -1
-        farthest_node = -1
-        for node in self.neighborhood_set:
-            distance = self.network_api.proximity(self.get_num(), node)
-            if distance != -1 and (farthest < distance or farthest == -1):
-                farthest = distance
-                farthest_node = node
-        # Replace the farthest node, if node is nearer and set is large enough
-        if len(self.neighborhood_set) > math.pow(2, B + 1):
-            x_distance = self.network_api.proximity(self.get_num(), x)
-            if x_distance < farthest:
-                self.neighborhood_set.remove(farthest_node)
-        self.neighborhood_set.append(x)
+        evicted = []
+        kept = self.leaf_set.add(x, evicted) or kept
+
+        # Add into neighborhood set, replacing the farthest node if x is nearer
+        # and the set is full
+        x_distance = self.network_api.proximity(self.get_num(), x)
+        kept = self.neighborhood_set.add(x, x_distance, evicted) or kept
+
+        # Index x only if it was kept, and forget the nodes it replaced
+        if kept:
+            self.known_nodes.add(x)
+        self.__forget(evicted)
+
+    def exchange_rows(self):
+        """Periodic routing table maintenance: ask a random entry of each row
+        for its own row of the same level, whose entries are also valid for the
+        current node, and keep any nearer candidates"""
+        global length
+        for row in range(length):
+            entries = [
+                int(node) for node in self.routing_table[row]
+                if node != -1 and node != self.get_num()
+            ]
+            if not entries:
+                continue
+            contact = random.choice(entries)
+            if not self.network_api.is_alive(contact):
+                self.repair_nodes([contact])
+                continue
+            contact_row = self.network_api.get_node(
+                contact).get_routing_table()[row]
+            for col, node in enumerate(contact_row):
+                if self.__offer_entry(row, col, node):
+                    self.known_nodes.add(node)
 
     def join(self):
         """Implementation for expanding multicast search"""
@@ -613,13 +806,138 @@ class PastryNode(Node):
             a_node = (self.network_api.get_node(found_node))
             num_hops, r_t, l_s, n_s = a_node.node_arrival(self.get_num())
             it = self.node_init(r_t, l_s, n_s)
+            # The state received may hold nodes that crashed unnoticed
+            self.heartbeat()
             list_it = list(set(it))
             for node_id in list_it:
+                # Skip the nodes that have failed since they were learnt
+                if not self.network_api.is_alive(node_id):
+                    continue
                 node = (self.network_api.get_node(node_id))
                 node.node_update(self.get_num())
-        print('Added node: ', end='')
-        print(self)
-        print('=============================================================')
+            self.fetch_replicas()
+        if self.verbose:
+            print('Added node: ', end='')
+            print(self)
+            print('=' * 61)
+
+    def depart(self):
+        """Leave the network gracefully: the departure is announced to the
+        nodes of the leaf set, neighborhood set and routing table, which repair
+        their state at once instead of on the query path
+        
+        Returns:
+            Boolean -- True if the node has left the network
+        """
+        notify = set(self.leaf_set) | set(self.neighborhood_set) | set(
+            self.positions)
+        if not self.network_api.remove_node(self.get_num()):
+            return False
+        for node_id in notify:
+            if self.network_api.is_alive(node_id):
+                node = self.network_api.get_node(node_id)
+                node.repair_nodes([self.get_num()])
+        return True
+
+    def heartbeat(self):
+        """Keep-alive pass: probe the nodes of the leaf set, neighborhood set
+        and routing table, and repair the state for all the failed ones at
+        once, off the query path
+        
+        Returns:
+            List -- Hashes of the failed nodes found
+        """
+        members = set(self.leaf_set) | set(self.neighborhood_set) | set(
+            self.positions)
+        failed = [
+            node for node in members if not self.network_api.is_alive(node)
+        ]
+        if failed:
+            self.repair_nodes(failed)
+        return failed
+
+    def begin_trace(self, name, key_hash):
+        """Start tracing a lookup made from the current node, if the network
+        has a tracer and the lookup is sampled
+
+        Arguments:
+            name {String} -- Kind of lookup
+            key_hash {Integer} -- Hash of the key
+
+        Returns:
+            LookupTrace -- None if the lookup is not traced
+        """
+        tracer = self.network_api.tracer
+        if tracer is None:
+            return None
+        return tracer.begin(name, self.get_num(), key_hash)
+
+    def __trace_hop(self, trace, node, next_node):
+        """Close the span of node on trace, forwarding to next_node (-1 if the
+        lookup ends on node)"""
+        proximity = -1
+        if next_node != -1:
+            proximity = self.network_api.proximity(node, next_node)
+        trace.hop(node, next_node, proximity)
+
+    def lookup(self, key_hash, path=None, trace=None):
+        """Route a lookup for key_hash, originated by the current node, to the
+        node numerically closest to it
+        
+        Arguments:
+            key_hash {Integer} -- Hash of the key to be looked up
+
+        Keyword Arguments:
+            path {List} -- If given, the nodes visited are appended to it
+                           (default: {None})
+            trace {LookupTrace} -- If given, a span is recorded for every hop
+                                   and the trace is ended (default: {None})
+        
+        Returns:
+            Integer, Integer -- Node Id of the owner of the key
+                                (-1 if the lookup did not converge), Num hops
+        """
+        self.num_originated += 1
+        return self.forward_lookup(key_hash, path=path, trace=trace)
+
+    def forward_lookup(self, key_hash, path=None, trace=None):
+        """Route a lookup for key_hash from the current node to the node
+        numerically closest to it, without counting it as originated here, as
+        for a lookup handed over by the vectorized engine. Unlike
+        node_arrival, no routing state is collected on the way.
+        
+        Arguments:
+            key_hash {Integer} -- Hash of the key to be looked up
+
+        Keyword Arguments:
+            path {List} -- If given, the nodes visited are appended to it
+                           (default: {None})
+            trace {LookupTrace} -- If given, a span is recorded for every hop
+                                   and the trace is ended (default: {None})
+        
+        Returns:
+            Integer, Integer -- Node Id of the owner of the key
+                                (-1 if the lookup did not converge), Num hops
+        """
+        global ID_SPACE
+        found = ID_SPACE
+        node = self
+        for hops in range(MAX_HOPS):
+            next_node = node.route(key_hash, trace)
+            if next_node == found or next_node == -1:
+                node.num_terminated += 1
+                if trace is not None:
+                    self.__trace_hop(trace, node.get_num(), -1)
+                    trace.end(node.get_num(), hops)
+                return node.get_num(), hops
+            if path is not None:
+                path.append(next_node)
+            if trace is not None:
+                self.__trace_hop(trace, node.get_num(), next_node)
+            node = self.network_api.get_node(next_node)
+        if trace is not None:
+            trace.end(-1, MAX_HOPS)
+        return -1, MAX_HOPS
 
     def search(self, key):
         """Searches the Pastry DHT for the key
@@ -631,12 +949,173 @@ class PastryNode(Node):
             [Integer, Integer] -- Num hops, Node Id of the node if present,
                                   else -1
         """
-        global length
-        name = str(key)
-        m = hashlib.sha1(name.encode('utf-8'))
-        key_hash = m.hexdigest()[:length]
-        r = self.node_arrival(int(key_hash, 16))
-        if len(r) == 2:
-            return r[0], r[1]
-        else:
-            return r[0], -1
+        key_hash = hash_key(key)
+        trace = self.begin_trace('search', key_hash)
+        owner, num_hops = self.lookup(key_hash, trace=trace)
+        if owner == key_hash:
+            return num_hops, self.network_api.get_node(owner).get_id()
+        return num_hops, -1
+
+    def replica_set(self, key_hash):
+        """Find the nodes on which key_hash is to be stored: the replicas
+        nodes numerically closest to the key, among the current node and its
+        leaf set
+        
+        Arguments:
+            key_hash {Integer} -- Hash of the key
+        
+        Returns:
+            List -- Node Ids of the replica set, closest first
+        """
+        candidates = self.leaf_set.closest_k(key_hash, self.replicas)
+        candidates.append(self.get_num())
+        candidates.sort(key=lambda node: circular_abs(node, key_hash))
+        return candidates[:self.replicas]
+
+    def replicate(self, key_hash, val, replica_set=None):
+        """Store copies of the (key, value) pair on the replica set
+        
+        Arguments:
+            key_hash {Integer} -- Hash of the key
+            val {Integer} -- Value
+
+        Keyword Arguments:
+            replica_set {List} -- Node Ids to store on, if already known
+                                  (default: {None})
+        """
+        if replica_set is None:
+            replica_set = self.replica_set(key_hash)
+        for node_id in replica_set:
+            if node_id != self.get_num() and self.network_api.is_alive(
+                    node_id):
+                node = self.network_api.get_node(node_id)
+                node.data_store[key_hash] = val
+
+    def __restore_replicas(self):
+        """Re-create the replicas of the keys for which the current node is
+        now the numerically closest node, after its leaf set has changed"""
+        for key_hash, val in self.data_store.items():
+            replica_set = self.replica_set(key_hash)
+            if replica_set[0] == self.get_num():
+                self.replicate(key_hash, val, replica_set)
+
+    def fetch_replicas(self):
+        """Copy the keys, for which the newly joined node is now a replica,
+        from the nodes in its leaf set"""
+        for node_id in self.leaf_set:
+            node = self.network_api.get_node(node_id)
+            for key_hash, val in node.data_store.items():
+                if key_hash not in self.data_store and (
+                        self.get_num() in self.replica_set(key_hash)):
+                    self.data_store[key_hash] = val
+
+    def put(self, key, val):
+        """Stores the (key, value) pair on the node numerically closest to the
+        key, and replicates it on the closest nodes of its leaf set
+        
+        Arguments:
+            key {Integer} -- Key Value
+            val {Integer} -- Value
+        
+        Returns:
+            Integer -- Returns -1 if key couldn't be stored, else returns 0
+        """
+        key_hash = hash_key(key)
+        trace = self.begin_trace('put', key_hash)
+        owner, num_hops = self.lookup(key_hash, trace=trace)
+        if owner == -1:
+            return -1
+        node = self.network_api.get_node(owner)
+        if key_hash in node.data_store:
+            return -1
+        node.data_store[key_hash] = val
+        node.replicate(key_hash, val)
+        return 0
+
+    def get(self, key):
+        """Fetches the value of key, answered by the first replica met on the
+        route to the numerically closest node
+        
+        Arguments:
+            key {Integer} -- Key to be fetched
+        
+        Returns:
+            Integer, Integer -- Num hops, Value of the key if present, else -1
+        """
+        global ID_SPACE
+        key_hash = hash_key(key)
+        self.num_originated += 1
+        trace = self.begin_trace('get', key_hash)
+        found = ID_SPACE
+        node = self
+        for hops in range(MAX_HOPS):
+            if key_hash in node.data_store:
+                node.num_terminated += 1
+                if trace is not None:
+                    trace.decide('replica')
+                    self.__trace_hop(trace, node.get_num(), -1)
+                    trace.end(node.get_num(), hops)
+                return hops, node.data_store[key_hash]
+            next_node = node.route(key_hash, trace)
+            if next_node == found or next_node == -1:
+                node.num_terminated += 1
+                if trace is not None:
+                    self.__trace_hop(trace, node.get_num(), -1)
+                    trace.end(-1, hops)
+                return hops, -1
+            if trace is not None:
+                self.__trace_hop(trace, node.get_num(), next_node)
+            node = self.network_api.get_node(next_node)
+        if trace is not None:
+            trace.end(-1, MAX_HOPS)
+        return MAX_HOPS, -1
+
+    def key_hash(self, key):
+        """
+        Arguments:
+            key {Integer}
+
+        Returns:
+            Integer -- Hash of key in the identifier space
+        """
+        return hash_key(key)
+
+    def leave(self):
+        """Leave the network gracefully, see depart
+
+        Returns:
+            Boolean -- True if the node has left the network
+        """
+        return self.depart()
+
+    @classmethod
+    def batch_lookup(cls, network, sources, key_hashes):
+        """Route lookups for key_hashes started at sources, all together with
+        the vectorized BatchRouter
+
+        Arguments:
+            network {Network}
+            sources {ndarray} -- Node ids on which the lookups start
+            key_hashes {ndarray} -- Hashes of the keys to be looked up
+
+        Returns:
+            ndarray, ndarray -- Node Id of the owner of each key (-1 if the
+                                lookup did not converge), Num hops of each
+                                lookup
+        """
+        global length, B
+        # pastry_batch imports this module
+        from pastry_batch import BatchRouter
+        sources = np.asarray(sources, dtype=np.int64)
+        router = BatchRouter(network, length, B)
+        routed = np.zeros(len(router.nums), dtype=np.int64)
+        owners, hops, handed_off = router.lookup(sources,
+                                                 key_hashes,
+                                                 routed=routed)
+        add_batch_load(network,
+                       router.nums,
+                       routed,
+                       sources,
+                       owners,
+                       handed_off=handed_off)
+        return owners, hops
@@ -0,0 +1,225 @@
+"""
+Snapshots of a built Chord or Pastry overlay
+Saves a Network, with the state and data store of every ChordNode or
+PastryNode on it, as a directory of NumPy arrays, and loads it back without
+running any join.
+
+Every array is kept in its own .npy file, and memory-mapped when the snapshot
+is loaded. The routing tables are copied straight from the map into the
+blocks of a RoutingTableStore if one is given, and into the lists of each
+node otherwise; the other arrays are read into the Python structures of the
+nodes. Node ids, finger tables and routing tables need to fit in 63 bits,
+and stored keys and values need to be integers.
+"""
+import os
+import json
+import numpy as np
+from chord_node import ChordNode
+from pastry_node import PastryNode
+from modules.network import Network
+
+FORMAT = 1
+
+
+def flatten(lists):
+    """
+    Arguments:
+        lists {List} -- Lists of integers
+
+    Returns:
+        ndarray, ndarray -- Offsets of each list (len(lists) + 1), values
+    """
+    offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(values) for values in lists])
+    values = np.fromiter((value for values in lists for value in values),
+                         dtype=np.int64,
+                         count=offsets[-1])
+    return offsets, values
+
+
+def unflatten(offsets, values):
+    """Inverse of flatten
+
+    Arguments:
+        offsets {ndarray}
+        values {ndarray}
+
+    Returns:
+        List -- Lists of integers
+    """
+    offsets = offsets.tolist()
+    values = values.tolist()
+    return [values[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+
+
+def save_snapshot(directory, network, data_store=None):
+    """Save the overlay built on network
+
+    Arguments:
+        directory {String} -- Directory of the snapshot, created if needed
+        network {Network}
+
+    Keyword Arguments:
+        data_store {Dict} -- Keys and values stored through the experiment
+                             driver, to be saved along (default: {None})
+    """
+    os.makedirs(directory, exist_ok=True)
+    nodes = [network.get_node(num) for num in sorted(network.nodes)]
+    if not nodes:
+        raise ValueError('Cannot save an empty overlay')
+    arrays = {}
+    meta = {
+        'format': FORMAT,
+        'num_switches': network.num_switches,
+        'hash_width': len(nodes[0].hash),
+    }
+
+    # Network: connections between switches, and switch of each node
+    switches = sorted(network.dict)
+    arrays['switches'] = np.array(switches, dtype=np.int64)
+    arrays['adjacency_offsets'], arrays['adjacency'] = flatten(
+        [network.dict[switch] for switch in switches])
+    arrays['ids'] = np.array([node.get_id() for node in nodes],
+                             dtype=np.int64)
+    arrays['nums'] = np.array([node.get_num() for node in nodes],
+                              dtype=np.int64)
+    arrays['node_switches'] = np.array(
+        [network.switch_to_node[node.get_num()] for node in nodes],
+        dtype=np.int64)
+
+    if isinstance(nodes[0], ChordNode):
+        meta['protocol'] = 'chord'
+        meta['m'] = len(nodes[0].finger_table)
+        arrays['fingers'] = np.array(
+            [[entry['node'] for entry in node.finger_table]
+             for node in nodes],
+            dtype=np.int64)
+        arrays['predecessors'] = np.array(
+            [node.get_predecessor() for node in nodes], dtype=np.int64)
+    else:
+        meta['protocol'] = 'pastry'
+        meta['l'] = len(nodes[0].routing_table)
+        meta['b'] = (nodes[0].L - 1).bit_length()
+        meta['replicas'] = nodes[0].replicas
+        if meta['l'] * meta['b'] > 63:
+            raise ValueError('Snapshots support node ids of at most 63 bits')
+        arrays['routing_tables'] = np.array(
+            [[[int(entry) for entry in row] for row in node.routing_table]
+             for node in nodes],
+            dtype=np.int64)
+        arrays['leaf_offsets'], arrays['leaf_sets'] = flatten(
+            [list(node.leaf_set) for node in nodes])
+        neighbors = [list(node.neighborhood_set) for node in nodes]
+        arrays['neighbor_offsets'], arrays['neighbors'] = flatten(neighbors)
+        arrays['neighbor_distances'] = flatten([[
+            node.neighborhood_set.distance(neighbor)
+            for neighbor in node_neighbors
+        ] for node, node_neighbors in zip(nodes, neighbors)])[1]
+        arrays['known_offsets'], arrays['known'] = flatten(
+            [node.known_nodes.nodes for node in nodes])
+
+    # Data stores of the nodes
+    arrays['store_offsets'], arrays['store_keys'] = flatten(
+        [list(node.data_store) for node in nodes])
+    arrays['store_values'] = flatten(
+        [list(node.data_store.values()) for node in nodes])[1]
+    if data_store is not None:
+        arrays['driver_keys'] = np.array(list(data_store), dtype=np.int64)
+        arrays['driver_values'] = np.array(list(data_store.values()),
+                                           dtype=np.int64)
+
+    for name, array in arrays.items():
+        np.save(os.path.join(directory, name + '.npy'), array)
+    with open(os.path.join(directory, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
+
+
+def load_snapshot(directory, store=None, verbose=False):
+    """Load an overlay saved by save_snapshot
+
+    Arguments:
+        directory {String}
+
+    Keyword Arguments:
+        store {RoutingTableStore} -- Shared compact storage for the routing
+                                     tables of Pastry nodes (default: {None})
+        verbose {Boolean} -- Passed on to the nodes (default: {False})
+
+    Returns:
+        Network, Dict -- Network holding all the nodes, keys and values stored
+                         through the experiment driver (None if not saved)
+    """
+    with open(os.path.join(directory, 'meta.json')) as f:
+        meta = json.load(f)
+    if meta['format'] != FORMAT:
+        raise ValueError('Unsupported snapshot format: ' +
+                         str(meta['format']))
+
+    def array(name):
+        path = os.path.join(directory, name + '.npy')
+        if not os.path.exists(path):
+            return None
+        return np.load(path, mmap_mode='r')
+
+    adjacency = unflatten(array('adjacency_offsets'), array('adjacency'))
+    network = Network(meta['num_switches'],
+                      adjacency=dict(
+                          zip(array('switches').tolist(), adjacency)))
+
+    ids = array('ids').tolist()
+    nums = array('nums').tolist()
+    node_switches = array('node_switches').tolist()
+    hash_format = '0' + str(meta['hash_width']) + 'x'
+    stores = unflatten(array('store_offsets'), array('store_keys'))
+    values = array('store_values').tolist()
+
+    if meta['protocol'] == 'chord':
+        fingers = array('fingers').tolist()
+        predecessors = array('predecessors').tolist()
+    else:
+        tables = array('routing_tables')
+        leaf_sets = unflatten(array('leaf_offsets'), array('leaf_sets'))
+        neighbors = unflatten(array('neighbor_offsets'), array('neighbors'))
+        distances = array('neighbor_distances').tolist()
+        known = unflatten(array('known_offsets'), array('known'))
+
+    start = 0
+    neighbor_start = 0
+    for index, num in enumerate(nums):
+        node_hash = format(num, hash_format)
+        if meta['protocol'] == 'chord':
+            node = ChordNode(ids[index],
+                             node_hash,
+                             network,
+                             meta['m'],
+                             verbose=verbose)
+            node.load_state(fingers[index], predecessors[index])
+        else:
+            node = PastryNode(ids[index],
+                              node_hash,
+                              network,
+                              meta['l'],
+                              meta['b'],
+                              store=store,
+                              replicas=meta['replicas'],
+                              verbose=verbose)
+            count = len(neighbors[index])
+            node.load_state(
+                tables[index], leaf_sets[index],
+                list(
+                    zip(neighbors[index],
+                        distances[neighbor_start:neighbor_start + count])),
+                known_nodes=known[index])
+            neighbor_start += count
+        keys = stores[index]
+        node.data_store = dict(zip(keys, values[start:start + len(keys)]))
+        start += len(keys)
+        network.add_node(node, switch=node_switches[index])
+
+    data_store = None
+    driver_keys = array('driver_keys')
+    if driver_keys is not None:
+        data_store = dict(
+            zip(driver_keys.tolist(),
+                array('driver_values').tolist()))
+    return network, data_store
@@ -0,0 +1,72 @@
+"""Equivalence of the vectorized Chord engine with ChordNode.find_successor"""
+import os
+import sys
+import copy
+import random
+import hashlib
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from chord_node import ChordNode
+from modules.network import Network
+
+
+def build_ring(directory, num_nodes, m=24):
+    """Fast-join num_nodes Chord nodes
+
+    Arguments:
+        directory {String} -- Directory in which the links are written
+        num_nodes {Integer}
+
+    Keyword Arguments:
+        m {Integer} -- Bits of the identifier space (default: {24})
+
+    Returns:
+        Network
+    """
+    network = Network(2 * num_nodes,
+                      file_name=os.path.join(directory, 'links.dat'))
+    num_added = 0
+    for i in range(4 * num_nodes):
+        node_hash = hashlib.sha1(str(i).encode('utf-8')).hexdigest()[:m // 4]
+        node = ChordNode(i, node_hash, network, m)
+        if network.add_node(node):
+            node.join(fast=True)
+            num_added += 1
+        if num_added == num_nodes:
+            break
+    return network
+
+
+@pytest.mark.parametrize('crash', [False, True])
+def test_batch_matches_find_successor(tmp_path, crash):
+    random.seed(1)
+    network = build_ring(str(tmp_path), 400)
+    for num in random.sample(sorted(network.nodes), 100):
+        if crash:
+            network.remove_node(num)
+        else:
+            network.get_node(num).depart_network()
+    scalar = copy.deepcopy(network)
+    rng = np.random.default_rng(1)
+    live = sorted(network.nodes)
+    # One lookup at a time, so that both copies make the same repairs
+    for key in rng.integers(0, 1 << 24, 2000).tolist():
+        source = random.choice(live)
+        owners, hops = ChordNode.batch_lookup(network, [source], [key])
+        owner, num_hops, _ = scalar.get_node(source).find_successor(key)
+        assert (int(owners[0]), int(hops[0])) == (owner, num_hops)
+        assert network.is_alive(owner)
+
+
+def test_batch_owners_alive_after_crashes(tmp_path):
+    random.seed(2)
+    network = build_ring(str(tmp_path), 400)
+    for num in random.sample(sorted(network.nodes), 100):
+        network.remove_node(num)
+    rng = np.random.default_rng(2)
+    sources = rng.choice(sorted(network.nodes), 2000)
+    owners, _ = ChordNode.batch_lookup(network, sources,
+                                       rng.integers(0, 1 << 24, 2000))
+    assert all(network.is_alive(owner) for owner in owners.tolist())